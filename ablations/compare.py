@@ -1,23 +1,40 @@
-import json
+import argparse
 import os
+import sys
 import pandas as pd
 
-def compare_results():
-    results = []
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.runs import compare, ingest, RUNS_DB
+
+PATHS = {
+    "Baseline": "results/baseline",
+    "Ablation A1 (High Thresh)": "results/ablation_A1",
+    "Ablation B1 (No Humanize)": "results/ablation_B1"
+}
 
-    paths = {
-        "Baseline": "results/baseline",
-        "Ablation A1 (High Thresh)": "results/ablation_A1",
-        "Ablation B1 (No Humanize)": "results/ablation_B1"
-    }
+def compare_results(run_ids=None, db=RUNS_DB):
+    """
+    Metrics of indexed runs side by side (pipeline/runs.py). Without run ids,
+    the named ablation directories are compared, indexed first if they aren't yet.
+    """
+    if run_ids:
+        names = [f"Run {i}" for i in run_ids]
+    else:
+        names, run_ids = [], []
+        for name, path in PATHS.items():
+            ids = ingest([path], db=db)
+            if ids:
+                names.append(name)
+                run_ids.append(ids[0])
 
-    for name, path in paths.items():
-        metrics_path = os.path.join(path, "metrics.json")
-        if os.path.exists(metrics_path):
-            with open(metrics_path, 'r') as f:
-                m = json.load(f)
-                m['Run'] = name
-                results.append(m)
+    results = []
+    for name, run in zip(names, compare(run_ids, db=db)["runs"]):
+        # The headline metrics (metrics.json), not the per-stage diagnostics
+        m = {k: v for k, v in run["metrics"].items() if "." not in k}
+        m['status'] = run['status']
+        m['Run'] = name
+        m['run_id'] = run['id']
+        results.append(m)
 
     if results:
         df = pd.DataFrame(results)
@@ -28,4 +45,8 @@ def compare_results():
         print("No results found to compare.")
 
 if __name__ == "__main__":
-    compare_results()
+    parser = argparse.ArgumentParser(description="Compare pipeline runs from the results index")
+    parser.add_argument('run_ids', type=int, nargs='*', help='Indexed runs (default: baseline and ablations)')
+    parser.add_argument('--db', default=RUNS_DB)
+    args = parser.parse_args()
+    compare_results(args.run_ids, args.db)
@@ -0,0 +1,209 @@
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pipeline.separate import separate
+from pipeline.transcribe import transcribe_thresholds
+from pipeline.render import render
+from pipeline.metrics import main as calculate_metrics, separation_main
+from pipeline.spectral import set_threads
+from pipeline.utils import file_digest
+from pipeline.runs import record_run, RUNS_DB
+
+# Which grid parameters each stage's output depends on. Variants that agree on
+# a stage's parameters (and its upstream ones) share that stage's result.
+# Separation and transcription are deterministic; the seed only drives render humanization.
+STAGE_PARAMS = {
+    "separation": ["bass_cutoff", "vocals_cutoff"],
+    "transcription": ["threshold", "hop_length"],
+    "render": ["seed", "threshold", "hop_length", "humanize"],
+}
+# Passed to the stages that don't depend on the seed (see STAGE_PARAMS)
+UPSTREAM_SEED = 42
+
+DEFAULT_GRID = {
+    "threshold": [0.6],
+    "humanize": [True],
+    "seed": [42],
+    "bass_cutoff": [200.0],
+    "vocals_cutoff": [4000.0],
+    "hop_length": [512],
+}
+
+def key_of(params):
+    blob = json.dumps(params, sort_keys=True)
+    return hashlib.sha1(blob.encode()).hexdigest()[:10]
+
+def stage_task(kind, variant, input_path, input_hash, root):
+    params = {name: variant[name] for name in STAGE_PARAMS[kind]}
+    return {
+        "kind": kind,
+        "input": input_path,
+        "params": params,
+        # Keyed on the input's content too, so another input never reuses a stage directory
+        "dir": os.path.join(root, kind, key_of(dict(params, input=input_hash))),
+    }
+
+def run_task(task):
+    """Worker entry point: runs one stage for one parameter prefix, unless already done."""
+    marker = os.path.join(task["dir"], "done.json")
+    if os.path.exists(marker):
+        return task["dir"]
+    os.makedirs(task["dir"], exist_ok=True)
+    p = task["params"]
+
+    if task["kind"] == "separation":
+        separate(argparse.Namespace(
+            input=task["input"], outdir=task["dir"], seed=UPSTREAM_SEED,
+            bass_cutoff=p["bass_cutoff"], vocals_cutoff=p["vocals_cutoff"]
+        ))
+        separation_main(argparse.Namespace(
+            ref=task["input"], stems=os.path.join(task["dir"], "stems"),
+            out=os.path.join(task["dir"], "separation_metrics.json")
+        ))
+    elif task["kind"] == "render":
+        render(argparse.Namespace(
+            midi=os.path.join(task["transcription_dir"], "transcription.mid"),
+            out=os.path.join(task["dir"], "rendered.wav"),
+            seed=p["seed"], humanize=p["humanize"]
+        ))
+    elif task["kind"] == "metrics":
+        calculate_metrics(argparse.Namespace(
+            ref=task["input"],
+            hyp=os.path.join(task["render_dir"], "rendered.wav"),
+            midi=os.path.join(task["transcription_dir"], "transcription.mid"),
+            separation=os.path.join(task["separation_dir"], "separation_metrics.json"),
+            out=os.path.join(task["dir"], "metrics.json")
+        ))
+
+    with open(marker, "w") as f:
+        json.dump(p, f, indent=2)
+    return task["dir"]
+
+def run_transcriptions(group):
+    """Worker entry point: every pending threshold of one hop length from a single CQT."""
+    pending = {d: t for d, t in group["thresholds"].items() if not os.path.exists(os.path.join(d, "done.json"))}
+    if not pending:
+        return
+    for d in pending:
+        os.makedirs(d, exist_ok=True)
+    p = group["params"]
+    transcribe_thresholds(
+        argparse.Namespace(input=group["input"], seed=UPSTREAM_SEED, hop_length=p["hop_length"]),
+        list(pending.values()), list(pending)
+    )
+    for d, threshold in pending.items():
+        with open(os.path.join(d, "done.json"), "w") as f:
+            json.dump(dict(p, threshold=threshold), f, indent=2)
+
+def group_transcriptions(tasks):
+    """Thresholds only change note extraction, so tasks differing only in threshold share one CQT."""
+    groups = {}
+    for task in tasks:
+        params = {k: v for k, v in task["params"].items() if k != "threshold"}
+        group = groups.setdefault(key_of(params), {"input": task["input"], "params": params, "thresholds": {}})
+        group["thresholds"][task["dir"]] = task["params"]["threshold"]
+    return list(groups.values())
+
+def run_wave(pool, tasks, transcriptions=()):
+    """Runs a set of independent tasks, each distinct directory once."""
+    unique = {task["dir"]: task for task in tasks}
+    futures = [pool.submit(run_task, task) for task in unique.values()]
+    futures += [pool.submit(run_transcriptions, group) for group in transcriptions]
+    for future in futures:
+        future.result()
+    return len(futures)
+
+def expand_grid(grid):
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+def sweep(input_path, grid, out, jobs=None, db=RUNS_DB):
+    """
+    Runs every combination in `grid` and returns one row of params + metrics per variant.
+    Stages shared by several variants run once; independent stages run in a process pool.
+    """
+    input_path = os.path.abspath(input_path)
+    input_hash = file_digest(input_path)
+    root = os.path.join(out, "cache")
+    variants = expand_grid(grid)
+
+    sep = [stage_task("separation", v, input_path, input_hash, root) for v in variants]
+    trans = [stage_task("transcription", v, input_path, input_hash, root) for v in variants]
+    rend = [stage_task("render", v, input_path, input_hash, root) for v in variants]
+    for r, t in zip(rend, trans):
+        r["transcription_dir"] = t["dir"]
+    metrics = []
+    for v, s, t, r in zip(variants, sep, trans, rend):
+        metrics.append({
+            "kind": "metrics", "input": input_path, "params": v,
+            "dir": os.path.join(out, "variants", key_of(dict(v, input=input_hash))),
+            "separation_dir": s["dir"], "transcription_dir": t["dir"], "render_dir": r["dir"],
+        })
+
+    # Split the cores between workers so their FFT/HPSS threads don't oversubscribe
+    workers = jobs or os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    # Spawned, not forked: forking a caller whose numba/FFT threads are already up can deadlock the workers
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=set_threads, initargs=(threads,)) as pool:
+        # Separation and transcription don't depend on each other
+        counts = {"upstream": run_wave(pool, sep, group_transcriptions(trans))}
+        counts["render"] = run_wave(pool, rend)
+        counts["metrics"] = run_wave(pool, metrics)
+    print(f"[*] {len(variants)} variants: {counts['upstream']} separation/CQT runs, "
+          f"{counts['render']} renders, {counts['metrics']} metric runs")
+
+    rows = []
+    for task in metrics:
+        with open(os.path.join(task["dir"], "metrics.json")) as f:
+            row = dict(task["params"], **json.load(f))
+        row["run_dir"] = task["dir"]
+        # Variant directories are keyed by their params and input, so a re-run finds them already indexed
+        row["run_id"] = record_run(task["dir"], input_path, task["params"], source="sweep", unique=True, db=db)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+def parse_bool(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parameter sweep over the pipeline")
+    parser.add_argument('--input', default="tests/test_piano.wav")
+    parser.add_argument('--out', default="results/sweep")
+    parser.add_argument('--jobs', type=int, default=None, help='Worker processes (default: CPU count)')
+    parser.add_argument('--threshold', type=float, nargs='+', default=DEFAULT_GRID["threshold"])
+    parser.add_argument('--humanize', type=parse_bool, nargs='+', default=DEFAULT_GRID["humanize"])
+    parser.add_argument('--seed', type=int, nargs='+', default=DEFAULT_GRID["seed"])
+    parser.add_argument('--bass-cutoff', type=float, nargs='+', default=DEFAULT_GRID["bass_cutoff"])
+    parser.add_argument('--vocals-cutoff', type=float, nargs='+', default=DEFAULT_GRID["vocals_cutoff"])
+    parser.add_argument('--hop-length', type=int, nargs='+', default=DEFAULT_GRID["hop_length"])
+    args = parser.parse_args()
+
+    grid = {
+        "threshold": args.threshold,
+        "humanize": args.humanize,
+        "seed": args.seed,
+        "bass_cutoff": args.bass_cutoff,
+        "vocals_cutoff": args.vocals_cutoff,
+        "hop_length": args.hop_length,
+    }
+    df = sweep(args.input, grid, args.out, args.jobs)
+    print(df.drop(columns=["run_dir", "run_id"]).to_string(index=False))
+    os.makedirs(args.out, exist_ok=True)
+    df.to_csv(os.path.join(args.out, "sweep.csv"), index=False)
+    # A single-variant sweep doubles as a plain run (what compare.py reads)
+    if len(df) == 1:
+        with open(os.path.join(df["run_dir"][0], "metrics.json")) as f:
+            single = json.load(f)
+        with open(os.path.join(args.out, "metrics.json"), "w") as f:
+            json.dump(single, f)
+    print(f"\nSweep saved to {os.path.join(args.out, 'sweep.csv')}")
@@ -28,8 +28,15 @@ def run_pipeline(args):
     """Run the main pipeline (equivalent to run.sh)"""
     from pipeline.separate import separate
     from pipeline.transcribe import transcribe
-    from pipeline.render import render
-    from pipeline.metrics import main as calculate_metrics
+    from pipeline.render import render, parse_gains
+    from pipeline.metrics import main as calculate_metrics, separation_main as separation_metrics
+    from pipeline.scheduler import Stage, run_stages
+    from pipeline.utils import audio_path
+    from pipeline.backends import model_files
+    from pipeline.spectral import set_threads, set_precision
+    from pipeline.runs import record_run
+    from pipeline.profiler import SamplingProfiler, print_report
+    from contextlib import nullcontext
     import json
     
     print("[*] Starting Blahblah Pipeline...")
@@ -39,10 +46,20 @@ def run_pipeline(args):
     
     # Create output directory
     os.makedirs(args.output, exist_ok=True)
+    if args.threads:
+        set_threads(args.threads)
+    precision = args.precision or os.environ.get("PIPELINE_PRECISION", "float32")
+    set_precision(precision)
+    try:
+        stem_gains = parse_gains(args.stem_gain)
+    except ValueError as e:
+        print(f"[!] --stem-gain: {e}")
+        return False
     
     # Save environment info
     env_info = {
         "seed": args.seed,
+        "precision": precision,
         "python_version": f"{sys.version_info.major}.{sys.version_info.minor}.{sys.version_info.micro}",
         "executable": sys.executable
     }
@@ -50,52 +67,140 @@ def run_pipeline(args):
     with open(os.path.join(args.output, "env.json"), "w") as f:
         json.dump(env_info, f, indent=2)
     
-    try:
+    def stage(label, func, stage_args):
+        def run():
+            print(f"[*] {label}...")
+            func(stage_args)
+        return run
+
+    out = lambda name: os.path.join(args.output, name)
+    # The npz bundle only applies to stems; renders stay single files
+    render_format = "wav" if args.format == "npz" else args.format
+    rendered = audio_path(out("rendered"), render_format)
+
+    # Stages declare what they read and write; transcription doesn't wait for
+    # separation, and the separation metric doesn't wait for rendering.
+    stages = [
         # 0. Track S: Source Separation
-        print("[*] Track S: Separating Stems...")
-        separate_args = argparse.Namespace(
+        Stage("separate", stage("Track S: Separating Stems", separate, argparse.Namespace(
             input=args.input,
             outdir=args.output,
-            seed=args.seed
-        )
-        separate(separate_args)
-        
+            seed=args.seed,
+            format=args.format
+        )), inputs=[args.input], outputs=[out("separation_diagnostics.json")],
+            params={"seed": args.seed, "format": args.format, "precision": precision},
+            diagnostics=out("separation_diagnostics.json")),
+
         # 1. Track A: WAV -> MIDI (Transcribe)
-        print("[*] Track A: Transcribing...")
-        transcribe_args = argparse.Namespace(
+        Stage("transcribe", stage("Track A: Transcribing", transcribe, argparse.Namespace(
             input=args.input,
             outdir=args.output,
             threshold=args.threshold,
-            seed=args.seed
-        )
-        transcribe(transcribe_args)
-        
+            seed=args.seed,
+            sparse=args.sparse,
+            quality=args.quality,
+            max_polyphony=args.max_polyphony,
+            stems=out("stems") if args.multitrack else None
+        )), inputs=[args.input] + model_files() + ([out("separation_diagnostics.json")] if args.multitrack else []),
+            outputs=[out("transcription.mid"), out("transcription_diagnostics.json")],
+            params={"threshold": args.threshold, "seed": args.seed, "sparse": args.sparse, "quality": args.quality,
+                    "max_polyphony": args.max_polyphony, "precision": precision, "multitrack": args.multitrack},
+            diagnostics=out("transcription_diagnostics.json")),
+
         # 2. Track B: MIDI -> WAV (Render)
-        print("[*] Track B: Rendering...")
-        render_args = argparse.Namespace(
-            midi=os.path.join(args.output, "transcription.mid"),
-            out=os.path.join(args.output, "rendered.wav"),
+        Stage("render", stage("Track B: Rendering", render, argparse.Namespace(
+            midi=out("transcription.mid"),
+            out=rendered,
             seed=args.seed,
-            humanize=args.humanize
-        )
-        render(render_args)
-        
+            humanize=args.humanize,
+            format=render_format,
+            segments=args.render_segments,
+            gains=stem_gains
+        )), inputs=[out("transcription.mid")], outputs=[rendered],
+            params={"seed": args.seed, "humanize": args.humanize, "format": render_format,
+                    "segments": args.render_segments, "precision": precision, "gains": stem_gains}),
+
         # 3. Evaluation
-        print("[*] Calculating Metrics...")
-        metrics_args = argparse.Namespace(
+        Stage("separation_metrics", stage("Scoring Separation", separation_metrics, argparse.Namespace(
             ref=args.input,
-            hyp=os.path.join(args.output, "rendered.wav"),
-            midi=os.path.join(args.output, "transcription.mid"),
-            out=os.path.join(args.output, "metrics.json")
-        )
-        from pipeline.metrics import main as calculate_metrics
-        calculate_metrics(metrics_args)
-        
-        print(f"[*] Pipeline Complete. Check {args.output}/metrics.json")
+            stems=out("stems"),
+            out=out("separation_metrics.json"),
+            ref_stems=args.ref_stems,
+            bss_window=args.bss_window
+        )), inputs=[args.input, out("separation_diagnostics.json")], outputs=[out("separation_metrics.json")],
+            params={"ref_stems": args.ref_stems, "bss_window": args.bss_window}),
+
+        Stage("metrics", stage("Calculating Metrics", calculate_metrics, argparse.Namespace(
+            ref=args.input,
+            hyp=rendered,
+            midi=out("transcription.mid"),
+            separation=out("separation_metrics.json"),
+            out=out("metrics.json")
+        )), inputs=[args.input, rendered, out("transcription.mid"), out("separation_metrics.json")],
+            outputs=[out("metrics.json")]),
+    ]
+
+    profiler = SamplingProfiler(args.profile_interval) if args.profile else None
+    if profiler:
+        # Samples from each stage's thread are attributed to that stage
+        for s in stages:
+            s.func = profiler.wrap(s.name, s.func)
+    with profiler or nullcontext():
+        report = run_stages(stages, args.output, max_workers=args.jobs, force=args.force)
+    if profiler:
+        paths, profile = profiler.write(args.output)
+        print_report(profile)
+        print(f"[*] Flamegraph: {paths['flamegraph']} (collapsed stacks: {paths['folded']})")
+    with open(out("schedule.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"[*] Critical path: {' -> '.join(report['critical_path'])} "
+          f"({report['critical_path_s']:.2f}s of {report['serial_s']:.2f}s serial, {report['wall_s']:.2f}s wall)")
+
+    # Every run, failed ones included, goes into the results index (pipeline/runs.py)
+    try:
+        run_id = record_run(args.output, args.input, params={
+            "threshold": args.threshold, "seed": args.seed, "sparse": args.sparse, "quality": args.quality,
+            "humanize": args.humanize,
+            "format": args.format, "render_segments": args.render_segments, "max_polyphony": args.max_polyphony,
+            "precision": precision, "multitrack": args.multitrack, "stem_gains": stem_gains,
+            "ref_stems": args.ref_stems, "bss_window": args.bss_window})
+        print(f"[*] Indexed as run {run_id}")
+    except Exception as e:
+        print(f"[!] Could not index the run: {e}")
+
+    if report["failed"]:
+        failure = report["stages"][report["failed"]]
+        print(f"[!] Pipeline failed in {report['failed']}: {failure['error']}")
+        print(failure["details"])
+        return False
+
+    for name in report["abstained"]:
+        print(f"[*] {name} abstained ({report['stages'][name]['reason']}); the stages after it were skipped")
+    summary = "metrics.json" if os.path.exists(out("metrics.json")) else "schedule.json"
+    print(f"[*] Pipeline Complete. Check {os.path.join(args.output, summary)}")
+    return True
+
+def run_live(args):
+    """Replay --input (or listen on --listen) through the live transcriber"""
+    from pipeline.live import live
+    
+    print("[*] Live Mode: streaming transcription")
+    live_args = argparse.Namespace(
+        input=args.input,
+        listen=args.listen,
+        outdir=args.output,
+        threshold=args.threshold,
+        silence_db=-60.0,
+        realtime=True,
+        midi_port=args.midi_port
+    )
+    try:
+        live(live_args)
+        print(f"[*] Live session complete. Check {args.output}/live_diagnostics.json")
         return True
-        
     except Exception as e:
-        print(f"[!] Pipeline failed: {e}")
+        print(f"[!] Live transcription failed: {e}")
         import traceback
         traceback.print_exc()
         return False
@@ -136,6 +241,9 @@ Examples:
   # CLI Mode - With custom parameters
   blahblah.exe --input input.wav --output results/ --threshold 0.7 --humanize --seed 123
   
+  # Live Mode - Replay a file at real time and drive a synth
+  blahblah.exe --live --input input.wav --midi-port "FluidSynth"
+  
   # Web Mode - Start web interface
   blahblah.exe --web
   
@@ -149,7 +257,38 @@ Examples:
     parser.add_argument('--output', type=str, default='results', help='Output directory (default: results)')
     parser.add_argument('--threshold', type=float, default=0.6, help='Transcription threshold (0.0-1.0, default: 0.6)')
     parser.add_argument('--humanize', action='store_true', help='Enable humanization for rendering')
+    parser.add_argument('--sparse', action='store_true', help='Skip silent regions during transcription')
+    parser.add_argument('--quality', type=float, default=1.0,
+                        help='Transcription quality (0.0-1.0); below 1.0 a coarse pass picks the regions analyzed '
+                             'at full resolution (default: 1.0)')
+    parser.add_argument('--max-polyphony', type=int, default=20,
+                        help='Strongest pitches kept per frame in transcription (0: all, default: 20)')
+    parser.add_argument('--format', choices=['wav', 'wav32', 'flac', 'opus', 'npz'], default='wav',
+                        help='Encoding for stems and render (npz bundles stems; default: wav)')
     parser.add_argument('--seed', type=int, default=42, help='Random seed for reproducibility (default: 42)')
+    parser.add_argument('--render-segments', type=int, default=1,
+                        help='Render this many time segments of the MIDI in parallel (default: 1)')
+    parser.add_argument('--multitrack', action='store_true',
+                        help='Transcribe each separated stem to its own instrument (drums on channel 10)')
+    parser.add_argument('--stem-gain', action='append', metavar='NAME=DB',
+                        help='Render gain of one stem/instrument in dB, e.g. drums=-3 or vocals=-inf. Repeatable')
+    parser.add_argument('--ref-stems', type=str, help='Ground-truth stems for per-stem separation SDR')
+    parser.add_argument('--bss-window', type=float, nargs='?', const=1.0, metavar='SECONDS',
+                        help='With --ref-stems, also per-stem BSS SDR/SIR/SAR over windows of this length (default: 1.0)')
+    parser.add_argument('--jobs', type=int, default=None, help='Stages to run concurrently (default: all independent ones)')
+    parser.add_argument('--force', action='store_true', help='Re-run stages even if their outputs are up to date')
+    parser.add_argument('--profile', action='store_true',
+                        help='Sample the run and write profile.{folded,svg,json} to the output directory')
+    parser.add_argument('--profile-interval', type=float, default=0.01, help='Seconds between profile samples')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='FFT/HPSS threads per process (default: $PIPELINE_THREADS or all cores)')
+    parser.add_argument('--precision', choices=['float32', 'float64'], default=None,
+                        help='DSP working precision (default: $PIPELINE_PRECISION or float32)')
+    
+    # Live Mode arguments
+    parser.add_argument('--live', action='store_true', help='Transcribe in real time (replays --input, or use --listen)')
+    parser.add_argument('--listen', type=str, help='host:port streaming float32 mono PCM at 22050 Hz (live mode)')
+    parser.add_argument('--midi-port', type=str, help='MIDI output port for live note events')
     
     # Web Mode arguments
     parser.add_argument('--web', action='store_true', help='Start web interface')
@@ -174,6 +313,10 @@ Examples:
         
         run_web_server(args.port)
         
+    elif args.live and (args.input or args.listen):
+        success = run_live(args)
+        sys.exit(0 if success else 1)
+        
     elif args.input:
         # CLI mode
         print("[*] CLI Mode: Running pipeline")
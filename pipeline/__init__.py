@@ -0,0 +1,29 @@
+import importlib
+import importlib.abc
+import importlib.util
+import os
+import sys
+
+# Pipeline modules import each other by bare name (`from spectral import ...`,
+# with pipeline/ on sys.path) so each also runs as a script, while main.py, the
+# web app and the tests import pipeline.X. Both names have to give one module,
+# or process-wide settings (precision, FFT threads) and caches would be split
+# between two copies: pipeline.X is made an alias of the bare module.
+PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+if PIPELINE_DIR not in sys.path:
+    sys.path.append(PIPELINE_DIR)
+
+class _BareModuleAlias(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, name, path=None, target=None):
+        package, _, module = name.rpartition(".")
+        if package == __name__ and os.path.exists(os.path.join(PIPELINE_DIR, module + ".py")):
+            return importlib.util.spec_from_loader(name, self)
+        return None
+
+    def create_module(self, spec):
+        return importlib.import_module(spec.name.rpartition(".")[2])
+
+    def exec_module(self, module):
+        pass
+
+sys.meta_path.insert(0, _BareModuleAlias())
@@ -0,0 +1,160 @@
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Ensure pipeline directory is in path for imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import spectral
+
+# Transcription model backends. A backend turns the normalized CQT into a note
+# activation map that transcribe.py thresholds; `model/config.json` picks one by
+# "model_type". Backends are loaded once per process.
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "model")
+MODEL_CONFIG = os.path.join(MODEL_DIR, "config.json")
+# How torch backends run, next to the model config: {"mode": "float" | "torchscript" | "int8", ...}
+INFERENCE_CONFIG = "inference.json"
+
+class HeuristicBackend:
+    """The original thresholding: the activation is the normalized CQT itself (dB)."""
+
+    output = "db"
+
+    def __init__(self, config, inference=None):
+        self.config = config
+        self.warnings = []
+
+    def activation(self, cqt_norm):
+        return cqt_norm
+
+class TorchBackend:
+    """
+    Frame-wise CNN (pipeline/cnn.py) on CPU. The CQT is cut into windows of
+    `window_frames` that run `batch_size` at a time on `threads` intra-op threads
+    (0: the pipeline's thread budget, see spectral.set_threads).
+    The activation is a per-bin, per-frame probability.
+
+    The inference config picks how the model runs: "float" (eager), "torchscript"
+    (traced and frozen) or "int8" (statically quantized on `calibration_windows`
+    synthetic windows for `engine`, then traced).
+    """
+
+    output = "probability"
+
+    def __init__(self, config, inference=None):
+        import torch
+        from cnn import FrameCNN, WindowedPredictor, calibration_windows, compile_model, quantize, INFERENCE_MODES
+
+        self.config = config
+        self.inference = inference or {}
+        self.warnings = []
+        self.window_frames = config.get("window_frames", 256)
+        self.batch_size = config.get("batch_size", 16)
+        self.threads = config.get("threads", 0)
+        n_bins = config.get("n_bins", 84)
+        with torch.random.fork_rng():
+            # Untrained models start from the same weights every run
+            torch.manual_seed(config.get("init_seed", 0))
+            model = FrameCNN(config.get("channels", 16), config.get("layers", 3))
+        weights = config.get("weights")
+        if weights:
+            state = torch.load(os.path.join(MODEL_DIR, weights), map_location="cpu")
+            model.load_state_dict(state)
+        else:
+            self.warnings.append("No model weights configured; transcribing with an untrained model")
+        model.eval()
+
+        self.mode = self.inference.get("mode", "float")
+        if self.mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode '{self.mode}'; expected one of {list(INFERENCE_MODES)}")
+        if self.mode == "int8":
+            calibration = calibration_windows(self.inference.get("calibration_windows", 64), n_bins,
+                                              self.window_frames, self.inference.get("calibration_seed", 0))
+            model = quantize(model, calibration, self.inference.get("engine", "x86"))
+        if self.mode != "float":
+            model = compile_model(model, n_bins, self.window_frames, self.batch_size)
+        self.predictor = WindowedPredictor(model, n_bins, self.window_frames, self.batch_size)
+
+    def activation(self, cqt_norm):
+        import torch
+
+        torch.set_num_threads(self.threads or spectral.THREADS)
+        return self.predictor(cqt_norm.astype(np.float32, copy=False))
+
+BACKENDS = {
+    "simulated_neural": HeuristicBackend,
+    "onset_frame_cnn": TorchBackend,
+}
+
+def read_config(path=MODEL_CONFIG):
+    if not os.path.exists(path):
+        return {"model_type": "simulated_neural"}
+    with open(path) as f:
+        return json.load(f)
+
+def read_inference_config(path=MODEL_CONFIG):
+    """inference.json next to the model config, if there is one."""
+    inference_path = os.path.join(os.path.dirname(os.path.abspath(path)), INFERENCE_CONFIG)
+    if not os.path.exists(inference_path):
+        return {}
+    with open(inference_path) as f:
+        return json.load(f)
+
+def model_files(path=MODEL_CONFIG):
+    """Files the backend `path` selects is built from: its config, inference config and weights."""
+    files = [path, os.path.join(os.path.dirname(os.path.abspath(path)), INFERENCE_CONFIG)]
+    weights = read_config(path).get("weights")
+    if weights:
+        files.append(os.path.join(MODEL_DIR, weights))
+    return files
+
+@functools.lru_cache(maxsize=None)
+def load_backend(path=MODEL_CONFIG):
+    """The backend `path` selects, built on first use and shared after that."""
+    config = read_config(path)
+    model_type = config.get("model_type", "simulated_neural")
+    if model_type not in BACKENDS:
+        raise ValueError(f"Unknown model_type '{model_type}' in {path}; expected one of {sorted(BACKENDS)}")
+    return BACKENDS[model_type](config, read_inference_config(path))
+
+def benchmark(path, config=MODEL_CONFIG, repeat=3):
+    """Seconds per second of audio from CQT to notes, with the configured backend and with the heuristic."""
+    import librosa
+    from spectral import amplitude_db
+    from transcribe import load_input, note_activation, extract_notes, N_BINS, FMIN_NOTE, HOP_LENGTH
+
+    y, sr = load_input(path)
+    cqt = np.abs(librosa.cqt(y, sr=sr, hop_length=HOP_LENGTH, fmin=librosa.note_to_hz(FMIN_NOTE), n_bins=N_BINS))
+    cqt_norm = amplitude_db(cqt)
+    duration = len(y) / sr
+
+    def best(backend):
+        note_activation(backend, cqt_norm[:, :64])  # warm-up
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extract_notes(note_activation(backend, cqt_norm), [0.6], HOP_LENGTH / sr)
+            times.append(time.perf_counter() - start)
+        return min(times) / duration
+
+    backend = load_backend(config)
+    return {
+        "model_type": backend.config.get("model_type", "simulated_neural"),
+        "duration_s": duration,
+        "model_s_per_audio_s": best(backend),
+        "heuristic_s_per_audio_s": best(HeuristicBackend({})),
+        "threads": backend.threads if getattr(backend, "threads", 0) else spectral.THREADS
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the configured transcription backend")
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--config', default=MODEL_CONFIG)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    for key, value in benchmark(args.input, args.config, args.repeat).items():
+        print(f"{key:>24}: {value:.4g}" if isinstance(value, float) else f"{key:>24}: {value}")
@@ -0,0 +1,119 @@
+import copy
+import threading
+import warnings
+import numpy as np
+import torch
+from torch import nn
+from torch.ao import quantization
+
+# Small frame-wise note CNN over the normalized CQT: each output is the
+# probability that a pitch bin is sounding in a frame. Only 3x3 convolutions,
+# so every output sees RECEPTIVE_HALO frames either side; windows are cut with
+# that much overlap and stitched back exactly.
+CHANNELS = 16
+N_LAYERS = 3
+RECEPTIVE_HALO = N_LAYERS
+DB_FLOOR = -80.0 # amplitude_to_db's top_db: inputs are scaled from [-80, 0] dB to [0, 1]
+INFERENCE_MODES = ("float", "torchscript", "int8")
+
+class FrameCNN(nn.Module):
+    def __init__(self, channels=CHANNELS, n_layers=N_LAYERS):
+        super().__init__()
+        layers = []
+        in_channels = 1
+        for _ in range(n_layers):
+            layers += [nn.Conv2d(in_channels, channels, 3, padding=1), nn.ReLU()]
+            in_channels = channels
+        self.body = nn.Sequential(*layers)
+        self.head = nn.Conv2d(channels, 1, 1)
+        # Identity until the model is quantized (see quantize())
+        self.quant = quantization.QuantStub()
+        self.dequant = quantization.DeQuantStub()
+
+    def forward(self, x):
+        # (batch, 1, bins, frames) scaled dB -> (batch, bins, frames) probabilities
+        return torch.sigmoid(self.dequant(self.head(self.body(self.quant(x))))).squeeze(1)
+
+def windows(cqt_norm, window_frames, halo=RECEPTIVE_HALO):
+    """(n_windows, bins, window_frames + 2 * halo) overlapping windows; edges padded with silence."""
+    n_frames = cqt_norm.shape[1]
+    n_windows = max(1, -(-n_frames // window_frames))
+    padded = np.full((cqt_norm.shape[0], n_windows * window_frames + 2 * halo), DB_FLOOR, dtype=np.float32)
+    padded[:, halo:halo + n_frames] = cqt_norm
+    view = np.lib.stride_tricks.sliding_window_view(padded, window_frames + 2 * halo, axis=1)
+    return view[:, ::window_frames].transpose(1, 0, 2)
+
+def calibration_windows(n_windows, n_bins, window_frames, seed=0):
+    """Fixed synthetic CQT windows (dB spread like a normalized CQT) to calibrate int8 activation ranges on."""
+    rng = np.random.RandomState(seed)
+    size = (n_windows, n_bins, window_frames + 2 * RECEPTIVE_HALO)
+    return np.clip(rng.normal(-40, 20, size), DB_FLOOR, 0).astype(np.float32)
+
+def quantize(model, calibration, engine="x86"):
+    """
+    Static int8 copy of the model: conv+ReLU pairs fused, activation ranges
+    observed on `calibration` windows. (Dynamic quantization only covers
+    Linear/RNN layers, which this model has none of.)
+    """
+    torch.backends.quantized.engine = engine
+    qmodel = copy.deepcopy(model).eval()
+    pairs = [[str(i), str(i + 1)] for i in range(0, len(qmodel.body), 2)]
+    quantization.fuse_modules(qmodel.body, pairs, inplace=True)
+    qmodel.qconfig = quantization.get_default_qconfig(engine)
+    quantization.prepare(qmodel, inplace=True)
+    with torch.inference_mode():
+        for tile in calibration:
+            qmodel(scale(torch.from_numpy(np.ascontiguousarray(tile))[None, None]))
+    return quantization.convert(qmodel, inplace=True)
+
+def compile_model(model, n_bins, window_frames, batch_size):
+    """TorchScript trace of the model at the fixed batch shape WindowedPredictor feeds it, frozen."""
+    example = torch.zeros(batch_size, 1, n_bins, window_frames + 2 * RECEPTIVE_HALO)
+    with torch.inference_mode(), warnings.catch_warnings():
+        # Deprecated in favour of torch.export on newer torch; the pinned 2.0 has no replacement
+        warnings.simplefilter("ignore", FutureWarning)
+        traced = torch.jit.trace(model.eval(), example)
+        return torch.jit.freeze(traced)
+
+def scale(batch):
+    return (batch - DB_FLOOR) / -DB_FLOOR
+
+class WindowedPredictor:
+    """
+    Runs a model over a CQT in batches of overlapping windows. The input batch is
+    allocated once per thread and reused; a short last batch runs on the front of it.
+    Predictors live in the shared, cached backends, so concurrent jobs each get
+    their own buffer to fill and scale in place.
+    """
+
+    def __init__(self, model, n_bins, window_frames=256, batch_size=16):
+        self.model = model
+        self.window_frames = window_frames
+        self.batch_shape = (batch_size, 1, n_bins, window_frames + 2 * RECEPTIVE_HALO)
+        self._local = threading.local()
+
+    @property
+    def batch(self):
+        """This thread's input buffer."""
+        if not hasattr(self._local, "batch"):
+            self._local.batch = torch.empty(self.batch_shape)
+        return self._local.batch
+
+    def __call__(self, cqt_norm):
+        n_bins, n_frames = cqt_norm.shape
+        halo, frames, batch_size = RECEPTIVE_HALO, self.window_frames, self.batch_shape[0]
+        tiles = windows(cqt_norm, frames)
+        out = np.empty((n_bins, len(tiles) * frames), dtype=np.float32)
+        buffer = self.batch
+        with torch.inference_mode():
+            for i in range(0, len(tiles), batch_size):
+                n = min(batch_size, len(tiles) - i)
+                batch = buffer[:n]
+                batch[:, 0].numpy()[:] = tiles[i:i + n]
+                probs = self.model(batch.sub_(DB_FLOOR).div_(-DB_FLOOR))[:, :, halo:halo + frames]
+                out[:, i * frames:(i + n) * frames] = probs.permute(1, 0, 2).reshape(n_bins, -1).numpy()
+        return out[:, :n_frames]
+
+def predict(model, cqt_norm, window_frames=256, batch_size=16):
+    """Frame probabilities for a whole (bins, frames) CQT, in batches of windows."""
+    return WindowedPredictor(model, cqt_norm.shape[0], window_frames, batch_size)(cqt_norm)
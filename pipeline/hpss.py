@@ -0,0 +1,161 @@
+import argparse
+import os
+import sys
+import threading
+import time
+import librosa
+import numba
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from spectral import stft, istft, NUMBA_THREADING_LAYER
+
+# Harmonic-percussive separation with the same result as librosa.effects.hpss
+# (kernel 31, power 2, margin 1), but with the two 2-D median filters replaced
+# by a running median over each row, compiled and run across rows in parallel.
+KERNEL_SIZE = 31
+TILE_FRAMES = 2048
+
+# numba's on-disk cache records the module name, so only the `hpss` import used by
+# the pipeline scripts (pipeline/ on sys.path) reads and writes it; any other import
+# name compiles in-process instead of loading a build that refers to the wrong module.
+# (pipeline.hpss is the same module; see pipeline/__init__.py.)
+CACHE = __name__ == "hpss"
+
+# The workqueue layer (see spectral.NUMBA_THREADING_LAYER) takes one launch at a
+# time, so concurrent ones are serialized; each already spreads its rows over every core.
+numba.config.THREADING_LAYER = NUMBA_THREADING_LAYER
+_LAUNCH = threading.Lock()
+
+@numba.njit(parallel=True, cache=CACHE)
+def _median_rows(X, size, out):
+    """Sliding median along each row; the window is kept sorted and updated one sample per step."""
+    n = X.shape[1]
+    half = size // 2
+
+    def reflect(i):
+        # scipy.ndimage 'reflect' boundary: d c b a | a b c d | d c b a
+        i = i % (2 * n)
+        return i if i < n else 2 * n - 1 - i
+
+    for r in numba.prange(X.shape[0]):
+        x = X[r]
+        window = np.empty(size, dtype=X.dtype)
+        for j in range(size):
+            window[j] = x[reflect(j - half)]
+        window.sort()
+        out[r, 0] = window[half]
+        for i in range(1, n):
+            old = x[reflect(i - half - 1)]
+            new = x[reflect(i + half)]
+            if old != new:
+                # Overwrite the outgoing value and shift the new one into place
+                pos = np.searchsorted(window, old)
+                while pos > 0 and window[pos - 1] > new:
+                    window[pos] = window[pos - 1]
+                    pos -= 1
+                while pos < size - 1 and window[pos + 1] < new:
+                    window[pos] = window[pos + 1]
+                    pos += 1
+                window[pos] = new
+            out[r, i] = window[half]
+
+@numba.njit(parallel=True, cache=CACHE)
+def _apply_masks(S, mag, harm, perc, margin_harm, margin_perc, split_zeros, out_harm, out_perc):
+    # librosa.util.softmask at power 2, for both masks in one pass
+    tiny = np.finfo(mag.dtype).tiny
+    for f in numba.prange(S.shape[0]):
+        for t in range(S.shape[1]):
+            h = harm[f, t]
+            p = perc[f, t]
+            mh = 0.0
+            mp = 0.0
+            z = max(h, p * margin_harm)
+            if z < tiny:
+                mh = 0.5 if split_zeros else 0.0
+            else:
+                a = (h / z) ** 2
+                b = (p * margin_harm / z) ** 2
+                mh = a / (a + b)
+            z = max(p, h * margin_perc)
+            if z < tiny:
+                mp = 0.5 if split_zeros else 0.0
+            else:
+                a = (p / z) ** 2
+                b = (h * margin_perc / z) ** 2
+                mp = a / (a + b)
+            out_harm[f, t] = S[f, t] * mh
+            out_perc[f, t] = S[f, t] * mp
+
+def median_filter_rows(X, size=KERNEL_SIZE):
+    """Median over a window of `size` along the last axis, 'reflect' at the edges."""
+    X = np.ascontiguousarray(X)
+    out = np.empty_like(X)
+    with _LAUNCH:
+        _median_rows(X, size, out)
+    return out
+
+def hpss(S, kernel_size=KERNEL_SIZE, margin=1.0, tile_frames=TILE_FRAMES):
+    """
+    Splits a complex STFT into harmonic and percussive parts, like librosa.decompose.hpss.
+    Frames are processed in tiles (with enough context for the time-direction median)
+    so the temporaries stay cache-sized on long tracks.
+    """
+    margin_harm, margin_perc = margin if isinstance(margin, (tuple, list)) else (margin, margin)
+    win_harm, win_perc = kernel_size if isinstance(kernel_size, (tuple, list)) else (kernel_size, kernel_size)
+    split_zeros = margin_harm == 1 and margin_perc == 1
+
+    mag = np.abs(S)
+    H = np.empty_like(S)
+    P = np.empty_like(S)
+    n_frames = S.shape[1]
+    halo = win_harm // 2
+    for t0 in range(0, n_frames, tile_frames or n_frames):
+        t1 = min(n_frames, t0 + (tile_frames or n_frames))
+        # Context frames for the harmonic (time) median; the real edges reflect as in librosa
+        c0, c1 = max(0, t0 - halo), min(n_frames, t1 + halo)
+        harm = median_filter_rows(mag[:, c0:c1], win_harm)[:, t0 - c0:t1 - c0]
+        perc = median_filter_rows(mag[:, t0:t1].T, win_perc).T
+        with _LAUNCH:
+            _apply_masks(S[:, t0:t1], mag[:, t0:t1], np.ascontiguousarray(harm), np.ascontiguousarray(perc),
+                         margin_harm, margin_perc, split_zeros, H[:, t0:t1], P[:, t0:t1])
+    return H, P
+
+def hpss_audio(y, n_fft=2048, hop_length=512, kernel_size=KERNEL_SIZE, margin=1.0):
+    """Drop-in for librosa.effects.hpss: returns (harmonic, percussive) signals."""
+    S = stft(y, n_fft=n_fft, hop_length=hop_length)
+    H, P = hpss(S, kernel_size=kernel_size, margin=margin)
+    harmonic, percussive = istft(np.stack([H, P]), hop_length=hop_length, length=len(y))
+    return harmonic, percussive
+
+def benchmark(path, repeat=3):
+    """Times hpss_audio against librosa.effects.hpss on one file; returns timings and max deviation."""
+    y, sr = librosa.load(path, sr=22050)
+    hpss_audio(y[:sr])  # compile (or load the cached build) outside the timing
+
+    def best(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func(y)
+            times.append(time.perf_counter() - start)
+        return min(times), result
+
+    t_ref, (h_ref, p_ref) = best(librosa.effects.hpss)
+    t_new, (h_new, p_new) = best(hpss_audio)
+    return {
+        "duration_s": len(y) / sr,
+        "librosa_s": t_ref,
+        "engine_s": t_new,
+        "speedup": t_ref / t_new,
+        "max_abs_diff": float(max(np.max(np.abs(h_ref - h_new)), np.max(np.abs(p_ref - p_new)))),
+        "threads": numba.get_num_threads()
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the HPSS engine against librosa")
+    parser.add_argument('--input', required=True)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    for key, value in benchmark(args.input, args.repeat).items():
+        print(f"{key:>14}: {value:.4g}" if isinstance(value, float) else f"{key:>14}: {value}")
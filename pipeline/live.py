@@ -0,0 +1,262 @@
+import argparse
+import os
+import socket
+import sys
+import time
+import librosa
+import mido
+import numpy as np
+import soundfile as sf
+import soxr
+
+# Ensure pipeline directory is in path for imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from utils import save_diagnostics
+from transcribe import (
+    HOP_LENGTH, N_BINS, FMIN_NOTE, FLATNESS_WARN, FLATNESS_ABSTAIN,
+    MIN_NOTE_DURATION, threshold_to_db, select_bins
+)
+
+FLATNESS_FFT = 2048
+WARMUP_SECONDS = 1.0
+
+class RingBuffer:
+    """Fixed-size circular sample buffer."""
+
+    def __init__(self, size):
+        self.data = np.zeros(size, dtype=np.float32)
+        self.pos = 0
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32)[-len(self.data):]
+        end = self.pos + len(samples)
+        if end <= len(self.data):
+            self.data[self.pos:end] = samples
+        else:
+            split = len(self.data) - self.pos
+            self.data[self.pos:] = samples[:split]
+            self.data[:end - len(self.data)] = samples[split:]
+        self.pos = end % len(self.data)
+
+    def latest(self, n):
+        """The newest n samples, oldest first."""
+        start = (self.pos - n) % len(self.data)
+        if start < self.pos:
+            return self.data[start:self.pos]
+        return np.concatenate([self.data[start:], self.data[:self.pos]])
+
+class LiveTranscriber:
+    """
+    Incremental counterpart of transcribe(): one CQT frame per hop, the same
+    dB threshold and flatness-based abstain, MIDI note_on/note_off as they happen.
+    """
+
+    def __init__(self, sr=22050, threshold=0.6, hop_length=HOP_LENGTH, silence_db=-60.0):
+        """silence_db is absolute (dBFS): frames quieter than this are never transcribed."""
+        self.sr = sr
+        self.hop_length = hop_length
+        self.frame_time = hop_length / sr
+        self.threshold_db = threshold_to_db(threshold)
+        self.silence_db = silence_db
+        self.midi_offset = int(librosa.note_to_midi(FMIN_NOTE))
+
+        # CQT filter bank, each filter shifted to end at the newest sample so
+        # short (high) filters are not delayed by the long (low) ones
+        freqs = librosa.cqt_frequencies(N_BINS, fmin=librosa.note_to_hz(FMIN_NOTE))
+        filters, lengths = librosa.filters.wavelet(freqs=freqs, sr=sr)
+        n_fft = filters.shape[1]
+        for k, length in enumerate(lengths):
+            filters[k] = np.roll(filters[k], (n_fft - int(np.ceil(length))) // 2)
+        self.kernel = np.ascontiguousarray(filters.conj() / np.sqrt(lengths)[:, None])
+        self.n_fft = n_fft
+        self.flat_window = np.hanning(FLATNESS_FFT).astype(np.float32)
+
+        self.ring = RingBuffer(max(n_fft, FLATNESS_FFT))
+        self.pending = 0
+        self.frame = 0
+        self.ref = 0.0
+
+        # Short blips are filtered exactly like the offline tracker
+        self.min_frames = int(np.floor(MIN_NOTE_DURATION / self.frame_time)) + 1
+        self.run_length = np.zeros(N_BINS, dtype=int)
+        self.sounding = np.zeros(N_BINS, dtype=bool)
+
+        self.flatness_sum = 0.0
+        self.flatness_frames = 0
+        self.status = "success"
+        self.warnings = []
+
+        self.events = []
+        self.hop_times = []
+        self.onset_delays = []
+
+    def push(self, samples):
+        """Feed new samples; returns the (time, mido.Message) events they produced."""
+        events = []
+        samples = np.asarray(samples, dtype=np.float32)
+        while len(samples):
+            take = min(len(samples), self.hop_length - self.pending)
+            self.ring.write(samples[:take])
+            self.pending += take
+            samples = samples[take:]
+            if self.pending == self.hop_length:
+                self.pending = 0
+                start = time.perf_counter()
+                events.extend(self._process_hop())
+                self.hop_times.append(time.perf_counter() - start)
+        self.events.extend(events)
+        return events
+
+    def flush(self):
+        """Close every sounding note, e.g. at the end of the stream."""
+        t = self.frame * self.frame_time
+        events = [(t, mido.Message('note_off', note=int(b) + self.midi_offset, velocity=0))
+                  for b in np.where(self.sounding)[0]]
+        self.sounding[:] = False
+        self.run_length[:] = 0
+        self.events.extend(events)
+        return events
+
+    def _process_hop(self):
+        self.frame += 1
+        t = self.frame * self.frame_time
+        if self.status == "abstained":
+            return []
+
+        # Live input can't be peak-normalized up front, so silence is gated in dBFS
+        recent = self.ring.latest(FLATNESS_FFT)
+        rms = float(np.sqrt(np.mean(recent ** 2)))
+        silent = rms <= 0 or 20 * np.log10(rms) < self.silence_db
+
+        # Failure Honesty: running flatness over non-silent frames
+        if not silent:
+            S = np.maximum(1e-10, np.abs(np.fft.rfft(recent * self.flat_window)) ** 2)
+            self.flatness_sum += float(np.exp(np.mean(np.log(S))) / np.mean(S))
+            self.flatness_frames += 1
+
+        if self.flatness_frames * self.frame_time >= WARMUP_SECONDS:
+            mean_flatness = self.flatness_sum / self.flatness_frames
+            if mean_flatness > FLATNESS_WARN and not self.warnings:
+                self.warnings.append("Input sounds like noise; results may be unreliable")
+            if mean_flatness > FLATNESS_ABSTAIN:
+                self.status = "abstained"
+                return self.flush()
+
+        # Same thresholding as transcribe(), against the running peak instead of the global max
+        if silent:
+            active = np.zeros(N_BINS, dtype=bool)
+        else:
+            mag = np.abs(self.kernel @ self.ring.latest(self.n_fft))
+            self.ref = max(self.ref, float(np.max(mag)))
+            mag_db = 20 * np.log10(np.maximum(mag, 1e-5) / self.ref)
+            active = (mag_db > self.threshold_db) & select_bins(mag_db[:, None])[:, 0]
+
+        self.run_length = np.where(active, self.run_length + 1, 0)
+        events = []
+        for b in np.where(active & ~self.sounding & (self.run_length >= self.min_frames))[0]:
+            # Stamped at the onset frame; the wait for min_frames is the detection delay
+            onset = t - (self.run_length[b] - 1) * self.frame_time
+            events.append((onset, mido.Message('note_on', note=int(b) + self.midi_offset, velocity=100)))
+            self.onset_delays.append(t - onset)
+        self.sounding |= active & (self.run_length >= self.min_frames)
+        for b in np.where(self.sounding & ~active)[0]:
+            events.append((t, mido.Message('note_off', note=int(b) + self.midi_offset, velocity=0)))
+        self.sounding &= active
+        return events
+
+    def latency_stats(self):
+        """Per-hop processing time against the real-time budget of one hop."""
+        budget = self.hop_length / self.sr
+        times = np.array(self.hop_times) if self.hop_times else np.zeros(1)
+        return {
+            "hops": len(self.hop_times),
+            "budget_ms": budget * 1000,
+            "mean_ms": float(np.mean(times) * 1000),
+            "p95_ms": float(np.percentile(times, 95) * 1000),
+            "max_ms": float(np.max(times) * 1000),
+            "realtime_factor": float(np.mean(times) / budget),
+            "overruns": int(np.sum(times > budget)),
+            "detection_delay_ms": float(np.mean(self.onset_delays) * 1000) if self.onset_delays else 0.0,
+        }
+
+def replay_file(path, sr=22050, block=HOP_LENGTH, realtime=True):
+    """Yield mono blocks of an audio file, optionally paced at real time."""
+    info = sf.info(path)
+    resampler = soxr.ResampleStream(info.samplerate, sr, 1, dtype='float32')
+    start = time.perf_counter()
+    sent = 0
+    for chunk in sf.blocks(path, blocksize=block, dtype='float32', always_2d=True):
+        out = resampler.resample_chunk(chunk.mean(axis=1))
+        if realtime:
+            time.sleep(max(0.0, start + sent / sr - time.perf_counter()))
+        sent += len(out)
+        yield out
+    yield resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+
+def socket_frames(host, port, block=HOP_LENGTH):
+    """Yield blocks of float32 little-endian mono PCM read from a TCP stream."""
+    leftover = b""
+    with socket.create_connection((host, port)) as conn:
+        while True:
+            data = conn.recv(block * 4)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) - len(data) % 4
+            leftover = data[usable:]
+            yield np.frombuffer(data[:usable], dtype='<f4')
+
+def write_events(events, path):
+    """Write (time, message) events to a single-track MIDI file."""
+    mid = mido.MidiFile()
+    track = mido.MidiTrack()
+    mid.tracks.append(track)
+    last_tick = 0
+    for t, msg in sorted(events, key=lambda e: e[0]):
+        tick = int(round(mido.second2tick(t, mid.ticks_per_beat, 500000)))
+        track.append(msg.copy(time=tick - last_tick))
+        last_tick = tick
+    mid.save(path)
+
+def live(args):
+    live_tr = LiveTranscriber(threshold=args.threshold, silence_db=args.silence_db)
+    if args.listen:
+        host, port = args.listen.rsplit(':', 1)
+        frames = socket_frames(host, int(port))
+    else:
+        frames = replay_file(args.input, sr=live_tr.sr, realtime=args.realtime)
+
+    port = mido.open_output(args.midi_port) if args.midi_port else None
+    for block in frames:
+        for _, msg in live_tr.push(block):
+            if port:
+                port.send(msg)
+    for _, msg in live_tr.flush():
+        if port:
+            port.send(msg)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    write_events(live_tr.events, os.path.join(args.outdir, "live_transcription.mid"))
+    diagnostics = {
+        "status": live_tr.status,
+        "warnings": live_tr.warnings,
+        "notes": sum(1 for _, msg in live_tr.events if msg.type == 'note_on'),
+        "latency": live_tr.latency_stats()
+    }
+    if live_tr.status == "abstained":
+        diagnostics["reason"] = "Input too noisy"
+    save_diagnostics(diagnostics, os.path.join(args.outdir, "live_diagnostics.json"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--input', help='Audio file to replay')
+    parser.add_argument('--listen', help='host:port streaming float32 mono PCM at 22050 Hz')
+    parser.add_argument('--outdir', required=True)
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--silence-db', type=float, default=-60.0, help='Silence gate in dBFS')
+    parser.add_argument('--realtime', action='store_true', help='Pace file replay at real time')
+    parser.add_argument('--midi-port', help='Send events to this MIDI output port as they happen')
+    args = parser.parse_args()
+    if not (args.input or args.listen):
+        parser.error("one of --input or --listen is required")
+    live(args)
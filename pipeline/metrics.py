@@ -1,42 +1,129 @@
 import argparse
 import json
 import librosa
+import mir_eval
 import numpy as np
 import os
+import pretty_midi
+import sys
+import time
 
-def calculate_spectral_mse(ref_path, hyp_path):
-    try:
-        y_ref, sr = librosa.load(ref_path, sr=22050)
-        y_hyp, _ = librosa.load(hyp_path, sr=sr)
+# Ensure pipeline directory is in path for imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from utils import AudioStream, STEM_NAMES
+from spectral import stft, as_dsp, energy
 
-        min_len = min(len(y_ref), len(y_hyp))
-        if min_len == 0: return 0.0
-        y_ref, y_hyp = y_ref[:min_len], y_hyp[:min_len]
+def sonic_metrics(ref_path, hyp_path):
+    """
+    (spectral MSE, MFCC distance) of a render against its reference. Both come
+    from one batched STFT of the two signals; the MFCCs reuse its power spectrum.
+    """
+    y_ref, sr = librosa.load(ref_path, sr=22050)
+    y_hyp, _ = librosa.load(hyp_path, sr=sr)
+    y_ref, y_hyp = as_dsp(y_ref), as_dsp(y_hyp)
 
-        S_ref = np.abs(librosa.stft(y_ref))
-        S_hyp = np.abs(librosa.stft(y_hyp))
+    min_len = min(len(y_ref), len(y_hyp))
+    if min_len == 0: return 0.0, 0.0
+    S = np.abs(stft(np.stack([y_ref[:min_len], y_hyp[:min_len]])))
 
-        mse = np.mean((S_ref - S_hyp)**2)
-        return float(mse)
+    diff = S[0] - S[1]
+    mse = energy(diff) / diff.size
+    # Power spectrum in place of the magnitudes
+    mel = librosa.feature.melspectrogram(S=np.square(S, out=S), sr=sr)
+    # dB floor (top_db) is relative to each signal's own peak, as in mfcc(y=...)
+    mfcc = [librosa.feature.mfcc(S=librosa.power_to_db(m), sr=sr) for m in mel]
+    dist = np.mean((mfcc[0] - mfcc[1])**2)
+    return float(mse), float(dist)
+
+def calculate_spectral_mse(ref_path, hyp_path):
+    try:
+        return sonic_metrics(ref_path, hyp_path)[0]
     except Exception:
         return 0.0
 
 def calculate_mfcc_dist(ref_path, hyp_path):
     try:
-        y_ref, sr = librosa.load(ref_path, sr=22050)
-        y_hyp, _ = librosa.load(hyp_path, sr=sr)
+        return sonic_metrics(ref_path, hyp_path)[1]
+    except Exception:
+        return 0.0
 
-        min_len = min(len(y_ref), len(y_hyp))
-        if min_len == 0: return 0.0
-        y_ref, y_hyp = y_ref[:min_len], y_hyp[:min_len]
+SDR_BLOCK_SECONDS = 10.0
+BSS_WINDOW_SECONDS = 1.0
 
-        mfcc_ref = librosa.feature.mfcc(y=y_ref, sr=sr)
-        mfcc_hyp = librosa.feature.mfcc(y=y_hyp, sr=sr)
+def ratio_db(signal, noise):
+    """10 log10(signal / noise) of two energies, 100 dB for a perfect match."""
+    if noise == 0: return 100.0
+    return float(10 * np.log10(signal / (noise + 1e-10)))
 
-        dist = np.mean((mfcc_ref - mfcc_hyp)**2)
-        return float(dist)
-    except Exception:
-        return 0.0
+def separation_scores(ref_path, stems_dir, ref_stems=None, bss_window=None, block_seconds=SDR_BLOCK_SECONDS,
+                      sr=22050):
+    """
+    Separation metrics from one lock-step pass over the reference mix, every
+    stem and, if given, the ground-truth stems in ref_stems, block_seconds at a
+    time; only energy sums are kept, so memory doesn't grow with the duration.
+    - separation_sdr: the mix against the sum of the stems (calculate_sdr_proxy).
+    - stems: per stem with a ground truth, its SDR against it, and with
+      bss_window (seconds) the median of mir_eval's BSS SDR/SIR/SAR over
+      windows of that length, silent windows skipped as in bss_eval_sources_framewise.
+    """
+    ref = AudioStream.open(ref_path, sr)
+    stems = {name: AudioStream.open_stem(stems_dir, name, sr) for name in STEM_NAMES}
+    stems = {name: stream for name, stream in stems.items() if stream}
+    truth = {name: AudioStream.open_stem(ref_stems, name, sr) for name in stems} if ref_stems else {}
+    truth = {name: stream for name, stream in truth.items() if stream}
+    scored = list(truth)
+
+    block = int(block_seconds * sr)
+    window = int(bss_window * sr) if bss_window and scored else 0
+    if window:
+        # Whole windows per block; a trailing partial window isn't scored
+        block = max(window, block // window * window)
+
+    def take(stream, n):
+        # Stems are cut or zero-padded to the reference's length
+        y = stream.read(n)
+        return np.pad(y, (0, n - len(y))) if len(y) < n else y
+
+    ref_pwr = noise_pwr = 0.0
+    stem_pwr = dict.fromkeys(scored, 0.0)
+    stem_noise = dict.fromkeys(scored, 0.0)
+    bss = {name: [] for name in scored}
+    while True:
+        y_ref = ref.read(block)
+        n = len(y_ref)
+        if n == 0:
+            break
+        est = {name: take(stream, n) for name, stream in stems.items()}
+        true = {name: take(stream, n) for name, stream in truth.items()}
+
+        # The residual of the mix, in place of the sum of the stems
+        residual = -y_ref
+        for y in est.values():
+            residual += y
+        ref_pwr += energy(y_ref)
+        noise_pwr += energy(residual)
+
+        for name in scored:
+            stem_pwr[name] += energy(true[name])
+            stem_noise[name] += energy(est[name] - true[name])
+        for start in range(0, n - window + 1, window) if window else []:
+            refs = np.stack([true[name][start:start + window] for name in scored])
+            ests = np.stack([est[name][start:start + window] for name in scored])
+            if np.all(refs == 0, axis=1).any() or np.all(ests == 0, axis=1).any():
+                continue
+            sdr, sir, sar, _ = mir_eval.separation.bss_eval_sources(refs, ests, compute_permutation=False)
+            for i, name in enumerate(scored):
+                bss[name].append((sdr[i], sir[i], sar[i]))
+
+    scores = {"separation_sdr": ratio_db(ref_pwr, noise_pwr), "stems": {}}
+    for name in scored:
+        scores["stems"][name] = {"sdr": ratio_db(stem_pwr[name], stem_noise[name])}
+        if window:
+            values = np.array(bss[name]).reshape(-1, 3)
+            medians = [float(m) for m in np.median(values, axis=0)] if len(values) else [None] * 3
+            scores["stems"][name].update(dict(zip(["bss_sdr", "bss_sir", "bss_sar"], medians)),
+                                         bss_windows=len(values))
+    return scores
 
 def calculate_sdr_proxy(ref_path, stems_dir):
     """
@@ -44,27 +131,146 @@ def calculate_sdr_proxy(ref_path, stems_dir):
     the sum of stems to the original reference.
     """
     try:
-        y_ref, sr = librosa.load(ref_path, sr=22050)
-        y_sum = np.zeros_like(y_ref)
-
-        for stem in ["vocals", "bass", "drums", "other"]:
-            stem_path = os.path.join(stems_dir, f"{stem}.wav")
-            if os.path.exists(stem_path):
-                y_stem, _ = librosa.load(stem_path, sr=sr)
-                min_len = min(len(y_sum), len(y_stem))
-                y_sum[:min_len] += y_stem[:min_len]
-
-        # SDR = 10 * log10( ||ref||^2 / ||ref - sum||^2 )
-        noise = y_ref - y_sum
-        ref_pwr = np.sum(y_ref**2)
-        noise_pwr = np.sum(noise**2)
-
-        if noise_pwr == 0: return 100.0
-        sdr = 10 * np.log10(ref_pwr / (noise_pwr + 1e-10))
-        return float(sdr)
+        return separation_scores(ref_path, stems_dir)["separation_sdr"]
     except Exception:
         return 0.0
 
+def load_note_events(midi_path):
+    """Note intervals (seconds) and pitches (Hz) of every instrument in a MIDI file."""
+    pm = pretty_midi.PrettyMIDI(midi_path)
+    notes = [n for inst in pm.instruments for n in inst.notes]
+    intervals = np.array([[n.start, n.end] for n in notes]).reshape(-1, 2)
+    pitches = np.array([librosa.midi_to_hz(n.pitch) for n in notes])
+    return intervals, pitches
+
+def calculate_note_f1(ref_midi, hyp_midi, onset_tolerance=0.05):
+    """
+    Note-level F1 (onset + pitch, offsets ignored) of a hypothesis MIDI against a reference MIDI.
+    """
+    try:
+        ref_intervals, ref_pitches = load_note_events(ref_midi)
+        hyp_intervals, hyp_pitches = load_note_events(hyp_midi)
+    except Exception:
+        return 0.0
+    if len(ref_pitches) == 0 and len(hyp_pitches) == 0:
+        return 1.0
+    if len(ref_pitches) == 0 or len(hyp_pitches) == 0:
+        return 0.0
+    _, _, f1, _ = mir_eval.transcription.precision_recall_f1_overlap(
+        ref_intervals, ref_pitches, hyp_intervals, hyp_pitches,
+        onset_tolerance=onset_tolerance, offset_ratio=None
+    )
+    return float(f1)
+
+def evaluate_quality_tradeoff(input_path, outdir, qualities, threshold=0.6, seed=42):
+    """
+    Transcribes the input once at full resolution and once per quality setting,
+    reporting latency and note agreement with the full-resolution result.
+    """
+    from transcribe import transcribe
+
+    def timed_run(quality):
+        run_dir = os.path.join(outdir, f"quality_{quality:.2f}")
+        os.makedirs(run_dir, exist_ok=True)
+        start = time.perf_counter()
+        transcribe(argparse.Namespace(
+            input=input_path, outdir=run_dir, threshold=threshold, seed=seed, quality=quality
+        ))
+        return os.path.join(run_dir, "transcription.mid"), time.perf_counter() - start
+
+    # First call pays one-off import/JIT costs; keep it out of the comparison
+    timed_run(1.0)
+    ref_midi, ref_latency = timed_run(1.0)
+    rows = []
+    for quality in sorted(set(qualities) | {1.0}):
+        midi_path, latency = (ref_midi, ref_latency) if quality == 1.0 else timed_run(quality)
+        rows.append({
+            "quality": float(quality),
+            "latency_s": float(latency),
+            "speedup": float(ref_latency / latency) if latency > 0 else 0.0,
+            "note_f1_vs_full": calculate_note_f1(ref_midi, midi_path),
+        })
+    return rows
+
+def evaluate_inference_modes(input_path, outdir, modes, model_config=None, threshold=0.6, seed=42):
+    """
+    Transcribes the input with the configured torch model in each inference mode
+    (see backends.TorchBackend), reporting model and end-to-end latency and the
+    accuracy delta against the float model: note F1 and the largest probability error.
+    """
+    from backends import load_backend, read_config, read_inference_config, MODEL_CONFIG
+    from transcribe import analyze, load_input, transcribe
+
+    model_config = model_config or MODEL_CONFIG
+    config = read_config(model_config)
+    if config.get("model_type") != "onset_frame_cnn":
+        raise ValueError(f"{model_config} selects '{config.get('model_type')}'; inference modes apply to onset_frame_cnn")
+    y, sr = load_input(input_path)
+
+    def mode_config(mode):
+        # config.json and inference.json side by side, as under model/
+        model_dir = os.path.join(outdir, f"inference_{mode}", "model")
+        os.makedirs(model_dir, exist_ok=True)
+        with open(os.path.join(model_dir, "config.json"), 'w') as f:
+            json.dump(config, f)
+        with open(os.path.join(model_dir, "inference.json"), 'w') as f:
+            json.dump(dict(read_inference_config(model_config), mode=mode), f)
+        return os.path.join(model_dir, "config.json")
+
+    def timed_run(mode):
+        path = mode_config(mode)
+        run_dir = os.path.dirname(os.path.dirname(path))
+        run_args = argparse.Namespace(input=input_path, outdir=run_dir, threshold=threshold, seed=seed, model_config=path)
+        # First call builds (quantizes, traces) the model; keep it out of the timing
+        transcribe(run_args)
+        start = time.perf_counter()
+        transcribe(run_args)
+        latency = time.perf_counter() - start
+        backend = load_backend(path)
+        cqt_norm = analyze(y, sr, run_args)["cqt_norm"]
+        start = time.perf_counter()
+        probs = backend.activation(cqt_norm)
+        return os.path.join(run_dir, "transcription.mid"), latency, time.perf_counter() - start, probs
+
+    ref_midi, ref_latency, ref_model, ref_probs = timed_run("float")
+    rows = []
+    for mode in ["float"] + [m for m in dict.fromkeys(modes) if m != "float"]:
+        midi_path, latency, model_latency, probs = (
+            (ref_midi, ref_latency, ref_model, ref_probs) if mode == "float" else timed_run(mode))
+        rows.append({
+            "mode": mode,
+            "latency_s": float(latency),
+            "model_s_per_audio_s": float(model_latency * sr / len(y)),
+            "model_speedup": float(ref_model / model_latency) if model_latency > 0 else 0.0,
+            "note_f1_vs_float": calculate_note_f1(ref_midi, midi_path),
+            "max_probability_error": float(np.max(np.abs(probs - ref_probs))) if probs.size else 0.0,
+        })
+    return rows
+
+def separation_main(args):
+    """
+    Separation metrics alone; they only need the stems, so a scheduler can run
+    this alongside transcription/rendering and hand the result to main().
+    """
+    ref_stems = getattr(args, 'ref_stems', None)
+    if not ref_stems:
+        metrics = {"separation_sdr": calculate_sdr_proxy(args.ref, args.stems)}
+    else:
+        # Per-stem scores against the ground truth, in the same streaming pass
+        scores = separation_scores(args.ref, args.stems, ref_stems, getattr(args, 'bss_window', None))
+        metrics = {"separation_sdr": scores["separation_sdr"], "separation_stems": scores["stems"]}
+    with open(args.out, 'w') as f:
+        json.dump(metrics, f)
+    return metrics
+
+def load_separation_sdr(args, stems_dir):
+    """Precomputed SDR from separation_main() if given, else computed now."""
+    path = getattr(args, 'separation', None)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)["separation_sdr"]
+    return calculate_sdr_proxy(args.ref, stems_dir)
+
 def main(args):
     metrics = {
         "spectral_mse": 0.0,
@@ -79,19 +285,21 @@ def main(args):
         metrics["status"] = "abstained_or_failed"
         # Even if rendering failed, we can still report SDR if separation happened
         stems_dir = os.path.join(os.path.dirname(args.hyp), "stems")
-        metrics['separation_sdr'] = calculate_sdr_proxy(args.ref, stems_dir)
+        metrics['separation_sdr'] = load_separation_sdr(args, stems_dir)
         print(json.dumps(metrics, indent=2))
         with open(args.out, 'w') as f:
             json.dump(metrics, f)
         return
 
     # 1. Sonic Truth
-    metrics['spectral_mse'] = calculate_spectral_mse(args.ref, args.hyp)
-    metrics['mfcc_dist'] = calculate_mfcc_dist(args.ref, args.hyp)
+    try:
+        metrics['spectral_mse'], metrics['mfcc_dist'] = sonic_metrics(args.ref, args.hyp)
+    except Exception:
+        pass
 
     # 2. Separation Metric
     stems_dir = os.path.join(os.path.dirname(args.hyp), "stems")
-    metrics['separation_sdr'] = calculate_sdr_proxy(args.ref, stems_dir)
+    metrics['separation_sdr'] = load_separation_sdr(args, stems_dir)
 
     # 3. Transcription Accuracy (Heuristic Proxy)
     if metrics['spectral_mse'] < 200:
@@ -105,8 +313,35 @@ def main(args):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--ref', required=True)
-    parser.add_argument('--hyp', required=True)
-    parser.add_argument('--midi', required=True)
+    parser.add_argument('--hyp')
+    parser.add_argument('--midi')
+    parser.add_argument('--stems', help='Score only the separation of these stems against --ref')
+    parser.add_argument('--ref-stems', help='Ground-truth stems, for per-stem SDR (with --stems)')
+    parser.add_argument('--bss-window', type=float, nargs='?', const=BSS_WINDOW_SECONDS, metavar='SECONDS',
+                        help=f'Also per-stem BSS SDR/SIR/SAR (mir_eval) over windows of this length '
+                             f'(default: {BSS_WINDOW_SECONDS})')
     parser.add_argument('--out', required=True)
+    parser.add_argument('--tradeoff', type=float, nargs='+', metavar='QUALITY',
+                        help='Report transcription latency/accuracy for these quality settings instead')
+    parser.add_argument('--inference-modes', nargs='+', choices=['float', 'torchscript', 'int8'],
+                        help='Report latency/accuracy of the torch model in these inference modes instead')
+    parser.add_argument('--model-config', help='Model config for --inference-modes (default: model/config.json)')
+    parser.add_argument('--threshold', type=float, default=0.6)
     args = parser.parse_args()
-    main(args)
+    if args.inference_modes:
+        rows = evaluate_inference_modes(args.ref, os.path.dirname(os.path.abspath(args.out)), args.inference_modes,
+                                        args.model_config, args.threshold)
+        print(json.dumps(rows, indent=2))
+        with open(args.out, 'w') as f:
+            json.dump(rows, f, indent=2)
+    elif args.tradeoff:
+        rows = evaluate_quality_tradeoff(args.ref, os.path.dirname(os.path.abspath(args.out)), args.tradeoff, args.threshold)
+        print(json.dumps(rows, indent=2))
+        with open(args.out, 'w') as f:
+            json.dump(rows, f, indent=2)
+    elif args.stems:
+        print(json.dumps(separation_main(args), indent=2))
+    elif not (args.hyp and args.midi):
+        parser.error("--hyp and --midi are required unless --stems, --tradeoff or --inference-modes is given")
+    else:
+        main(args)
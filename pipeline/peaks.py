@@ -0,0 +1,85 @@
+import os
+import struct
+import numpy as np
+
+# Waveform summaries stored next to each rendered/separated file so the UI can
+# draw long tracks without downloading the audio. Level 0 summarizes
+# BASE_BLOCK samples per column; every further level groups LEVEL_FACTOR columns.
+BASE_BLOCK = 256
+LEVEL_FACTOR = 4
+N_LEVELS = 5
+MAGIC = b'PEAK'
+HEADER = struct.Struct('<4sHHIQ')  # magic, version, levels, sample rate, samples
+LEVEL_HEADER = struct.Struct('<II')  # samples per column, columns
+
+def peaks_path(audio_path):
+    return os.path.splitext(audio_path)[0] + '.peaks'
+
+def compute_peaks(audio, n_levels=N_LEVELS):
+    """
+    Min/max/RMS mipmap of a (mono or multichannel) signal.
+    Returns a list of (block_size, int16 array of shape (columns, 3)).
+    """
+    audio = np.asarray(audio)
+    if audio.dtype == np.int16:
+        audio = audio.astype(np.float32) / 32768.0
+    mono = audio.reshape(len(audio), -1).mean(axis=1).astype(np.float32)
+
+    n_cols = max(1, -(-len(mono) // BASE_BLOCK))
+    padded = np.zeros(n_cols * BASE_BLOCK, dtype=np.float32)
+    padded[:len(mono)] = mono
+    frames = padded.reshape(n_cols, BASE_BLOCK)
+    lo, hi = frames.min(axis=1), frames.max(axis=1)
+    ms = np.mean(frames ** 2, axis=1)
+
+    levels = []
+    block = BASE_BLOCK
+    for _ in range(n_levels):
+        cols = np.stack([lo, hi, np.sqrt(ms)], axis=1)
+        levels.append((block, np.round(np.clip(cols, -1.0, 1.0) * 32767).astype('<i2')))
+        if len(lo) == 1:
+            break
+        # Next level from this one rather than from the samples
+        n = -(-len(lo) // LEVEL_FACTOR) * LEVEL_FACTOR
+        pad = n - len(lo)
+        lo = np.pad(lo, (0, pad), mode='edge').reshape(-1, LEVEL_FACTOR).min(axis=1)
+        hi = np.pad(hi, (0, pad), mode='edge').reshape(-1, LEVEL_FACTOR).max(axis=1)
+        ms = np.pad(ms, (0, pad)).reshape(-1, LEVEL_FACTOR).mean(axis=1)
+        block *= LEVEL_FACTOR
+    return levels
+
+def write_peaks(audio, sr, audio_path):
+    """Writes the peak mipmap for audio_path to its .peaks sidecar."""
+    levels = compute_peaks(audio)
+    with open(peaks_path(audio_path), 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 1, len(levels), int(sr), len(audio)))
+        for block, cols in levels:
+            f.write(LEVEL_HEADER.pack(block, len(cols)))
+        for _, cols in levels:
+            f.write(cols.tobytes())
+
+def read_peaks(path):
+    """Returns (sample rate, samples, [(block_size, int16 columns x 3)])."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, _, n_levels, sr, n_samples = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"Not a peaks file: {path}")
+    offset = HEADER.size
+    shapes = []
+    for _ in range(n_levels):
+        shapes.append(LEVEL_HEADER.unpack_from(data, offset))
+        offset += LEVEL_HEADER.size
+    levels = []
+    for block, n_cols in shapes:
+        cols = np.frombuffer(data, dtype='<i2', count=n_cols * 3, offset=offset).reshape(n_cols, 3)
+        levels.append((block, cols))
+        offset += cols.nbytes
+    return sr, n_samples, levels
+
+def select_level(levels, width):
+    """Coarsest level that still has at least `width` columns."""
+    for block, cols in reversed(levels):
+        if len(cols) >= width:
+            return block, cols
+    return levels[0]
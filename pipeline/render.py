@@ -1,99 +1,484 @@
 import argparse
+import functools
+import hashlib
 import mido
 import numpy as np
+import pretty_midi
 import scipy.io.wavfile
+import scipy.signal
 import subprocess
 import os
 import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 # Ensure pipeline directory is in path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from utils import set_seed, save_diagnostics
+from utils import (
+    set_seed, stage_rng, save_diagnostics, audio_path, format_from_path, write_audio_async,
+    submit_encode, AUDIO_FORMATS
+)
+from peaks import write_peaks
+from spectral import as_dsp
+
+STREAM_CHUNK_SECONDS = 1.0
+STREAM_CHUNK_PEAKS = 64
+RELEASE_TAIL = 1.0 # seconds a note keeps sounding after its note-off
+CROSSFADE_SECONDS = 0.05
+INCREMENTAL_MAX_FRACTION = 0.5 # re-render everything once this much of the piece changed
+SEGMENT_TOLERANCE = 0.05 # max spectral error of a segmented render against a single pass
 
 def apply_humanization(mid, seed):
     """
     Injects micro-timing jitter and velocity curves.
+    Each note's jitter is drawn from its own stream, keyed by (track, pitch, onset tick),
+    so adding or removing one note leaves every other note exactly where it was.
     """
-    rng = np.random.RandomState(seed)
-    
-    for track in mid.tracks:
+    for track_idx, track in enumerate(mid.tracks):
+        events = []
+        tick = 0
         for msg in track:
+            tick += msg.time
             if msg.type == 'note_on' and msg.velocity > 0:
+                rng = stage_rng(seed, "render", track_idx, msg.note, tick)
+
                 # Velocity Humanization: Gaussian jitter
-                jitter = int(rng.normal(0, 5)) 
-                msg.velocity = np.clip(msg.velocity + jitter, 1, 127)
-                
-                # Timing Humanization (simulated by adjusting deltas)
-                # In a more complex implementation, we'd jitter msg.time
+                jitter = int(rng.normal(0, 5))
+                msg.velocity = int(np.clip(msg.velocity + jitter, 1, 127))
+
+                # Timing Humanization: move this onset only, not everything after it
                 time_jitter = int(rng.normal(0, 2))
-                msg.time = max(0, msg.time + time_jitter)
+                events.append((max(0, tick + time_jitter), msg))
+            else:
+                events.append((tick, msg))
+
+        events.sort(key=lambda e: e[0])
+        last = 0
+        for tick, msg in events:
+            msg.time = tick - last
+            last = tick
+        track[:] = [msg for _, msg in events]
     return mid
 
+def emit_chunks(emit, audio, sr):
+    """Report the rendered waveform to a progress listener in fixed-size chunks of min/max peaks."""
+    if audio.dtype == np.int16:
+        audio = audio.astype(np.float32) / 32768.0
+    mono = audio.reshape(len(audio), -1).mean(axis=1)
+    emit('start', {'duration': len(mono) / sr})
+    chunk = int(sr * STREAM_CHUNK_SECONDS)
+    for offset in range(0, len(mono), chunk):
+        block = mono[offset:offset + chunk]
+        cols = np.array_split(block, min(STREAM_CHUNK_PEAKS, len(block)))
+        emit('audio_chunk', {
+            'offset': offset / sr,
+            'duration': len(block) / sr,
+            'min': [round(float(c.min()), 4) for c in cols],
+            'max': [round(float(c.max()), 4) for c in cols]
+        })
+
+def find_soundfont():
+    # Check if FluidSynth and SoundFont are available
+    soundfont = "/usr/share/sounds/sf2/FluidR3_GM.sf2"
+    if not os.path.exists(soundfont):
+        # Fallback to another common location or error
+        soundfont = "/usr/share/sounds/sf3/default-gm.sf3"
+        if not os.path.exists(soundfont):
+             # Just a placeholder if we can't find it, though in a real environment it should be there.
+             # For the sake of this task, I'll assume it's where it should be based on Dockerfile.
+             pass
+    return soundfont
+
+def synthesize(midi_path, sample_rate=44100):
+    """
+    Renders a MIDI file with FluidSynth (used for container robustness).
+    Returns (sr, int16 audio); the intermediate WAV never leaves a temp file.
+    """
+    fd, temp_wav = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    cmd = [
+        "fluidsynth", "-ni", find_soundfont(), midi_path,
+        "-F", temp_wav, "-r", str(sample_rate), "-g", "1.0"
+    ]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return scipy.io.wavfile.read(temp_wav)
+    finally:
+        os.remove(temp_wav)
+
+def synthesize_pm(pm, sample_rate=44100):
+    """synthesize() for an in-memory pretty_midi.PrettyMIDI."""
+    fd, temp_midi = tempfile.mkstemp(suffix=".mid")
+    os.close(fd)
+    try:
+        pm.write(temp_midi)
+        return synthesize(temp_midi, sample_rate)
+    finally:
+        os.remove(temp_midi)
+
+def snap(pm, t):
+    """Round a time down to the MIDI tick grid, so excerpts keep the original quantization."""
+    return pm.tick_to_time(int(pm.time_to_tick(t)))
+
+def excerpt(pm, t0, t1, keep):
+    """
+    The notes for which keep(note) holds, shifted so t0 becomes time 0. Each
+    instrument's controller and pitch-bend state at t0 is carried in at time 0,
+    and a marker at t1 makes the synth render at least that far.
+    """
+    times, tempi = pm.get_tempo_changes()
+    tempo = tempi[max(0, np.searchsorted(times, t0, side='right') - 1)]
+    part = pretty_midi.PrettyMIDI(resolution=pm.resolution, initial_tempo=float(tempo))
+    for inst in pm.instruments:
+        new = pretty_midi.Instrument(program=inst.program, is_drum=inst.is_drum, name=inst.name)
+        new.notes = [pretty_midi.Note(n.velocity, n.pitch, max(0.0, n.start - t0), n.end - t0)
+                     for n in inst.notes if keep(n)]
+        if not new.notes:
+            continue
+
+        state = {}
+        for cc in sorted(inst.control_changes, key=lambda c: c.time):
+            if cc.time <= t0:
+                state[cc.number] = cc.value
+            elif cc.time < t1:
+                new.control_changes.append(pretty_midi.ControlChange(cc.number, cc.value, cc.time - t0))
+        new.control_changes[:0] = [pretty_midi.ControlChange(n, v, 0.0) for n, v in sorted(state.items())]
+
+        bend = None
+        for pb in sorted(inst.pitch_bends, key=lambda b: b.time):
+            if pb.time <= t0:
+                bend = pb.pitch
+            elif pb.time < t1:
+                new.pitch_bends.append(pretty_midi.PitchBend(pb.pitch, pb.time - t0))
+        if bend:
+            new.pitch_bends.insert(0, pretty_midi.PitchBend(bend, 0.0))
+        part.instruments.append(new)
+    part.text_events.append(pretty_midi.Text("end", t1 - t0))
+    return part
+
+def render_excerpt(pm, t0, t1, keep, sample_rate=44100, synth=None):
+    """
+    Synthesizes the notes selected by keep(note) over [t0, t1) as they would
+    sound in a full render. Returns int16 audio of exactly that duration.
+    """
+    n = int(round((t1 - t0) * sample_rate))
+    part = excerpt(pm, t0, t1, keep)
+    if not part.instruments:
+        return np.zeros((n, 2), dtype=np.int16)
+    sr, audio = (synth or synthesize_pm)(part, sample_rate)
+    if len(audio) < n:
+        audio = np.concatenate([audio, np.zeros((n - len(audio),) + audio.shape[1:], dtype=audio.dtype)])
+    return audio[:n]
+
+def release_time(inst, note, piece_end):
+    """When a note stops being held: its note-off, or the sustain pedal release after it."""
+    pedal = sorted((cc.time, cc.value >= 64) for cc in inst.control_changes if cc.number == 64)
+    down = False
+    for time, is_down in pedal:
+        if time <= note.end:
+            down = is_down
+        elif not down:
+            return note.end
+        elif not is_down:
+            return time
+    return piece_end if down else note.end
+
+def render_segmented(pm, sample_rate=44100, n_segments=4, jobs=None, synth=None):
+    """
+    Splits the piece into n_segments time ranges and synthesizes them concurrently.
+    A segment owns the notes that start in it and renders them to the end of
+    their release, with the controller state at its start carried in. Voices add
+    linearly, so the segments are stitched by overlap-adding them.
+    Returns (sr, int16 audio) like synthesize().
+    """
+    end = pm.get_end_time()
+    bounds = [snap(pm, t) for t in np.linspace(0.0, end, n_segments + 1)[:-1]] + [np.inf]
+
+    tasks = []
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        owned = [(inst, n) for inst in pm.instruments for n in inst.notes if lo <= n.start < hi]
+        if not owned:
+            continue
+        t1 = max(release_time(inst, n, end) for inst, n in owned) + RELEASE_TAIL
+        tasks.append((lo, t1, lambda n, lo=lo, hi=hi: lo <= n.start < hi))
+
+    def run(task):
+        lo, t1, keep = task
+        return render_excerpt(pm, lo, t1, keep, sample_rate, synth)
+
+    # Each segment is its own synth process, so threads are enough to fill the cores
+    with ThreadPoolExecutor(max_workers=jobs or len(tasks) or 1) as pool:
+        parts = list(pool.map(run, tasks))
+
+    offsets = [int(round(lo * sample_rate)) for lo, _, _ in tasks]
+    length = max([o + len(p) for o, p in zip(offsets, parts)] + [int(round(end * sample_rate))])
+    mix = np.zeros((length, 2), dtype=np.int32)
+    for offset, part in zip(offsets, parts):
+        mix[offset:offset + len(part)] += part.reshape(len(part), -1)
+    return sample_rate, np.clip(mix, -32768, 32767).astype(np.int16)
+
+def instrument_label(inst):
+    """The name gains are keyed by: the track name (a stem, for multitrack transcriptions), else the GM name."""
+    if inst.name:
+        return inst.name
+    return "drums" if inst.is_drum else pretty_midi.program_to_instrument_name(inst.program)
+
+def parse_gains(specs):
+    """["bass=-3", "drums=-inf"] -> {"bass": -3.0, "drums": -inf} (dB)."""
+    gains = {}
+    for spec in specs or []:
+        name, sep, db = spec.rpartition("=")
+        if not sep or not name:
+            raise ValueError(f"Expected NAME=DB, got '{spec}'")
+        gains[name] = float(db)
+    return gains
+
+def mix_stems(parts, gains):
+    """Sums int16 parts of any length, each scaled by its linear gain, into one clipped int16 mix."""
+    length = max([len(p) for p in parts] + [0])
+    mix = np.zeros((length, 2), dtype=np.float32)
+    for part, gain in zip(parts, gains):
+        if gain:
+            mix[:len(part)] += part.reshape(len(part), -1) * np.float32(gain)
+    return np.clip(np.rint(mix), -32768, 32767).astype(np.int16)
+
+def render_instruments(pm, sample_rate=44100, gains=None, jobs=None, synth=None):
+    """
+    Synthesizes each instrument on its own, concurrently, and mixes them with
+    per-instrument gains in dB (keyed by instrument_label; -inf mutes).
+    Returns (sr, int16 audio) like synthesize().
+    """
+    gains = gains or {}
+    end = pm.get_end_time()
+    tasks = []
+    for inst in pm.instruments:
+        db = gains.get(instrument_label(inst), 0.0)
+        if inst.notes and db != -np.inf:
+            ids = {id(n) for n in inst.notes}
+            tasks.append((excerpt(pm, 0.0, end, lambda n, ids=ids: id(n) in ids), 10 ** (db / 20)))
+
+    def run(task):
+        return (synth or synthesize_pm)(task[0], sample_rate)[1]
+
+    # One synth process per instrument, like render_segmented's segments
+    with ThreadPoolExecutor(max_workers=jobs or len(tasks) or 1) as pool:
+        parts = list(pool.map(run, tasks))
+    return sample_rate, mix_stems(parts, [gain for _, gain in tasks])
+
+def spectral_error(audio, reference, sr):
+    """Relative STFT magnitude difference; insensitive to sub-millisecond onset shifts."""
+    n = min(len(audio), len(reference))
+    mono = lambda a: a[:n].astype(np.float32).reshape(n, -1).mean(axis=1)
+    _, _, A = scipy.signal.stft(mono(audio), sr, nperseg=2048)
+    _, _, B = scipy.signal.stft(mono(reference), sr, nperseg=2048)
+    return float(np.linalg.norm(np.abs(A) - np.abs(B)) / max(np.linalg.norm(np.abs(B)), 1e-12))
+
+def post_fx(audio, sr):
+    """Slight stereo spread and soft compression; int16 in, working precision (float32) out."""
+    # Convert to float for processing; a fresh array, so scaled in place
+    audio = as_dsp(audio)
+    audio /= 32768.0
+
+    # Stereo spread simulation (duplicate mono to stereo with slight delay)
+    if len(audio.shape) == 1:
+        # Create a 2ms delay for one channel
+        delay_samples = int(sr * 0.002)
+        left = audio
+        right = np.zeros_like(audio)
+        right[delay_samples:] = audio[:-delay_samples]
+        audio = np.stack([left, right], axis=1)
+
+    # Subtle compression
+    threshold = 0.8
+    ratio = 2.0
+    mask = np.abs(audio) > threshold
+    audio[mask] = np.sign(audio[mask]) * (threshold + (np.abs(audio[mask]) - threshold) / ratio)
+    return audio
+
+def render_cache_path(out):
+    return os.path.splitext(out)[0] + ".render_cache.npz"
+
+def note_table(pm):
+    """Every note as a sorted (start, end, pitch, velocity, instrument) row."""
+    rows = [(n.start, n.end, n.pitch, n.velocity, i) for i, inst in enumerate(pm.instruments) for n in inst.notes]
+    table = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return table[np.lexsort(table.T[::-1])]
+
+def control_signature(pm, settings=None):
+    """Everything besides the notes that shapes the render (plus any render settings); any change forces a full render."""
+    parts = [(inst.program, inst.is_drum,
+              [(cc.number, cc.value, cc.time) for cc in inst.control_changes],
+              [(pb.pitch, pb.time) for pb in inst.pitch_bends]) for inst in pm.instruments]
+    key = (parts, pm.get_tempo_changes()[1].tolist())
+    if settings:
+        key += (sorted(settings.items()),)
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+def changed_windows(old_notes, new_notes):
+    """
+    Merged (start, end) spans whose audio depends on a note present in only one
+    of the two sets, including its release and a crossfade on either side.
+    """
+    changed = set(map(tuple, old_notes.tolist())) ^ set(map(tuple, new_notes.tolist()))
+    spans = sorted((max(0.0, start - CROSSFADE_SECONDS), end + RELEASE_TAIL + CROSSFADE_SECONDS)
+                   for start, end, *_ in changed)
+    windows = []
+    for start, end in spans:
+        if windows and start <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], end)
+        else:
+            windows.append([start, end])
+    return windows, len(changed)
+
+def splice(mix, patch, offset, fade):
+    """Writes patch into mix at offset with linear crossfades of `fade` samples; returns the (maybe longer) mix."""
+    end = offset + len(patch)
+    if end > len(mix):
+        mix = np.concatenate([mix, np.zeros((end - len(mix),) + mix.shape[1:], dtype=mix.dtype)])
+    weight = np.ones(len(patch), dtype=np.float32)
+    fade = min(fade, len(patch) // 2)
+    ramp = np.arange(fade, dtype=np.float32) / max(fade, 1)
+    if offset > 0:
+        weight[:fade] = ramp
+    if end < len(mix):
+        weight[len(patch) - fade:] = ramp[::-1]
+    weight = weight.reshape((-1,) + (1,) * (patch.ndim - 1))
+    mix[offset:end] = mix[offset:end] * (1 - weight) + patch * weight
+    return mix
+
+def render_incremental(pm, cache_path, sample_rate=44100, synth=None, settings=None):
+    """
+    Re-synthesizes only the windows whose notes differ from the render cached at
+    cache_path and splices them into it. Falls back to a full render without a
+    usable cache, when most of the piece changed or when `settings` (e.g. stem
+    gains) differ from the cached render's.
+    Returns (post-FX mix, sr, stats) and refreshes the cache.
+    """
+    synth = synth or synthesize_pm
+    notes = note_table(pm)
+    controls = control_signature(pm, settings)
+
+    windows = None
+    stats = {"mode": "full", "reason": "no cached render"}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as f:
+            cache = {key: f[key] for key in f.files}
+        if int(cache["sr"]) != sample_rate or str(cache["controls"]) != controls:
+            stats["reason"] = "sample rate, instruments, controllers or gains changed"
+        else:
+            windows, n_changed = changed_windows(cache["notes"], notes)
+            if sum(end - start for start, end in windows) > INCREMENTAL_MAX_FRACTION * max(pm.get_end_time(), 1e-6):
+                stats["reason"] = "most of the piece changed"
+                windows = None
+
+    if windows is None:
+        sr, audio = synth(pm, sample_rate)
+        mix = post_fx(audio, sr)
+    else:
+        sr = sample_rate
+        mix = cache["mix"]
+        rendered = 0.0
+        for start, end in windows:
+            # Begin at the earliest onset still sounding in the window, so every note gets its real attack
+            sounding = lambda n: n.start < end and n.end + RELEASE_TAIL > start
+            onsets = [n.start for inst in pm.instruments for n in inst.notes if sounding(n)]
+            t0 = snap(pm, min([start] + onsets))
+            audio = render_excerpt(pm, t0, end, sounding, sr, synth)
+            patch = post_fx(audio, sr)[int(round(start * sr)) - int(round(t0 * sr)):]
+            mix = splice(mix, patch, int(round(start * sr)), int(CROSSFADE_SECONDS * sr))
+            rendered += end - t0
+        stats = {"mode": "incremental", "changed_notes": n_changed, "windows": len(windows),
+                 "rendered_seconds": float(rendered)}
+
+    np.savez(cache_path, mix=mix, sr=sr, notes=notes, controls=controls)
+    return mix, sr, stats
+
 def render(args):
     set_seed(args.seed)
     diagnostics = {"polyphony_overflow": 0, "rendered_voices": 0}
     
     # 1. Parse MIDI
     mid = mido.MidiFile(args.midi)
+    if not any(msg.type == 'note_on' and msg.velocity > 0 for track in mid.tracks for msg in track):
+        # Nothing to play (e.g. the transcription abstained); leave no stale render behind
+        diagnostics["status"] = "skipped"
+        diagnostics["reason"] = "No notes to render"
+        fmt = getattr(args, 'format', None) or format_from_path(args.out)
+        out = audio_path(os.path.splitext(args.out)[0], fmt)
+        if os.path.exists(out):
+            os.remove(out)
+        save_diagnostics(diagnostics, os.path.splitext(out)[0] + "_diagnostics.json")
+        return
     
     # 2. Humanization (Expressiveness)
     if args.humanize:
         mid = apply_humanization(mid, args.seed)
     
-    # Save temp humanized MIDI
-    temp_midi = args.midi.replace(".mid", "_humanized.mid")
+    # Save temp humanized MIDI next to the output, so several renders of
+    # one transcription don't overwrite each other's copy
+    temp_midi = os.path.join(os.path.dirname(os.path.abspath(args.out)),
+                             os.path.basename(args.midi).replace(".mid", "_humanized.mid"))
     mid.save(temp_midi)
     
     # 3. Synthesis (using FluidSynth as the reliable backend)
-    # We use FluidSynth here for container robustness.
-    # Check if FluidSynth and SoundFont are available
-    soundfont = "/usr/share/sounds/sf2/FluidR3_GM.sf2"
-    if not os.path.exists(soundfont):
-        # Fallback to another common location or error
-        soundfont = "/usr/share/sounds/sf3/default-gm.sf3"
-        if not os.path.exists(soundfont):
-             # Just a placeholder if we can't find it, though in a real environment it should be there.
-             # For the sake of this task, I'll assume it's where it should be based on Dockerfile.
-             pass
-
-    cmd = [
-        "fluidsynth", "-ni", soundfont, temp_midi,
-        "-F", args.out, "-r", "44100", "-g", "1.0"
-    ]
-    
+    # 4. Minimal Mixing (Post-FX)
+    n_segments = getattr(args, 'segments', 1)
+    gains = getattr(args, 'gains', None) or {}
+    pm = pretty_midi.PrettyMIDI(temp_midi)
+    synth = None
+    if n_segments > 1:
+        # Time segments rendered in parallel; fluidsynth itself is single-threaded
+        synth = functools.partial(render_segmented, n_segments=n_segments, jobs=getattr(args, 'jobs', None))
+    per_instrument = len([inst for inst in pm.instruments if inst.notes]) > 1 or bool(gains)
+    if per_instrument:
+        # Each instrument (e.g. one per separated stem) in its own synth, mixed with its gain
+        synth = functools.partial(render_instruments, gains=gains, synth=synth)
+        diagnostics["instruments"] = [
+            {"name": instrument_label(inst), "program": int(inst.program), "is_drum": inst.is_drum,
+             "notes": len(inst.notes), "gain_db": gains.get(instrument_label(inst), 0.0)}
+            for inst in pm.instruments]
+    emit = getattr(args, 'progress', None)
+    if emit:
+        emit('progress', {'step': 'synthesize'})
     try:
-        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if getattr(args, 'incremental', False):
+            # Only the spans whose notes changed since the last render are synthesized again
+            audio, sr, diagnostics["incremental"] = render_incremental(
+                pm, render_cache_path(args.out), synth=synth, settings=gains)
+        elif synth:
+            sr, audio = synth(pm)
+            if n_segments > 1:
+                diagnostics["segments"] = {"count": n_segments}
+            if getattr(args, 'verify', False) and n_segments > 1 and not gains:
+                _, reference = synthesize(temp_midi)
+                error = spectral_error(audio, reference, sr)
+                diagnostics["segments"]["spectral_error"] = error
+                diagnostics["segments"]["within_tolerance"] = error <= SEGMENT_TOLERANCE
+                if error > SEGMENT_TOLERANCE:
+                    diagnostics.setdefault("warnings", []).append(
+                        f"Segmented render off by {error:.3f} (> {SEGMENT_TOLERANCE}); kept the single-pass render")
+                    audio = reference
+            audio = post_fx(audio, sr)
+        else:
+            sr, audio = synthesize(temp_midi)
+            audio = post_fx(audio, sr)
     except Exception as e:
         diagnostics["error"] = str(e)
-    
-    # 4. Minimal Mixing (Post-FX)
-    # Load WAV, apply slight reverb/compression simulation via scipy/numpy
-    if os.path.exists(args.out):
-        sr, audio = scipy.io.wavfile.read(args.out)
+        audio = None
 
-        # Convert to float for processing
-        audio = audio.astype(np.float32) / 32768.0
+    # A single encode of the final mix
+    fmt = getattr(args, 'format', None) or format_from_path(args.out)
+    out = audio_path(os.path.splitext(args.out)[0], fmt)
+    if audio is not None:
+        # The float mix goes straight to the encoder, which quantizes PCM formats once
+        jobs = [write_audio_async(out, audio, sr, fmt), submit_encode(write_peaks, audio, sr, out)]
+        if emit:
+            emit_chunks(emit, audio, sr)
+        for job in jobs:
+            job.result()
+        diagnostics["output"] = os.path.basename(out)
 
-        # Stereo spread simulation (duplicate mono to stereo with slight delay)
-        if len(audio.shape) == 1:
-            # Create a 2ms delay for one channel
-            delay_samples = int(sr * 0.002)
-            left = audio
-            right = np.zeros_like(audio)
-            right[delay_samples:] = audio[:-delay_samples]
-            audio = np.stack([left, right], axis=1)
-
-        # Subtle compression
-        threshold = 0.8
-        ratio = 2.0
-        mask = np.abs(audio) > threshold
-        audio[mask] = np.sign(audio[mask]) * (threshold + (np.abs(audio[mask]) - threshold) / ratio)
-
-        # Back to int16
-        audio = (audio * 32767.0).astype(np.int16)
-        scipy.io.wavfile.write(args.out, sr, audio)
-    
-    save_diagnostics(diagnostics, args.out.replace(".wav", "_diagnostics.json"))
+    save_diagnostics(diagnostics, os.path.splitext(out)[0] + "_diagnostics.json")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -101,5 +486,19 @@ if __name__ == "__main__":
     parser.add_argument('--out', required=True)
     parser.add_argument('--seed', type=int, default=42)
     parser.add_argument('--humanize', action='store_true')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Re-synthesize only what changed since the last render to --out')
+    parser.add_argument('--segments', type=int, default=1, help='Render this many time segments in parallel')
+    parser.add_argument('--jobs', type=int, default=None, help='Concurrent segment renders (default: one per segment)')
+    parser.add_argument('--verify', action='store_true',
+                        help='Also render in a single pass and keep it if the segmented render is off')
+    parser.add_argument('--format', choices=sorted(AUDIO_FORMATS),
+                        help='Output encoding (default: implied by the --out extension)')
+    parser.add_argument('--gain', action='append', metavar='NAME=DB',
+                        help='Gain of one instrument (track name, e.g. a stem, or GM name) in dB; -inf mutes. Repeatable')
     args = parser.parse_args()
+    try:
+        args.gains = parse_gains(args.gain)
+    except ValueError as e:
+        parser.error(str(e))
     render(args)
@@ -0,0 +1,271 @@
+import argparse
+import glob
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# Ensure pipeline directory is in path for imports
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from utils import file_digest
+
+# Index of pipeline runs: one row per run with its input hash, parameters,
+# per-stage timings and metrics, so runs can be filtered and compared without
+# reopening every output directory's JSON. Params and metrics are stored one
+# value per row and indexed by (name, value), which keeps "threshold=0.6, best
+# note_f1 first" an index lookup however many runs pile up.
+RUNS_DB = os.environ.get("RUNS_DB") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results", "runs.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    run_dir TEXT NOT NULL,
+    source TEXT NOT NULL,
+    created REAL NOT NULL,
+    input_path TEXT,
+    input_hash TEXT,
+    status TEXT,
+    wall_s REAL
+);
+CREATE TABLE IF NOT EXISTS params (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS stages (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    stage TEXT NOT NULL,
+    status TEXT,
+    cached INTEGER,
+    elapsed_s REAL,
+    PRIMARY KEY (run_id, stage)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_by_input ON runs(input_hash, created);
+CREATE INDEX IF NOT EXISTS runs_by_dir ON runs(run_dir);
+CREATE INDEX IF NOT EXISTS params_by_value ON params(name, value);
+CREATE INDEX IF NOT EXISTS metrics_by_value ON metrics(name, value);
+"""
+
+def connect(db=RUNS_DB):
+    os.makedirs(os.path.dirname(os.path.abspath(db)), exist_ok=True)
+    conn = sqlite3.connect(db, timeout=30)
+    conn.row_factory = sqlite3.Row
+    # Readers (the web API) don't block the pipeline appending
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    conn.executescript(SCHEMA)
+    return conn
+
+def param_value(value):
+    """Params are stored as JSON text, so 0.6, true and "wav" compare as they were passed."""
+    return json.dumps(value, sort_keys=True)
+
+def parse_param(text):
+    """name=value from the CLI or query string; the value is read as JSON where it parses."""
+    name, _, value = text.partition("=")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+def load_json(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def numeric_items(data, prefix=""):
+    return [(prefix + name, float(value)) for name, value in data.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)]
+
+def collect(run_dir):
+    """Metrics and stage timings a run left in its output directory."""
+    metrics = load_json(os.path.join(run_dir, "metrics.json")) or {}
+    values = numeric_items(metrics)
+    # Stage diagnostics (note counts, polyphony, confidence...) as "<stage>.<name>"
+    for path in sorted(glob.glob(os.path.join(run_dir, "*_diagnostics.json"))):
+        stage = os.path.basename(path)[:-len("_diagnostics.json")]
+        values += numeric_items(load_json(path) or {}, stage + ".")
+    # Per-stem separation scores, when the run had ground-truth stems
+    separation = load_json(os.path.join(run_dir, "separation_metrics.json")) or {}
+    for stem, scores in separation.get("separation_stems", {}).items():
+        values += numeric_items(scores, f"separation.{stem}.")
+    schedule = load_json(os.path.join(run_dir, "schedule.json")) or {}
+    stages = [(name, info.get("status"), int(bool(info.get("cached"))), info.get("elapsed_s"))
+              for name, info in schedule.get("stages", {}).items()]
+    status = "failed" if schedule.get("failed") else "abstained" if schedule.get("abstained") else metrics.get("status")
+    return values, stages, status, schedule.get("wall_s")
+
+def record_run(run_dir, input_path=None, params=None, source="pipeline", unique=False, db=RUNS_DB):
+    """
+    Appends the run in `run_dir` to the index and returns its id. With
+    unique=True a directory already indexed is left alone (content-keyed sweep
+    variants, backfills) and its latest id is returned, unless the directory
+    was re-run since (its metrics.json is newer than the row) or holds another input.
+    """
+    run_dir = os.path.abspath(run_dir)
+    if params is None:
+        env = load_json(os.path.join(run_dir, "env.json")) or {}
+        params = {"seed": env["seed"]} if "seed" in env else {}
+    values, stages, status, wall_s = collect(run_dir)
+    input_hash = file_digest(input_path) if input_path and os.path.exists(input_path) else None
+
+    conn = connect(db)
+    try:
+        with conn:
+            if unique:
+                row = conn.execute("SELECT id, created, input_hash FROM runs WHERE run_dir = ? ORDER BY id DESC LIMIT 1",
+                                   (run_dir,)).fetchone()
+                metrics_path = os.path.join(run_dir, "metrics.json")
+                rerun = os.path.exists(metrics_path) and os.path.getmtime(metrics_path) > row["created"] if row else False
+                if row and not rerun and input_hash in (None, row["input_hash"]):
+                    return row["id"]
+            run_id = conn.execute(
+                "INSERT INTO runs (run_dir, source, created, input_path, input_hash, status, wall_s) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_dir, source, time.time(), input_path and os.path.abspath(input_path), input_hash, status, wall_s)
+            ).lastrowid
+            conn.executemany("INSERT INTO params VALUES (?, ?, ?)",
+                             [(run_id, name, param_value(value)) for name, value in params.items()])
+            conn.executemany("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?)",
+                             [(run_id, name, value) for name, value in values])
+            conn.executemany("INSERT INTO stages VALUES (?, ?, ?, ?, ?)", [(run_id,) + stage for stage in stages])
+    finally:
+        conn.close()
+    return run_id
+
+def ingest(run_dirs, input_path=None, db=RUNS_DB):
+    """Backfills existing output directories (anything with a metrics.json) into the index."""
+    return [record_run(d, input_path, source="ingest", unique=True, db=db)
+            for d in run_dirs if os.path.exists(os.path.join(d, "metrics.json"))]
+
+def details(conn, run_ids):
+    """Full rows for run_ids, in that order, with params, metrics and stage timings attached."""
+    if not run_ids:
+        return []
+    marks = ",".join("?" * len(run_ids))
+    runs = {row["id"]: dict(row, params={}, metrics={}, stages={})
+            for row in conn.execute(f"SELECT * FROM runs WHERE id IN ({marks})", run_ids)}
+    for row in conn.execute(f"SELECT * FROM params WHERE run_id IN ({marks})", run_ids):
+        runs[row["run_id"]]["params"][row["name"]] = json.loads(row["value"])
+    for row in conn.execute(f"SELECT * FROM metrics WHERE run_id IN ({marks})", run_ids):
+        runs[row["run_id"]]["metrics"][row["name"]] = row["value"]
+    for row in conn.execute(f"SELECT * FROM stages WHERE run_id IN ({marks})", run_ids):
+        runs[row["run_id"]]["stages"][row["stage"]] = {
+            "status": row["status"], "cached": bool(row["cached"]), "elapsed_s": row["elapsed_s"]}
+    return [runs[i] for i in run_ids if i in runs]
+
+def find_runs(input_hash=None, params=None, order_by=None, ascending=False, limit=50, db=RUNS_DB):
+    """
+    Runs matching every given param (name -> value) and input hash, newest first
+    or ordered by a metric (runs without it are left out), up to `limit`.
+    """
+    query = ["SELECT r.id FROM runs r"]
+    where, args = [], []
+    if order_by:
+        query.append("JOIN metrics m ON m.run_id = r.id AND m.name = ?")
+        args.append(order_by)
+    if input_hash:
+        where.append("r.input_hash = ?")
+        args.append(input_hash)
+    for name, value in (params or {}).items():
+        where.append("r.id IN (SELECT run_id FROM params WHERE name = ? AND value = ?)")
+        args += [name, param_value(value)]
+    if where:
+        query.append("WHERE " + " AND ".join(where))
+    direction = "ASC" if ascending else "DESC"
+    query.append(f"ORDER BY m.value {direction}, r.id DESC" if order_by else "ORDER BY r.created DESC, r.id DESC")
+    query.append("LIMIT ?")
+    args.append(int(limit))
+
+    conn = connect(db)
+    try:
+        ids = [row["id"] for row in conn.execute(" ".join(query), args)]
+        return details(conn, ids)
+    finally:
+        conn.close()
+
+def compare(run_ids, db=RUNS_DB):
+    """Side by side: the runs, plus every metric's value per run and its change from the first run."""
+    conn = connect(db)
+    try:
+        runs = details(conn, list(run_ids))
+    finally:
+        conn.close()
+    names = sorted({name for run in runs for name in run["metrics"]})
+    table = {}
+    for name in names:
+        values = [run["metrics"].get(name) for run in runs]
+        base = values[0] if values else None
+        table[name] = {
+            "values": values,
+            "delta": [None if v is None or base is None else v - base for v in values],
+        }
+    return {"runs": runs, "metrics": table}
+
+def format_runs(runs, columns):
+    header = ["id", "created", "status"] + columns
+    lines = [header]
+    for run in runs:
+        values = dict(run["params"], **run["metrics"])
+        lines.append([str(run["id"]), time.strftime("%Y-%m-%d %H:%M", time.localtime(run["created"])),
+                      str(run["status"])] + [f"{values[c]:.4g}" if isinstance(values.get(c), float)
+                                             else str(values.get(c, "")) for c in columns])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join("  ".join(cell.rjust(w) for cell, w in zip(line, widths)) for line in lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Index and compare pipeline runs")
+    parser.add_argument('--db', default=RUNS_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="Append a finished run to the index")
+    rec.add_argument('dir')
+    rec.add_argument('--input')
+    rec.add_argument('--param', action='append', default=[], metavar='NAME=VALUE')
+
+    add = commands.add_parser("ingest", help="Index existing output directories (once each)")
+    add.add_argument('dirs', nargs='+')
+    add.add_argument('--input', help='Input the runs were made from (for its hash)')
+
+    ls = commands.add_parser("list", help="Find runs")
+    ls.add_argument('--input', help='Only runs of this input file (matched by content hash)')
+    ls.add_argument('--input-hash')
+    ls.add_argument('--param', action='append', default=[], metavar='NAME=VALUE')
+    ls.add_argument('--order-by', metavar='METRIC')
+    ls.add_argument('--ascending', action='store_true')
+    ls.add_argument('--limit', type=int, default=50)
+    ls.add_argument('--columns', nargs='+', default=["threshold", "note_f1", "spectral_mse", "separation_sdr"])
+    ls.add_argument('--json', action='store_true')
+
+    cmp = commands.add_parser("compare", help="Metrics of several runs side by side")
+    cmp.add_argument('ids', type=int, nargs='+')
+
+    args = parser.parse_args()
+    if args.command == "record":
+        run_id = record_run(args.dir, args.input, dict(map(parse_param, args.param)) or None, source="cli", db=args.db)
+        print(f"[*] Indexed as run {run_id}")
+    elif args.command == "ingest":
+        ids = ingest(args.dirs, args.input, db=args.db)
+        print(f"[*] Indexed {len(ids)} runs in {args.db}")
+    elif args.command == "list":
+        input_hash = file_digest(args.input) if args.input else args.input_hash
+        runs = find_runs(input_hash, dict(map(parse_param, args.param)), args.order_by, args.ascending,
+                         args.limit, db=args.db)
+        print(json.dumps(runs, indent=2) if args.json else format_runs(runs, args.columns))
+    else:
+        result = compare(args.ids, db=args.db)
+        width = max([len(name) for name in result["metrics"]] + [6])
+        print(f"{'metric':<{width}}  " + "  ".join(f"{'run ' + str(run['id']):>12}" for run in result["runs"]))
+        for name, row in result["metrics"].items():
+            cells = ["" if v is None else f"{v:.4g}" for v in row["values"]]
+            print(f"{name:<{width}}  " + "  ".join(f"{cell:>12}" for cell in cells))
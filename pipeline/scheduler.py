@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Stage:
+    """
+    One pipeline step: a callable plus the files it reads and writes.
+    Dependencies are inferred from inputs produced by other stages' outputs.
+    `params` fingerprints everything else the outputs depend on (thresholds, seeds...).
+    `diagnostics` is the JSON file where the stage reports `"status": "abstained"`
+    when its input has nothing for it to do (noise, silence).
+    """
+
+    def __init__(self, name, func, inputs=(), outputs=(), params=None, diagnostics=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.diagnostics = diagnostics
+
+    def fingerprint(self):
+        blob = json.dumps(self.params, sort_keys=True, default=str)
+        return hashlib.sha1(blob.encode()).hexdigest()
+
+def build_graph(stages):
+    """Maps each stage name to the names of the stages it depends on."""
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producers[os.path.abspath(path)] = stage.name
+    deps = {}
+    for stage in stages:
+        deps[stage.name] = sorted({
+            producers[os.path.abspath(path)] for path in stage.inputs
+            if os.path.abspath(path) in producers and producers[os.path.abspath(path)] != stage.name
+        })
+    return deps
+
+def is_cached(stage, state_dir):
+    """Outputs exist, are newer than every input and were made with the same params."""
+    stamp = os.path.join(state_dir, f".stage_{stage.name}.json")
+    if not stage.outputs or not os.path.exists(stamp):
+        return False
+    with open(stamp) as f:
+        if json.load(f).get("fingerprint") != stage.fingerprint():
+            return False
+    if not all(os.path.exists(path) for path in stage.outputs):
+        return False
+    oldest_output = min(os.path.getmtime(path) for path in stage.outputs)
+    return all(not os.path.exists(path) or os.path.getmtime(path) <= oldest_output for path in stage.inputs)
+
+def abstain_reason(stage):
+    """Why the stage's last run abstained, per its diagnostics, or None if it didn't."""
+    if not stage.diagnostics or not os.path.exists(stage.diagnostics):
+        return None
+    with open(stage.diagnostics) as f:
+        diagnostics = json.load(f)
+    if diagnostics.get("status") != "abstained":
+        return None
+    return diagnostics.get("reason", "abstained")
+
+def critical_path(stages, deps, timings):
+    """Longest chain of dependent stages by elapsed time."""
+    finish = {}
+    best_parent = {}
+    order = topological_order(stages, deps)
+    for name in order:
+        parent = max(deps[name], key=lambda d: finish[d], default=None)
+        best_parent[name] = parent
+        finish[name] = (finish[parent] if parent else 0.0) + timings.get(name, 0.0)
+    if not finish:
+        return [], 0.0
+    node = max(finish, key=finish.get)
+    total = finish[node]
+    path = []
+    while node:
+        path.append(node)
+        node = best_parent[node]
+    return path[::-1], total
+
+def topological_order(stages, deps):
+    order, seen = [], set()
+
+    def visit(name, trail=()):
+        if name in trail:
+            raise ValueError(f"Cycle in pipeline stages: {' -> '.join(trail + (name,))}")
+        if name in seen:
+            return
+        for dep in deps[name]:
+            visit(dep, trail + (name,))
+        seen.add(name)
+        order.append(name)
+
+    for stage in stages:
+        visit(stage.name)
+    return order
+
+def run_stages(stages, state_dir, max_workers=None, force=False, log=print):
+    """
+    Runs stages as a dependency graph, independent ones concurrently.
+    A stage is skipped when it is cached and nothing upstream re-ran. Stages
+    downstream of one that abstained are not run either (and lose any outputs
+    of earlier runs), since they would only score or render an empty result.
+    Returns a report with per-stage timings, the critical path, any failure
+    and the stages that abstained.
+    """
+    deps = build_graph(stages)
+    topological_order(stages, deps)
+    by_name = {stage.name: stage for stage in stages}
+    report = {"stages": {}, "failed": None, "abstained": []}
+    done, reran = set(), set()
+    running = {}
+    start = time.perf_counter()
+
+    def run(stage):
+        began = time.perf_counter()
+        stage.func()
+        return began - start, time.perf_counter() - start
+
+    def mark_abstained(stage):
+        reason = abstain_reason(stage)
+        if reason:
+            log(f"[*] {stage.name}: abstained ({reason})")
+            report["stages"][stage.name].update(status="abstained", reason=reason)
+            report["abstained"].append(stage.name)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as pool:
+        while len(done) < len(stages):
+            for stage in stages:
+                if stage.name in done or stage in running.values():
+                    continue
+                if not all(dep in done for dep in deps[stage.name]):
+                    continue
+                statuses = {dep: report["stages"][dep]["status"] for dep in deps[stage.name]}
+                blocked = [dep for dep, status in statuses.items() if status not in ("success", "abstained")]
+                if blocked:
+                    report["stages"][stage.name] = {"status": "blocked", "blocked_by": blocked, "elapsed_s": 0.0}
+                    done.add(stage.name)
+                    continue
+                upstream = [dep for dep, status in statuses.items() if status == "abstained"]
+                if upstream:
+                    log(f"[*] {stage.name}: skipped, {', '.join(upstream)} abstained")
+                    for path in stage.outputs:
+                        if os.path.exists(path):
+                            os.remove(path)
+                    report["stages"][stage.name] = {"status": "abstained", "abstained_upstream": upstream,
+                                                    "elapsed_s": 0.0}
+                    done.add(stage.name)
+                    continue
+                if not force and not (set(deps[stage.name]) & reran) and is_cached(stage, state_dir):
+                    log(f"[*] {stage.name}: cached")
+                    report["stages"][stage.name] = {"status": "success", "cached": True, "elapsed_s": 0.0}
+                    mark_abstained(stage)
+                    done.add(stage.name)
+                    continue
+                running[pool.submit(run, stage)] = stage
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                done.add(stage.name)
+                reran.add(stage.name)
+                try:
+                    began, ended = future.result()
+                    report["stages"][stage.name] = {
+                        "status": "success", "cached": False,
+                        "start_s": began, "end_s": ended, "elapsed_s": ended - began
+                    }
+                    with open(os.path.join(state_dir, f".stage_{stage.name}.json"), "w") as f:
+                        json.dump({"fingerprint": stage.fingerprint()}, f)
+                    mark_abstained(stage)
+                except Exception as e:
+                    report["stages"][stage.name] = {
+                        "status": "failed", "error": str(e), "details": traceback.format_exc(), "elapsed_s": 0.0
+                    }
+                    report["failed"] = report["failed"] or stage.name
+
+    timings = {name: info["elapsed_s"] for name, info in report["stages"].items()}
+    path, path_time = critical_path(stages, deps, timings)
+    report["critical_path"] = path
+    report["critical_path_s"] = path_time
+    report["serial_s"] = sum(timings.values())
+    report["wall_s"] = time.perf_counter() - start
+    report["dependencies"] = deps
+    return report
@@ -3,75 +3,141 @@ import os
 import json
 import librosa
 import numpy as np
-import soundfile as sf
 import sys
 
 # Ensure pipeline directory is in path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from utils import set_seed, save_diagnostics
+from utils import (
+    set_seed, save_diagnostics, audio_path, write_audio_async, submit_encode, remove_stems,
+    AUDIO_FORMATS, STEM_BUNDLE, STEM_NAMES
+)
+from peaks import write_peaks
+from hpss import hpss_audio, KERNEL_SIZE
+from spectral import stft, istft, as_dsp, N_FFT, HOP_LENGTH
+from transcribe import prescreen
 
-def separate(args):
-    set_seed(args.seed)
-    diagnostics = {
-        "stems_created": [],
-        "warnings": [],
-        "status": "success"
-    }
-
-    # 1. Load Audio
-    y, sr = librosa.load(args.input, sr=22050)
+# Streaming mode: context on each side of a block so its interior matches the
+# whole-file result (HPSS time median, then the band-split STFT, both reach this far)
+BLOCK_CONTEXT_FRAMES = KERNEL_SIZE + 4 * N_FFT // HOP_LENGTH
 
+def split_stems(y, sr, bass_cutoff=200.0, vocals_cutoff=4000.0):
+    """Vocals, bass, drums and other stems of y."""
     # 2. Harmonic-Percussive Source Separation (HPSS)
     # Percussive -> Drums
     # Harmonic -> (Vocals + Bass + Other)
-    harmonic, percussive = librosa.effects.hpss(y)
+    harmonic, percussive = hpss_audio(y)
 
     # 3. Further split Harmonic into Bass and Vocals/Other
     # We use a simple frequency-based mask for "Lean" implementation
-    S_harm = librosa.stft(harmonic)
+    S_harm = stft(harmonic)
     freqs = librosa.fft_frequencies(sr=sr)
 
     # Bass: < 200 Hz
-    bass_mask = freqs < 200
-    S_bass = S_harm.copy()
-    S_bass[~bass_mask, :] = 0
-    bass = librosa.istft(S_bass)
+    # Vocals typically 200Hz - 4kHz
+    # Other: > 4kHz or other residue
+    masks = {
+        "vocals": (freqs >= bass_cutoff) & (freqs < vocals_cutoff),
+        "bass": freqs < bass_cutoff,
+        "other": freqs >= vocals_cutoff
+    }
+    # All three bands are inverted in one batched iSTFT
+    S_bands = np.stack([S_harm * mask[:, None] for mask in masks.values()])
+    stems = dict(zip(masks, istft(S_bands)))
+    stems["drums"] = percussive
+    return {name: stems[name] for name in STEM_NAMES}
 
-    # Vocals/Other: > 200 Hz
-    S_rest = S_harm.copy()
-    S_rest[bass_mask, :] = 0
+def split_stems_blocked(y, sr, block_seconds, bass_cutoff=200.0, vocals_cutoff=4000.0, progress=None):
+    """
+    split_stems() one block at a time, so the spectrograms never cover more than
+    one block plus context; the stems match the whole-file ones up to float rounding.
+    progress(fraction) is called after each block.
+    """
+    block = max(1, int(block_seconds * sr) // HOP_LENGTH) * HOP_LENGTH
+    context = BLOCK_CONTEXT_FRAMES * HOP_LENGTH
+    # Same lengths as split_stems(): the bands come back cut to whole hops
+    band_length = len(y) // HOP_LENGTH * HOP_LENGTH
+    stems = {name: np.zeros(len(y) if name == "drums" else band_length, dtype=y.dtype) for name in STEM_NAMES}
+    for start in range(0, len(y), block):
+        c0, c1 = max(0, start - context), min(len(y), start + block + context)
+        parts = split_stems(y[c0:c1], sr, bass_cutoff, vocals_cutoff)
+        for name, part in parts.items():
+            out = stems[name]
+            end = min(start + block, len(out))
+            out[start:end] = part[start - c0:end - c0]
+        if progress:
+            progress(min(start + block, len(y)) / len(y))
+    return stems
 
-    # Within > 200 Hz, we can attempt to isolate Vocals (mid-range) from Other (high/low residue)
-    # Vocals typically 200Hz - 4kHz
-    vocals_mask = (freqs >= 200) & (freqs < 4000)
-    S_vocals = S_harm.copy()
-    S_vocals[~vocals_mask, :] = 0
-    vocals = librosa.istft(S_vocals)
+def separate(args):
+    set_seed(args.seed)
+    diagnostics = {
+        "stems_created": [],
+        "warnings": [],
+        "status": "success"
+    }
 
-    # Other: > 4kHz or other residue
-    other_mask = freqs >= 4000
-    S_other = S_harm.copy()
-    S_other[~other_mask, :] = 0
-    other = librosa.istft(S_other)
+    # 1. Load Audio (or take the signal the caller already decoded)
+    audio = getattr(args, 'audio', None)
+    y, sr = audio if audio is not None else librosa.load(args.input, sr=22050)
+    y = as_dsp(y)
 
-    # 4. Save Stems
+    # Noise and silence have no stems worth separating; stop before HPSS
+    screen = prescreen(y, sr)
+    diagnostics["prescreen"] = screen
     stem_dir = os.path.join(args.outdir, "stems")
-    os.makedirs(stem_dir, exist_ok=True)
+    if screen["abstain"]:
+        diagnostics["status"] = "abstained"
+        diagnostics["reason"] = screen["reason"]
+        # Leave no stems of an earlier input behind to be scored or transcribed
+        if os.path.isdir(stem_dir):
+            remove_stems(stem_dir)
+        save_diagnostics(diagnostics, os.path.join(args.outdir, "separation_diagnostics.json"))
+        return
 
-    stems = {
-        "vocals": vocals,
-        "bass": bass,
-        "drums": percussive,
-        "other": other
-    }
+    bass_cutoff = getattr(args, 'bass_cutoff', 200.0)
+    vocals_cutoff = getattr(args, 'vocals_cutoff', 4000.0)
+    block_seconds = getattr(args, 'block_seconds', None)
+    emit = getattr(args, 'progress', None)
+    if emit:
+        emit('progress', {'step': 'split', 'fraction': 0.0})
+    if block_seconds:
+        progress = emit and (lambda fraction: emit('progress', {'step': 'split', 'fraction': fraction}))
+        stems = split_stems_blocked(y, sr, block_seconds, bass_cutoff, vocals_cutoff, progress)
+        diagnostics["mode"] = {"streaming": True, "block_seconds": block_seconds}
+    else:
+        stems = split_stems(y, sr, bass_cutoff, vocals_cutoff)
+
+    # 4. Save Stems
+    os.makedirs(stem_dir, exist_ok=True)
+    # A run in another format would otherwise leave files the readers prefer
+    remove_stems(stem_dir)
 
+    # Encoding runs on the background pool while the next stem is synthesized
+    fmt = getattr(args, 'format', 'wav')
+    pending = []
+    bundle = {}
     for name, data in stems.items():
         # Normalize and save
         if np.max(np.abs(data)) > 0:
             data = librosa.util.normalize(data)
-        out_path = os.path.join(stem_dir, f"{name}.wav")
-        sf.write(out_path, data, sr)
+        base = os.path.join(stem_dir, name)
+        pending.append(submit_encode(write_peaks, data, sr, base))
+        if fmt == "npz":
+            bundle[name] = data.astype(np.float32)
+            out_path = os.path.join(stem_dir, STEM_BUNDLE)
+        else:
+            out_path = audio_path(base, fmt)
+            pending.append(write_audio_async(out_path, data, sr, fmt))
         diagnostics["stems_created"].append(name)
+        diagnostics.setdefault("stem_files", {})[name] = os.path.relpath(out_path, args.outdir)
+        if emit and fmt != "npz":
+            pending[-1].result()
+            emit('stem', {'name': name, 'path': out_path})
+
+    if bundle:
+        np.savez_compressed(os.path.join(stem_dir, STEM_BUNDLE), sr=sr, **bundle)
+    for job in pending:
+        job.result()
 
     # 5. Failure Honesty
     # If the input is too sparse or too dense, warn.
@@ -85,5 +151,11 @@ if __name__ == "__main__":
     parser.add_argument('--input', required=True)
     parser.add_argument('--outdir', required=True)
     parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--bass-cutoff', type=float, default=200.0, help='Bass/vocals crossover in Hz')
+    parser.add_argument('--vocals-cutoff', type=float, default=4000.0, help='Vocals/other crossover in Hz')
+    parser.add_argument('--format', choices=sorted(AUDIO_FORMATS) + ["npz"], default='wav',
+                        help='Stem encoding (npz bundles all stems as float32 in stems.npz)')
+    parser.add_argument('--block-seconds', type=float, default=None,
+                        help='Streaming mode: separate in blocks of this length to bound memory')
     args = parser.parse_args()
     separate(args)
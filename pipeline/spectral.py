@@ -0,0 +1,180 @@
+import functools
+import os
+import warnings
+import librosa
+import numpy as np
+import scipy.fft
+import scipy.signal
+
+# Shared STFT/iSTFT for every stage: windows and overlap-add normalizers are
+# cached per size, signals can be batched along leading axes, and all FFTs
+# (including the ones librosa runs for the CQT, mel and flatness features) go
+# through scipy.fft with THREADS workers. scipy keeps its own plan cache.
+N_FFT = 2048
+HOP_LENGTH = 512
+THREADS = os.cpu_count() or 1
+STFT_BLOCK_FRAMES = 256
+# Working precision of every stage: signals are float32 and spectrograms
+# complex64 unless set_precision("float64") (or PIPELINE_PRECISION) asks for
+# the wider reference path. Stage entry points coerce with as_dsp(), and the
+# dB/energy helpers below work in place so big arrays aren't copied wider.
+PRECISIONS = {"float32": np.float32, "float64": np.float64}
+PRECISION = np.float32
+
+# numba threading layer for the parallel HPSS kernels. It has to be chosen before
+# numba starts its threads, which set_threads() does, so it is set here too. The
+# default TBB layer hangs interpreter shutdown once a kernel has run off the main
+# thread (every scheduler stage and web job does), and OpenMP hangs in a process
+# forked after using it (the sweep's worker pool). workqueue is safe for both
+# but not for concurrent launches, which hpss.py serializes.
+NUMBA_THREADING_LAYER = "workqueue"
+
+def set_threads(n):
+    """Thread budget of this process: FFT workers and numba-parallel kernels (HPSS)."""
+    global THREADS
+    THREADS = max(1, int(n))
+    try:
+        import numba
+        numba.config.THREADING_LAYER = NUMBA_THREADING_LAYER
+        numba.set_num_threads(min(THREADS, numba.config.NUMBA_NUM_THREADS))
+    except ImportError:
+        pass
+
+class ThreadedFFT:
+    """numpy.fft-style facade over scipy.fft with THREADS workers, for librosa.set_fftlib."""
+
+    TRANSFORMS = {"fft", "ifft", "rfft", "irfft", "fftn", "ifftn", "rfftn", "irfftn", "hfft", "ihfft"}
+
+    def __getattr__(self, name):
+        func = getattr(scipy.fft, name)
+        if name not in self.TRANSFORMS:
+            return func
+
+        def transform(*args, out=None, **kwargs):
+            result = func(*args, workers=THREADS, **kwargs)
+            if out is None:
+                return result
+            out[...] = result
+            return out
+        return transform
+
+def set_precision(name):
+    """Working precision of this process: "float32" (default) or "float64"."""
+    global PRECISION
+    if name not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{name}'; expected one of {sorted(PRECISIONS)}")
+    PRECISION = PRECISIONS[name]
+
+def as_dsp(y):
+    """y in the working precision; no copy when it already is."""
+    return np.asarray(y, dtype=PRECISION)
+
+def amplitude_db(S, ref=np.max, amin=1e-5, top_db=80.0):
+    """librosa.amplitude_to_db(S), overwriting the magnitudes in S (which must be writable)."""
+    ref_value = ref(S) if callable(ref) else ref
+    np.maximum(S, amin, out=S)
+    np.log10(S, out=S)
+    S *= 20.0
+    S -= 20.0 * np.log10(max(amin, ref_value))
+    if top_db is not None:
+        np.maximum(S, S.max(initial=-np.inf) - top_db, out=S)
+    return S
+
+def power_db(S, ref=np.max, amin=1e-10, top_db=80.0):
+    """librosa.power_to_db(S), overwriting the powers in S (which must be writable)."""
+    ref_value = ref(S) if callable(ref) else ref
+    np.maximum(S, amin, out=S)
+    np.log10(S, out=S)
+    S *= 10.0
+    S -= 10.0 * np.log10(max(amin, ref_value))
+    if top_db is not None:
+        np.maximum(S, S.max(initial=-np.inf) - top_db, out=S)
+    return S
+
+def energy(y, block=1 << 16):
+    """Sum of squares of y, without a full-size temporary; blocks are summed in float64."""
+    y = np.ravel(y)
+    return sum(float(np.dot(y[i:i + block], y[i:i + block])) for i in range(0, len(y), block))
+
+if os.environ.get("PIPELINE_THREADS"):
+    set_threads(os.environ["PIPELINE_THREADS"])
+if os.environ.get("PIPELINE_PRECISION"):
+    set_precision(os.environ["PIPELINE_PRECISION"])
+
+with warnings.catch_warnings():
+    # Deprecated in librosa 0.11 but still the only hook into its internal FFTs
+    warnings.simplefilter("ignore", FutureWarning)
+    librosa.set_fftlib(ThreadedFFT())
+
+@functools.lru_cache(maxsize=None)
+def get_window(window, n_fft, dtype=np.float32):
+    window = scipy.signal.get_window(window, n_fft, fftbins=True).astype(dtype)
+    window.flags.writeable = False
+    return window
+
+def _overlap_add(frames, hop_length):
+    """Sums (..., n_fft, n_frames) frames spaced hop_length apart into (..., n_fft + hop * (n_frames - 1))."""
+    n_fft, n_frames = frames.shape[-2:]
+    y = np.zeros(frames.shape[:-2] + (n_fft + hop_length * (n_frames - 1),), dtype=frames.dtype)
+    if n_fft % hop_length == 0:
+        # Each hop-sized slice of the frame lines up with a contiguous run of the output
+        for k in range(n_fft // hop_length):
+            part = frames[..., k * hop_length:(k + 1) * hop_length, :]
+            y[..., k * hop_length:k * hop_length + hop_length * n_frames] += np.swapaxes(part, -1, -2).reshape(
+                frames.shape[:-2] + (-1,))
+    else:
+        for t in range(n_frames):
+            y[..., t * hop_length:t * hop_length + n_fft] += frames[..., t]
+    return y
+
+@functools.lru_cache(maxsize=32)
+def window_sumsquare(window, n_frames, n_fft, hop_length):
+    """Overlap-added squared window: the iSTFT normalizer (librosa.filters.window_sumsquare)."""
+    w = get_window(window, n_fft, np.float64) ** 2
+    total = _overlap_add(np.repeat(w[:, None], n_frames, axis=1), hop_length)
+    total.flags.writeable = False
+    return total
+
+def stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH, window='hann', frame_stride=1):
+    """
+    Centered, zero-padded STFT like librosa.stft, batched over leading axes of y.
+    Returns (..., 1 + n_fft // 2, n_frames); with frame_stride > 1 only every
+    frame_stride-th of those frames is computed (for cheap estimates).
+    """
+    y = as_dsp(y)
+    pad = [(0, 0)] * (y.ndim - 1) + [(n_fft // 2, n_fft // 2)]
+    frames = np.lib.stride_tricks.sliding_window_view(np.pad(y, pad), n_fft, axis=-1)[..., ::hop_length * frame_stride, :]
+    w = get_window(window, n_fft, y.dtype)
+    # Windowed a block of frames at a time: the full windowed-frame array would be as big as S
+    S = np.empty(frames.shape[:-1] + (1 + n_fft // 2,), dtype=np.result_type(y.dtype, np.complex64))
+    for t in range(0, frames.shape[-2], STFT_BLOCK_FRAMES):
+        block = slice(t, t + STFT_BLOCK_FRAMES)
+        S[..., block, :] = scipy.fft.rfft(frames[..., block, :] * w, axis=-1, workers=THREADS)
+    return np.swapaxes(S, -1, -2)
+
+def istft(S, hop_length=HOP_LENGTH, window='hann', length=None):
+    """Inverse of stft() like librosa.istft, batched over leading axes of S."""
+    n_fft = 2 * (S.shape[-2] - 1)
+    n_frames = S.shape[-1]
+    if length:
+        n_frames = min(n_frames, int(np.ceil((length + 2 * (n_fft // 2)) / hop_length)))
+    dtype = PRECISION
+
+    w = get_window(window, n_fft, dtype)[:, None]
+    # Inverted and overlap-added a block of frames at a time, like stft()
+    y = np.zeros(S.shape[:-2] + (n_fft + hop_length * (n_frames - 1),), dtype=dtype)
+    for t in range(0, n_frames, STFT_BLOCK_FRAMES):
+        frames = scipy.fft.irfft(S[..., t:min(n_frames, t + STFT_BLOCK_FRAMES)], n=n_fft, axis=-2,
+                                 workers=THREADS).astype(dtype, copy=False)
+        frames *= w
+        part = _overlap_add(frames, hop_length)
+        y[..., t * hop_length:t * hop_length + part.shape[-1]] += part
+    norm = window_sumsquare(window, n_frames, n_fft, hop_length)
+
+    start = n_fft // 2
+    size = length or len(norm) - 2 * start
+    y = librosa.util.fix_length(y[..., start:], size=size)
+    norm = librosa.util.fix_length(norm[start:], size=size)
+    nonzero = norm > np.finfo(norm.dtype).tiny
+    y[..., nonzero] /= norm[nonzero].astype(dtype)
+    return y
@@ -8,156 +8,537 @@ import sys
 
 # Ensure pipeline directory is in path for imports
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from utils import set_seed, save_diagnostics
+from utils import set_seed, save_diagnostics, load_stem, STEM_NAMES
+import spectral
+from spectral import stft, as_dsp, amplitude_db, power_db
+from backends import load_backend, MODEL_CONFIG
 
-def transcribe(args):
-    set_seed(args.seed)
-    diagnostics = {
-        "confidence": 0.0,
-        "polyphony_max": 0,
-        "warnings": [],
-        "status": "success"
-    }
+HOP_LENGTH = 512
+N_BINS = 84
+FMIN_NOTE = 'C1'
+COARSE_BINS_PER_OCTAVE = 6
+FLATNESS_WARN = 0.1
+FLATNESS_ABSTAIN = 0.5
+MIN_NOTE_DURATION = 0.05
+STREAM_BLOCK_FRAMES = 43 # ~1s of frames per progress event
+PRESCREEN_STRIDE = 8 # the pre-screen looks at every 8th analysis frame
+PRESCREEN_CONFIDENCE = 3.0 # standard errors the flatness estimate must clear to abstain early
+MAX_POLYPHONY = 20 # strongest bins kept per frame
+# Partials 2-5 of a note land this many bins (semitones) above it; a bin there at least
+# HARMONIC_MARGIN_DB weaker than the bin below is taken for an overtone, not a note
+HARMONIC_OFFSETS = (12, 19, 24, 28)
+HARMONIC_MARGIN_DB = 6.0
+POLYPHONY_WARN_GAP = 0.5 # seconds between dense frames still reported as one range
+# Multitrack mode: the General MIDI instrument each pitched stem is written as;
+# drums go on the percussion channel as kit hits instead
+STEM_INSTRUMENTS = {"vocals": "Lead 6 (voice)", "bass": "Electric Bass (finger)", "other": "Acoustic Grand Piano"}
+# Drum hit -> GM kit note by the onset frame's spectral centroid: kick, snare, closed hi-hat
+DRUM_CENTROIDS = ((300.0, 36), (3000.0, 38), (np.inf, 42))
+DRUM_HIT_SECONDS = 0.1
+
+def detect_active_segments(y, sr, hop_length=HOP_LENGTH, silence_db=-60.0, pad=0.1):
+    """
+    Cheap energy gate used by the sparse mode.
+    Returns merged (start_frame, end_frame) ranges that carry signal.
+    """
+    rms = librosa.feature.rms(y=y, frame_length=2048, hop_length=hop_length)[0]
+    if np.max(rms) <= 0:
+        return []
+    rms_db = amplitude_db(rms)
+    active = rms_db > silence_db
+
+    # Dilate so note attacks/releases at the edges of a segment survive
+    pad_frames = int(np.ceil(pad * sr / hop_length))
+    if pad_frames > 0:
+        kernel = np.ones(2 * pad_frames + 1, dtype=int)
+        active = np.convolve(active.astype(int), kernel, mode='same') > 0
+
+    edges = np.diff(np.concatenate([[0], active.astype(int), [0]]))
+    starts = np.where(edges == 1)[0]
+    ends = np.where(edges == -1)[0]
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def prescreen(y, sr, hop_length=HOP_LENGTH, stride=PRESCREEN_STRIDE, active_only=False, silence_db=-60.0):
+    """
+    Cheap look at a strided subsample of the frames analyze() would use: spectral
+    flatness (as librosa.feature.spectral_flatness), a polyphony estimate (semitones
+    above the default threshold) and an SNR estimate (energy over the median-bin noise
+    floor). Only abstains when the flatness is over FLATNESS_ABSTAIN by a clear
+    statistical margin, or there is no signal at all; anything borderline is left
+    to the full analysis.
+    With active_only, frames below silence_db are ignored, as in sparse mode.
+    """
+    power = np.abs(stft(y, hop_length=hop_length, frame_stride=stride))
+    np.square(power, out=power)
+    energy = power.sum(axis=0)
+    result = {"frames": int(power.shape[1]), "stride": stride, "flatness": 1.0, "polyphony": 0,
+              "snr_db": 0.0, "abstain": False}
+    if energy.max(initial=0) <= 0:
+        return dict(result, abstain=True, reason="Input is silent")
+    if active_only:
+        power = power[:, 10 * np.log10(np.maximum(energy, 1e-20) / energy.max()) > silence_db]
+        energy = power.sum(axis=0)
+
+    power_thresh = np.maximum(1e-10, power)
+    flatness = np.exp(np.mean(np.log(power_thresh), axis=0)) / np.mean(power_thresh, axis=0)
+    result["flatness"] = float(np.mean(flatness))
+    margin = PRESCREEN_CONFIDENCE * np.std(flatness) / np.sqrt(len(flatness))
+
+    # Distinct semitones in C1..C8 above the threshold, relative to the loudest bin
+    freqs = librosa.fft_frequencies(sr=sr)
+    fmin = librosa.note_to_hz(FMIN_NOTE)
+    in_range = (freqs >= fmin) & (freqs < fmin * 2 ** (N_BINS / 12))
+    pitches = np.round(librosa.hz_to_midi(freqs[in_range])).astype(int)
+    db = power_db(power[in_range])
+    starts = np.flatnonzero(np.diff(pitches, prepend=-1))
+    polyphony = (np.add.reduceat(db > threshold_to_db(0.6), starts, axis=0) > 0).sum(axis=0)
+    result["polyphony"] = int(np.percentile(polyphony, 95))
+
+    noise_floor = np.median(power_thresh, axis=0) * power.shape[0]
+    result["snr_db"] = float(np.median(10 * np.log10(np.maximum(energy, 1e-20) / noise_floor)))
+    if result["flatness"] - margin > FLATNESS_ABSTAIN:
+        result.update(abstain=True, reason="Input too noisy")
+    return result
+
+def threshold_to_db(threshold):
+    """Map the 0-1 threshold knob onto the dB scale of the normalized CQT."""
+    return threshold * -40
+
+def coarse_regions(y, sr, threshold_db, quality, hop_length=HOP_LENGTH, n_bins=N_BINS):
+    """
+    Low-cost first pass: larger hop and fewer bins per octave.
+    Returns fine-resolution (start_frame, end_frame, octave_lo, octave_hi) regions
+    worth a full-resolution look. Lower quality means a coarser, tighter search.
+    """
+    hop_factor = 4 if quality < 0.5 else 2
+    margin_db = 3.0 + 12.0 * quality
+    octave_pad = 0 if quality < 0.5 else 1
+    n_octaves = int(np.ceil(n_bins / 12))
+
+    coarse = np.abs(librosa.cqt(
+        y, sr=sr, hop_length=hop_length * hop_factor, fmin=librosa.note_to_hz(FMIN_NOTE),
+        n_bins=n_octaves * COARSE_BINS_PER_OCTAVE, bins_per_octave=COARSE_BINS_PER_OCTAVE
+    ))
+    if np.max(coarse) <= 0:
+        return []
+    coarse_db = amplitude_db(coarse)
+
+    # Loosen the threshold by a margin so the fine pass gets the final say
+    hits = coarse_db > threshold_db - margin_db
+    by_octave = hits.reshape(n_octaves, COARSE_BINS_PER_OCTAVE, -1).any(axis=1)
+    active = by_octave.any(axis=0)
 
-    # 1. Preprocess
-    y, sr = librosa.load(args.input, sr=22050)
-    y = librosa.util.normalize(y)
+    edges = np.diff(np.concatenate([[0], active.astype(int), [0]]))
+    regions = []
+    for start, end in zip(np.where(edges == 1)[0], np.where(edges == -1)[0]):
+        octaves = np.where(by_octave[:, start:end].any(axis=1))[0]
+        lo = max(0, int(octaves.min()) - octave_pad)
+        hi = min(n_octaves - 1, int(octaves.max()) + octave_pad)
+        # One coarse frame of slack either side for accurate onsets/offsets
+        regions.append((max(0, int(start - 1) * hop_factor), int(end + 1) * hop_factor, lo, hi))
+    return regions
+
+def sparse_cqt(y, sr, segments, hop_length=HOP_LENGTH, fmin=None, n_bins=N_BINS):
+    """
+    CQT magnitude computed only around active segments.
+    Segments are (start_frame, end_frame) or (start_frame, end_frame, octave_lo, octave_hi);
+    when octaves are given only those rows are computed.
+    Cells outside the segments are left at zero (i.e. the dB floor).
+    Returns the CQT and the number of frames actually filled.
+    """
+    if fmin is None:
+        fmin = librosa.note_to_hz(FMIN_NOTE)
+    n_octaves = int(np.ceil(n_bins / 12))
+    n_frames = 1 + len(y) // hop_length
+    cqt = np.zeros((n_bins, n_frames), dtype=y.dtype)
+
+    # Context on each side covers the longest (lowest) CQT filter
+    Q = 1.0 / (2.0 ** (1.0 / 12) - 1)
+    ctx_frames = int(np.ceil(Q * sr / fmin / 2 / hop_length)) + 1
+
+    # Merge segments whose contexts overlap so no frame is computed twice
+    merged = []
+    for seg in segments:
+        start, end = seg[0], min(seg[1], n_frames)
+        lo, hi = seg[2:] if len(seg) == 4 else (0, n_octaves - 1)
+        if merged and start - ctx_frames <= merged[-1][1] + ctx_frames:
+            last = merged[-1]
+            last[1] = max(last[1], end)
+            last[2] = min(last[2], lo)
+            last[3] = max(last[3], hi)
+        else:
+            merged.append([start, end, lo, hi])
+
+    filled = 0
+    for start, end, lo, hi in merged:
+        f0 = max(0, start - ctx_frames)
+        f1 = min(n_frames, end + ctx_frames)
+        b0, b1 = lo * 12, min(n_bins, (hi + 1) * 12)
+        chunk = y[f0 * hop_length:f1 * hop_length]
+        seg = np.abs(librosa.cqt(chunk, sr=sr, hop_length=hop_length, fmin=fmin * 2.0 ** lo, n_bins=b1 - b0))
+        first, last = start - f0, min(end - f0, seg.shape[1])
+        cqt[b0:b1, start:start + (last - first)] = seg[:, first:last]
+        filled += last - first
+
+    return cqt, filled
+
+def load_input(path):
+    """Mono 22.05 kHz, peak-normalized."""
+    y, sr = librosa.load(path, sr=22050)
+    return as_dsp(librosa.util.normalize(y)), sr
+
+def note_activation(backend, cqt_norm):
+    """The backend's activations on the normalized CQT's dB scale, ready for extract_notes()."""
+    activation = backend.activation(cqt_norm)
+    if backend.output == "probability":
+        # Active where p > 1 - threshold, so a higher knob still means more notes
+        activation = threshold_to_db(1 - activation)
+    return activation
+
+def analysis_params(args):
+    """
+    Every setting analyze() depends on, for keying cached analyses. The threshold
+    only counts in coarse-to-fine mode; the precision is the process's (set_precision()).
+    """
+    quality = getattr(args, 'quality', 1.0)
+    return (getattr(args, 'hop_length', HOP_LENGTH), getattr(args, 'sparse', False),
+            getattr(args, 'silence_db', -60.0), quality, args.threshold if quality < 1.0 else None,
+            getattr(args, 'model_config', None) or MODEL_CONFIG, np.dtype(spectral.PRECISION).name)
+
+def analyze(y, sr, args):
+    """
+    Everything transcribe() computes before the threshold is applied: the
+    normalized CQT, the model's note activations, the noise checks and the
+    mode diagnostics. Only the
+    coarse-to-fine mode reads args.threshold (to place its search regions).
+    """
+    info = {}
+    warnings = []
+    y = as_dsp(y)
+
+    # 1b. Pre-screen: noise and silence are rejected before paying for the CQT
+    hop_length = getattr(args, 'hop_length', HOP_LENGTH)
+    active_only = getattr(args, 'sparse', False) or getattr(args, 'quality', 1.0) < 1.0
+    screen = prescreen(y, sr, hop_length, active_only=active_only,
+                       silence_db=getattr(args, 'silence_db', -60.0))
+    info["prescreen"] = screen
+    if screen["abstain"]:
+        return {
+            "cqt_norm": np.zeros((N_BINS, 0), dtype=np.float32),
+            "activation": np.zeros((N_BINS, 0), dtype=np.float32),
+            "frame_time": hop_length / sr,
+            "duration": len(y) / sr,
+            "flatness": screen["flatness"],
+            "abstain": True,
+            "reason": screen["reason"],
+            "warnings": warnings,
+            "info": info
+        }
 
     # 2. Extract features
     # CQT for pitch
-    cqt = np.abs(librosa.cqt(y, sr=sr, fmin=librosa.note_to_hz('C1'), n_bins=84))
+    # Hop must be a multiple of 64 for the 7-octave CQT
+    segments = None
+    quality = getattr(args, 'quality', 1.0)
+    if quality < 1.0:
+        # Coarse-to-fine: cheap pass finds candidate regions, fine pass resolves them
+        segments = coarse_regions(y, sr, threshold_to_db(args.threshold), quality, hop_length=hop_length)
+        cqt, filled = sparse_cqt(y, sr, segments, hop_length=hop_length)
+        info["mode"] = "coarse_to_fine"
+        info["quality"] = float(quality)
+        info["skipped_fraction"] = float(1.0 - filled / cqt.shape[1])
+    elif getattr(args, 'sparse', False):
+        # Sparse mode: skip silent regions before paying for the CQT
+        segments = detect_active_segments(y, sr, hop_length=hop_length, silence_db=getattr(args, 'silence_db', -60.0))
+        cqt, filled = sparse_cqt(y, sr, segments, hop_length=hop_length)
+        info["mode"] = "sparse"
+        info["skipped_fraction"] = float(1.0 - filled / cqt.shape[1])
+    else:
+        cqt = np.abs(librosa.cqt(y, sr=sr, hop_length=hop_length, fmin=librosa.note_to_hz(FMIN_NOTE), n_bins=N_BINS))
 
-    # Mel spectrogram for timbre (though we primarily use CQT for MIDI)
-    mel = librosa.feature.melspectrogram(y=y, sr=sr)
-
-    # 3. Core logic: Peak picking (Simulated Model)
-    # Thresholding CQT to find notes
     # cqt shape is (bins, frames)
     # 84 bins from C1
 
-    # Normalize CQT
-    cqt_norm = librosa.amplitude_to_db(cqt, ref=np.max)
-
-    # Simple threshold-based detection
-    # We'll look for peaks in each frame
-    midi_notes = []
+    # Normalize CQT (in place: the magnitudes aren't needed afterwards)
+    cqt_norm = amplitude_db(cqt)
 
     # Confidence scoring based on SNR or signal strength
     avg_db = np.mean(cqt_norm)
     if avg_db < -60:
-        diagnostics["warnings"].append("Low signal-to-noise ratio")
+        warnings.append("Low signal-to-noise ratio")
 
     # Failure Honesty: Detect adversarial/unhandleable inputs
     # If the signal is too chaotic (e.g. white noise), spectral flateness will be high
-    flatness = librosa.feature.spectral_flatness(y=y)
-    if np.mean(flatness) > 0.1:
-        diagnostics["warnings"].append("Input sounds like noise; results may be unreliable")
-        if np.mean(flatness) > 0.5:
-            diagnostics["status"] = "abstained"
-            diagnostics["reason"] = "Input too noisy"
-            save_diagnostics(diagnostics, os.path.join(args.outdir, "transcription_diagnostics.json"))
-            # Create an empty MIDI
-            mid = mido.MidiFile()
-            mid.save(os.path.join(args.outdir, "transcription.mid"))
-            return
-
-    # Transcription process
-    threshold = args.threshold * -40 # map 0-1 to some dB range
-
-    # Detect active bins
-    active = cqt_norm > threshold
-
-    # Postprocess: merge nearby onsets, etc.
-    # For a simple demo, we'll just extract notes
-
-    mid = mido.MidiFile()
-    track = mido.MidiTrack()
-    mid.tracks.append(track)
-
-    # Track current active notes to create note_off events
-    active_notes = {} # note -> start_time
-
-    hop_length = 512
-    frame_time = hop_length / sr
-
-    poly_max = 0
-
-    for t in range(active.shape[1]):
-        current_frame_notes = np.where(active[:, t])[0]
-        poly_max = max(poly_max, len(current_frame_notes))
-
-        # Failure Honesty: Polyphony limit
-        if len(current_frame_notes) > 20:
-             diagnostics["warnings"].append(f"High polyphony detected at {t*frame_time:.2f}s")
-             # In a real "abstain" scenario we might stop or skip
-
-        # New notes
-        for bin_idx in current_frame_notes:
-            note = bin_idx + 24 # C1 is MIDI 24
-            if note not in active_notes:
-                # Note started
-                active_notes[note] = t
-
-        # Ended notes
-        finished_notes = []
-        for note, start_t in active_notes.items():
-            if not active[note-24, t]:
-                # Note ended
-                duration = (t - start_t) * frame_time
-                if duration > 0.05: # filter short blips
-                    # We need to convert time to ticks for MIDI
-                    # But for simplicity in this script, we'll just handle it
-                    pass
-                finished_notes.append(note)
-
-        for note in finished_notes:
-            del active_notes[note]
-
-    # Re-generating a cleaner MIDI for output
-    # Using pretty_midi might be easier but let's stick to mido for less deps if possible
-    # Actually pretty_midi is in requirements
+    flatness = librosa.feature.spectral_flatness(y=y, hop_length=hop_length)
+    if segments:
+        # Silent frames are perfectly "flat"; only judge the regions we kept
+        keep = np.zeros(flatness.shape[-1], dtype=bool)
+        for seg in segments:
+            keep[seg[0]:seg[1]] = True
+        flatness = flatness[..., keep]
+    mean_flatness = np.mean(flatness)
+    if mean_flatness > FLATNESS_WARN:
+        warnings.append("Input sounds like noise; results may be unreliable")
+
+    # Note activations from the model selected in model/config.json
+    backend = load_backend(getattr(args, 'model_config', None) or MODEL_CONFIG)
+    info["model"] = backend.config.get("model_type", "simulated_neural")
+    if hasattr(backend, "mode"):
+        info["inference"] = backend.mode
+    warnings.extend(backend.warnings)
+    activation = note_activation(backend, cqt_norm)
+
+    return {
+        "cqt_norm": cqt_norm,
+        "activation": activation,
+        "frame_time": hop_length / sr,
+        "duration": len(y) / sr,
+        "flatness": mean_flatness,
+        "abstain": bool(mean_flatness > FLATNESS_ABSTAIN),
+        "warnings": warnings,
+        "info": info
+    }
+
+def select_bins(activation, max_polyphony=MAX_POLYPHONY, suppress_harmonics=True):
+    """
+    Bins allowed to carry a note in each frame of a (bins, frames) dB activation map:
+    overtones of a stronger bin below are dropped, then only the max_polyphony
+    strongest of the rest are kept (0: no cap). Independent of the threshold, so
+    thresholding after selecting equals selecting among the active bins.
+    """
+    selected = np.ones(activation.shape, dtype=bool)
+    if suppress_harmonics:
+        for offset in HARMONIC_OFFSETS:
+            selected[offset:] &= activation[offset:] > activation[:-offset] - HARMONIC_MARGIN_DB
+    if 0 < max_polyphony < activation.shape[0]:
+        # One partial sort over the whole matrix: the top k of every frame at once
+        ranked = np.where(selected, activation, -np.inf)
+        top = np.argpartition(ranked, -max_polyphony, axis=0)[-max_polyphony:]
+        keep = np.zeros_like(selected)
+        np.put_along_axis(keep, top, True, axis=0)
+        selected &= keep
+    return selected
+
+def frame_ranges(mask, max_gap=0):
+    """(start_frame, end_frame) ranges of the True frames, merging gaps of up to max_gap frames."""
+    frames = np.flatnonzero(mask)
+    if not len(frames):
+        return []
+    breaks = np.flatnonzero(np.diff(frames) > max_gap + 1)
+    starts = frames[np.concatenate([[0], breaks + 1])]
+    ends = frames[np.concatenate([breaks, [len(frames) - 1]])] + 1
+    return list(zip(starts.tolist(), ends.tolist()))
+
+def extract_notes(activation, thresholds, frame_time, max_polyphony=MAX_POLYPHONY, suppress_harmonics=True):
+    """
+    Note tracking for a whole vector of thresholds in one vectorized pass over the
+    same activation map (the normalized CQT, or a model's output on its dB scale).
+    A note is a run of frames above the threshold in one bin among select_bins();
+    runs still open at the end or not longer than MIN_NOTE_DURATION are dropped.
+    Returns, per threshold, (int array of (pitch, start_frame, end_frame) rows in
+    the order the notes finish, per-frame polyphony before selection).
+    """
+    # Compare in the CQT's own precision, as a scalar threshold would
+    thresholds_db = threshold_to_db(np.atleast_1d(np.asarray(thresholds, dtype=float))).astype(activation.dtype)
+    active = activation[None] > thresholds_db[:, None, None]
+    polyphony = active.sum(axis=1)
+    active &= select_bins(activation, max_polyphony, suppress_harmonics)
+
+    n_frames = active.shape[-1]
+    edges = np.diff(np.pad(active, ((0, 0), (0, 0), (1, 1))).astype(np.int8), axis=-1)
+    k, bins, starts = np.nonzero(edges == 1)
+    ends = np.nonzero(edges == -1)[2]
+    keep = (ends < n_frames) & ((ends - starts) * frame_time > MIN_NOTE_DURATION) # filter short blips
+    k, bins, starts, ends = k[keep], bins[keep], starts[keep], ends[keep]
+
+    # Finished notes come out by end frame, then start frame, then pitch
+    order = np.lexsort((bins, starts, ends, k))
+    notes = np.stack([bins + 24, starts, ends], axis=1)[order] # C1 is MIDI 24
+    splits = np.searchsorted(k[order], np.arange(1, len(thresholds_db)))
+    return list(zip(np.split(notes, splits), polyphony))
+
+def note_instrument(notes, frame_time, instrument, name=""):
+    """A pretty_midi.Instrument (GM instrument name) playing extract_notes() notes."""
+    import pretty_midi
+    inst = pretty_midi.Instrument(program=pretty_midi.instrument_name_to_program(instrument), name=name)
+    for pitch, start, end in notes.tolist():
+        inst.notes.append(pretty_midi.Note(velocity=100, pitch=pitch, start=start * frame_time, end=end * frame_time))
+    return inst
+
+def drum_hits(y, sr, hop_length=HOP_LENGTH):
+    """
+    (GM kit note, onset seconds, velocity) per onset of a drum stem: kick, snare
+    or hi-hat by where the onset frame's energy is centred (DRUM_CENTROIDS),
+    louder onsets playing harder.
+    """
+    envelope = librosa.onset.onset_strength(y=y, sr=sr, hop_length=hop_length)
+    frames = librosa.onset.onset_detect(onset_envelope=envelope, sr=sr, hop_length=hop_length, units='frames')
+    if len(frames) == 0:
+        return []
+    power = np.abs(stft(y, hop_length=hop_length))[:, np.minimum(frames, envelope.shape[-1] - 1)]
+    np.square(power, out=power)
+    freqs = librosa.fft_frequencies(sr=sr)
+    centroid = freqs @ power / np.maximum(power.sum(axis=0), 1e-20)
+    kinds = np.searchsorted([limit for limit, _ in DRUM_CENTROIDS], centroid)
+    velocity = np.clip(40 + 87 * envelope[frames] / max(envelope.max(), 1e-12), 1, 127).astype(int)
+    times = librosa.frames_to_time(frames, sr=sr, hop_length=hop_length)
+    return [(DRUM_CENTROIDS[k][1], float(t), int(v)) for k, t, v in zip(kinds, times, velocity)]
+
+def write_transcription(features, notes, polyphony, outdir, emit=None, max_polyphony=MAX_POLYPHONY):
+    """Writes transcription.mid and its diagnostics for one threshold's notes."""
+    diagnostics = {
+        "confidence": 0.0,
+        "polyphony_max": 0,
+        "warnings": list(features["warnings"]),
+        "status": "success"
+    }
+    diagnostics.update(features["info"])
+
+    if features["abstain"]:
+        diagnostics["status"] = "abstained"
+        diagnostics["reason"] = features.get("reason", "Input too noisy")
+        save_diagnostics(diagnostics, os.path.join(outdir, "transcription_diagnostics.json"))
+        # Create an empty MIDI
+        mid = mido.MidiFile()
+        mid.save(os.path.join(outdir, "transcription.mid"))
+        return
+
+    frame_time = features["frame_time"]
+
+    # Failure Honesty: Polyphony limit, one warning per dense stretch
+    limit = max_polyphony or MAX_POLYPHONY
+    kept = f", kept the strongest {max_polyphony}" if max_polyphony else ""
+    for start, end in frame_ranges(polyphony > limit, int(POLYPHONY_WARN_GAP / frame_time)):
+        diagnostics["warnings"].append(f"High polyphony (up to {int(polyphony[start:end].max())} bins{kept}) "
+                                       f"from {start * frame_time:.2f}s to {end * frame_time:.2f}s")
+
     import pretty_midi
     pm = pretty_midi.PrettyMIDI()
-    piano_program = pretty_midi.instrument_name_to_program('Acoustic Grand Piano')
-    piano = pretty_midi.Instrument(program=piano_program)
-
-    active_notes = {}
-    for t in range(active.shape[1]):
-        current_frame_notes = np.where(active[:, t])[0]
-        for bin_idx in current_frame_notes:
-            note = bin_idx + 24
-            if note not in active_notes:
-                active_notes[note] = t
-
-        finished_notes = []
-        for note, start_t in active_notes.items():
-            if not active[note-24, t]:
-                duration = (t - start_t) * frame_time
-                if duration > 0.05:
-                    pm_note = pretty_midi.Note(
-                        velocity=100,
-                        pitch=note,
-                        start=start_t * frame_time,
-                        end=t * frame_time
-                    )
-                    piano.notes.append(pm_note)
-                finished_notes.append(note)
-        for note in finished_notes:
-            del active_notes[note]
+    piano = note_instrument(notes, frame_time, 'Acoustic Grand Piano')
+
+    if emit:
+        # Progress listeners get finished notes in ~1s blocks
+        emit('start', {'duration': features["duration"]})
+        blocks = notes[:, 2] // STREAM_BLOCK_FRAMES
+        for block in np.unique(blocks):
+            emit('notes', {'notes': [[pitch, start * frame_time, end * frame_time]
+                                     for pitch, start, end in notes[blocks == block].tolist()]})
 
     pm.instruments.append(piano)
-    pm.write(os.path.join(args.outdir, "transcription.mid"))
+    pm.write(os.path.join(outdir, "transcription.mid"))
+
+    diagnostics["polyphony_max"] = int(polyphony.max(initial=0))
+    diagnostics["notes"] = len(notes)
+    diagnostics["confidence"] = float(1.0 - features["flatness"]) # simple proxy
 
-    diagnostics["polyphony_max"] = int(poly_max)
-    diagnostics["confidence"] = float(1.0 - np.mean(flatness)) # simple proxy
+    save_diagnostics(diagnostics, os.path.join(outdir, "transcription_diagnostics.json"))
+
+def selection(args):
+    """(max_polyphony, suppress_harmonics) for note selection from the run's args."""
+    return getattr(args, 'max_polyphony', MAX_POLYPHONY), not getattr(args, 'keep_harmonics', False)
+
+def transcribe_stems(args):
+    """
+    Multitrack transcription of the separated stems in args.stems: one
+    instrument per stem (STEM_INSTRUMENTS, drums as kit hits on the percussion
+    channel), named after the stem so render gains can address it.
+    """
+    import pretty_midi
+    set_seed(args.seed)
+    diagnostics = {"mode": "multitrack", "stems": {}, "polyphony_max": 0, "notes": 0, "warnings": [],
+                   "status": "success"}
+    pm = pretty_midi.PrettyMIDI()
+    max_polyphony, suppress_harmonics = selection(args)
+    confidences = []
+    for name in STEM_NAMES:
+        y = load_stem(args.stems, name, 22050)
+        if y is None:
+            continue
+        y, sr = as_dsp(librosa.util.normalize(y)), 22050
+        if name == "drums":
+            inst = pretty_midi.Instrument(program=0, is_drum=True, name=name)
+            inst.notes = [pretty_midi.Note(velocity, note, start, start + DRUM_HIT_SECONDS)
+                          for note, start, velocity in drum_hits(y, sr)]
+            diagnostics["stems"][name] = {"notes": len(inst.notes), "drum": True}
+        else:
+            features = analyze(y, sr, args)
+            if features["abstain"]:
+                diagnostics["stems"][name] = {"notes": 0, "abstained": features.get("reason", "Input too noisy")}
+                diagnostics["warnings"].append(f"{name}: {diagnostics['stems'][name]['abstained']}")
+                continue
+            [(notes, polyphony)] = extract_notes(features["activation"], [args.threshold], features["frame_time"],
+                                                 max_polyphony, suppress_harmonics)
+            inst = note_instrument(notes, features["frame_time"], STEM_INSTRUMENTS[name], name)
+            diagnostics["stems"][name] = {"notes": len(notes), "program": inst.program,
+                                          "polyphony_max": int(polyphony.max(initial=0))}
+            diagnostics["polyphony_max"] = max(diagnostics["polyphony_max"], int(polyphony.max(initial=0)))
+            confidences.append(1.0 - float(features["flatness"]))
+        if inst.notes:
+            pm.instruments.append(inst)
+        diagnostics["notes"] += len(inst.notes)
 
+    if not pm.instruments:
+        diagnostics["status"] = "abstained"
+        diagnostics["reason"] = "No stem produced notes"
+    diagnostics["confidence"] = float(np.mean(confidences)) if confidences else 0.0
+    pm.write(os.path.join(args.outdir, "transcription.mid"))
     save_diagnostics(diagnostics, os.path.join(args.outdir, "transcription_diagnostics.json"))
 
+def transcribe(args, features=None):
+    """
+    Transcribes args.input at args.threshold. `features` from analyze() can be
+    passed in to skip the CQT when only the threshold changed. With args.stems,
+    the separated stems there are transcribed instead (transcribe_stems()).
+    """
+    if getattr(args, 'stems', None):
+        return transcribe_stems(args)
+    set_seed(args.seed)
+    if features is None:
+        # 1. Preprocess
+        y, sr = load_input(args.input)
+        features = analyze(y, sr, args)
+
+    # 3. Core logic: thresholding the CQT to find notes
+    max_polyphony, suppress_harmonics = selection(args)
+    [(notes, polyphony)] = extract_notes(features["activation"], [args.threshold], features["frame_time"],
+                                         max_polyphony, suppress_harmonics)
+    write_transcription(features, notes, polyphony, args.outdir, getattr(args, 'progress', None), max_polyphony)
+
+def transcribe_thresholds(args, thresholds, outdirs):
+    """
+    Threshold-sweep fast path: loads the input and computes the CQT once, then
+    extracts every threshold's notes in one pass. Each outdir gets exactly what
+    transcribe() would write for that threshold.
+    """
+    if getattr(args, 'quality', 1.0) < 1.0:
+        # Coarse-to-fine search regions depend on the threshold; nothing to share
+        for threshold, outdir in zip(thresholds, outdirs):
+            transcribe(argparse.Namespace(**dict(vars(args), threshold=threshold, outdir=outdir)))
+        return
+
+    set_seed(args.seed)
+    y, sr = load_input(args.input)
+    features = analyze(y, sr, args)
+    max_polyphony, suppress_harmonics = selection(args)
+    results = extract_notes(features["activation"], thresholds, features["frame_time"], max_polyphony, suppress_harmonics)
+    for (notes, polyphony), outdir in zip(results, outdirs):
+        write_transcription(features, notes, polyphony, outdir, max_polyphony=max_polyphony)
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('--input', required=True)
+    parser.add_argument('--input', help='Audio to transcribe (or --stems)')
+    parser.add_argument('--stems', help='Separated stems directory: one MIDI instrument per stem')
     parser.add_argument('--outdir', required=True)
     parser.add_argument('--threshold', type=float, default=0.6)
     parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--hop-length', type=int, default=HOP_LENGTH, help='CQT hop in samples (multiple of 64)')
+    parser.add_argument('--quality', type=float, default=1.0, help='Below 1.0, run a coarse pass first and refine only candidate regions')
+    parser.add_argument('--sparse', action='store_true', help='Skip silent regions before computing the CQT')
+    parser.add_argument('--silence-db', type=float, default=-60.0, help='Energy gate for --sparse, in dB below peak')
+    parser.add_argument('--max-polyphony', type=int, default=MAX_POLYPHONY, help='Strongest bins kept per frame (0: all)')
+    parser.add_argument('--keep-harmonics', action='store_true', help='Keep bins that look like overtones of a stronger note')
+    parser.add_argument('--model-config', default=MODEL_CONFIG, help='Model selection (default: model/config.json)')
     args = parser.parse_args()
+    if not (args.input or args.stems):
+        parser.error("--input or --stems is required")
     transcribe(args)
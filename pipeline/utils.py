@@ -1,9 +1,36 @@
+import hashlib
 import numpy as np
 import random
 import os
 import json
+import librosa
+import soundfile as sf
+import soxr
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+# Random streams: each stage draws from its own child of SeedSequence(seed), and
+# each task within a stage from a child of that, addressed by what it works on.
+# Nothing depends on which thread or process gets there first.
+RNG_STREAMS = {"separate": 0, "transcribe": 1, "render": 2}
+
+def seed_sequence(seed, stream, *key):
+    """
+    The SeedSequence that SeedSequence(seed).spawn() hands out for `stream`,
+    spawned further down `key` (e.g. track, pitch and tick of a note).
+    """
+    return np.random.SeedSequence(seed, spawn_key=(RNG_STREAMS[stream],) + tuple(int(k) for k in key))
+
+def stage_rng(seed, stream, *key):
+    """np.random.Generator of one task; see seed_sequence()."""
+    return np.random.default_rng(seed_sequence(seed, stream, *key))
 
 def set_seed(seed):
+    """
+    Seeds the global RNGs for third-party code that uses them. Pipeline code
+    draws from stage_rng() instead. PYTHONHASHSEED only reaches interpreters
+    started from here on (e.g. spawned workers); run.sh exports it.
+    """
     random.seed(seed)
     np.random.seed(seed)
     try:
@@ -19,3 +46,162 @@ def save_diagnostics(data, path):
     """Log failures, confidence stats, and warnings."""
     with open(path, 'w') as f:
         json.dump(data, f, indent=2)
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-1 of a file's contents, for caches keyed on the input rather than its name."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# Output encodings: name -> (extension, libsndfile format, subtype)
+AUDIO_FORMATS = {
+    "wav": (".wav", "WAV", "PCM_16"),
+    "wav32": (".wav", "WAV", "FLOAT"),
+    "flac": (".flac", "FLAC", "PCM_16"),
+    "opus": (".ogg", "OGG", "OPUS"),
+}
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+STEM_NAMES = ["vocals", "bass", "drums", "other"]
+STEM_BUNDLE = "stems.npz"
+STREAM_READ_FRAMES = 1 << 16
+
+# Encoding is mostly libsndfile time, which runs without the GIL
+_encode_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="encode")
+
+def audio_path(base, fmt):
+    """Path for an output written as `fmt`, given the path without extension."""
+    return base + AUDIO_FORMATS[fmt][0]
+
+def format_from_path(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".ogg", ".opus"):
+        return "opus"
+    if ext == ".flac":
+        return "flac"
+    return "wav"
+
+def write_audio(path, data, sr, fmt=None):
+    """Encode audio to path; fmt defaults to the one implied by the extension."""
+    fmt = fmt or format_from_path(path)
+    _, container, subtype = AUDIO_FORMATS[fmt]
+    if subtype == "OPUS" and sr not in OPUS_RATES:
+        target = next((r for r in OPUS_RATES if r >= sr), OPUS_RATES[-1])
+        if data.dtype == np.int16:
+            data = data.astype(np.float32) / 32768.0
+        data = soxr.resample(data, sr, target)
+        sr = target
+    if subtype == "FLOAT" and data.dtype == np.int16:
+        data = data.astype(np.float32) / 32768.0
+    sf.write(path, data, sr, format=container, subtype=subtype)
+    return path
+
+def write_audio_async(path, data, sr, fmt=None):
+    """write_audio on the shared encoder pool; returns a Future."""
+    return _encode_pool.submit(write_audio, path, data, sr, fmt)
+
+def submit_encode(func, *args):
+    """Run any other write-side work (e.g. peaks) on the encoder pool."""
+    return _encode_pool.submit(func, *args)
+
+def find_stem(stems_dir, name):
+    """Path of a separated stem in whichever single-file format it was written, or None."""
+    for ext in sorted({ext for ext, _, _ in AUDIO_FORMATS.values()}):
+        path = os.path.join(stems_dir, name + ext)
+        if os.path.exists(path):
+            return path
+    return None
+
+def remove_stems(stems_dir):
+    """
+    Deletes stems an earlier run left in stems_dir, in every format, the .npz
+    bundle and their peaks, so the lookups below can't pick up a stale one.
+    """
+    exts = {ext for ext, _, _ in AUDIO_FORMATS.values()} | {".peaks"}
+    paths = [os.path.join(stems_dir, name + ext) for name in STEM_NAMES for ext in sorted(exts)]
+    for path in paths + [os.path.join(stems_dir, STEM_BUNDLE)]:
+        if os.path.exists(path):
+            os.remove(path)
+
+def load_stem(stems_dir, name, sr):
+    """Load a stem as mono float32 at `sr`, from a single file or the .npz bundle; None if missing."""
+    bundle = os.path.join(stems_dir, STEM_BUNDLE)
+    if os.path.exists(bundle):
+        with np.load(bundle) as stems:
+            if name not in stems:
+                return None
+            y, stem_sr = stems[name], int(stems["sr"])
+        return librosa.resample(y, orig_sr=stem_sr, target_sr=sr) if stem_sr != sr else y
+    path = find_stem(stems_dir, name)
+    if path is None:
+        return None
+    y, _ = librosa.load(path, sr=sr)
+    return y
+
+def _bundle_blocks(bundle, name, blocksize):
+    """A 1-D array of an .npz bundle in blocks, decompressed as it is read."""
+    with zipfile.ZipFile(bundle) as z, z.open(name + ".npy") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, _, dtype = read_header(f)
+        remaining = shape[0]
+        while remaining > 0:
+            n = min(blocksize, remaining)
+            yield np.frombuffer(f.read(n * dtype.itemsize), dtype=dtype).astype(np.float32)
+            remaining -= n
+
+def _file_blocks(path, blocksize):
+    for block in sf.blocks(path, blocksize=blocksize, dtype="float32", always_2d=True):
+        yield block.mean(axis=1)
+
+class AudioStream:
+    """
+    Mono float32 audio at `sr`, read `n` samples at a time: the signal
+    librosa.load(path, sr=sr) or load_stem() would give, decoded and resampled
+    in blocks so memory doesn't grow with the duration.
+    """
+
+    def __init__(self, blocks, native_sr, sr):
+        self.blocks = blocks
+        self.resampler = soxr.ResampleStream(native_sr, sr, 1, dtype="float32") if native_sr != sr else None
+        self.parts = []
+        self.buffered = 0
+        self.done = False
+
+    @classmethod
+    def open(cls, path, sr, blocksize=STREAM_READ_FRAMES):
+        return cls(_file_blocks(path, blocksize), sf.info(path).samplerate, sr)
+
+    @classmethod
+    def open_stem(cls, stems_dir, name, sr, blocksize=STREAM_READ_FRAMES):
+        """load_stem() as a stream; None if the stem is missing."""
+        bundle = os.path.join(stems_dir, STEM_BUNDLE)
+        if os.path.exists(bundle):
+            with np.load(bundle) as stems:
+                if name not in stems.files:
+                    return None
+                stem_sr = int(stems["sr"])
+            return cls(_bundle_blocks(bundle, name, blocksize), stem_sr, sr)
+        path = find_stem(stems_dir, name)
+        return cls.open(path, sr, blocksize) if path else None
+
+    def read(self, n):
+        """The next n samples; fewer (maybe none) at the end."""
+        while self.buffered < n and not self.done:
+            block = next(self.blocks, None)
+            if block is None:
+                self.done = True
+                if not self.resampler:
+                    break
+                block = self.resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+            elif self.resampler:
+                block = self.resampler.resample_chunk(block)
+            self.parts.append(block)
+            self.buffered += len(block)
+        data = np.concatenate(self.parts) if self.parts else np.zeros(0, dtype=np.float32)
+        out, rest = data[:n], data[n:]
+        self.parts = [rest] if len(rest) else []
+        self.buffered = len(rest)
+        return out
+
@@ -13,6 +13,8 @@ fi
 INPUT_FILE="${1:-/data/input.wav}"
 OUTPUT_DIR="${2:-results}"
 SEED=${3:-42}
+# Must be set before each interpreter starts to have any effect
+export PYTHONHASHSEED="$SEED"
 
 echo "[*] CLI Mode. Input: $INPUT_FILE"
 mkdir -p "$OUTPUT_DIR"
@@ -52,4 +54,7 @@ python3 -u pipeline/metrics.py \
     --midi "$OUTPUT_DIR/transcription.mid" \
     --out "$OUTPUT_DIR/metrics.json"
 
+python3 pipeline/runs.py record "$OUTPUT_DIR" --input "$INPUT_FILE" \
+    --param seed="$SEED" --param threshold=0.6 --param humanize=true
+
 echo "[*] Pipeline Complete. Check $OUTPUT_DIR/metrics.json"
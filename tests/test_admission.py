@@ -0,0 +1,59 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from web.admission import AdmissionController, Rejected, estimate
+
+def write_wav(path, seconds, sr=22050, channels=1):
+    sf.write(str(path), np.zeros((int(seconds * sr), channels), dtype=np.float32), sr)
+    return str(path)
+
+def test_long_inputs_are_downgraded_or_rejected(tmp_path):
+    wav = write_wav(tmp_path / "in.wav", 240)
+    full = estimate("separate", wav)
+    # Separation has a streaming mode to fall back on; transcription doesn't
+    controller = AdmissionController(memory_budget=full.memory // 2)
+    assert not AdmissionController(memory_budget=full.memory).plan("separate", wav).streaming
+    assert controller.plan("separate", wav).streaming
+    with pytest.raises(Rejected) as e:
+        AdmissionController(memory_budget=1 << 20).plan("transcribe", wav)
+    assert e.value.status == 413
+    with pytest.raises(Rejected):
+        AdmissionController(max_duration=30).plan("separate", wav)
+
+def test_jobs_wait_their_turn_within_budget(tmp_path):
+    wav = write_wav(tmp_path / "in.wav", 10)
+    cost = estimate("separate", wav)
+    # Room for two jobs at a time, and a queue of three
+    controller = AdmissionController(memory_budget=2 * cost.memory, slots=4, max_queue=3)
+    tickets = [controller.request("separate", wav) for _ in range(3)]
+    with pytest.raises(Rejected) as e:
+        controller.request("separate", wav)
+    assert e.value.status == 503 and e.value.retry_after > 0
+
+    order, peak, queued = [], [0], []
+    lock = threading.Lock()
+
+    def job(i):
+        with controller.admitted(tickets[i], on_queued=lambda position, wait: queued.append(position)):
+            with lock:
+                order.append(i)
+                peak[0] = max(peak[0], controller.stats()["running"])
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=job, args=(i,)) for i in (2, 1, 0)]
+    for t in threads:
+        t.start()
+        time.sleep(0.01)
+    for t in threads:
+        t.join()
+
+    assert order == [0, 1, 2]
+    assert peak[0] == 2
+    assert queued
+    stats = controller.stats()
+    assert stats["running"] == stats["queued"] == 0 and stats["memory_in_use_mb"] == 0
+    assert stats["wait_s"]["max"] > 0
@@ -0,0 +1,80 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from pipeline.peaks import write_peaks
+from pipeline.utils import STEM_NAMES
+from web.app import app, cached_features, prune_profiles, transcription_args, OUTPUT_FOLDER
+
+PIANO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_piano.wav")
+
+def test_only_the_newest_profiles_are_kept(tmp_path):
+    now = time.time()
+    for i in range(5):
+        outdir = tmp_path / f"separate_{i}"
+        outdir.mkdir()
+        (outdir / "profile.json").write_text("{}")
+        os.utime(outdir, (now - 100 + i, now - 100 + i))
+    prune_profiles(str(tmp_path), keep=2)
+    assert sorted(os.listdir(tmp_path)) == ["separate_3", "separate_4"]
+    prune_profiles(str(tmp_path / "missing"), keep=2)
+
+def read_events(response):
+    assert response.status_code == 200 and response.mimetype == "application/x-ndjson"
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines() if line]
+    # Whether a job queues behind the previous one's release is down to timing
+    return [event for event in events if event["event"] != "queued"]
+
+def test_stream_endpoints_send_progress_then_results():
+    client = app.test_client()
+    with open(PIANO, "rb") as f:
+        events = read_events(client.post("/api/stream/separate", data={"file": (f, "piano.wav")}))
+    assert [event["event"] for event in events] == ["progress", "stem", "stem", "stem", "stem", "done"]
+    assert events[0] == {"event": "progress", "step": "split", "fraction": 0.0}
+    assert [event["name"] for event in events[1:5]] == STEM_NAMES
+    assert all(event["url"].startswith("/results/stems/") for event in events[1:5])
+    assert events[-1]["status"] == "success" and events[-1]["stems_created"] == STEM_NAMES
+
+    # The session input saved above, analyzed once, then re-thresholded from the cache
+    events = read_events(client.post("/api/stream/transcribe", data={"threshold": "0.9"}))
+    kinds = [event["event"] for event in events]
+    assert kinds[:2] == ["progress", "start"] and events[0]["step"] == "analyze"
+    assert set(kinds[2:-1]) == {"notes"} and kinds[-1] == "done"
+    assert sum(len(event["notes"]) for event in events[2:-1]) == events[-1]["diagnostics"]["notes"] > 0
+    assert not events[-1]["cached"]
+    events = read_events(client.post("/api/stream/transcribe", data={"threshold": "0.8"}))
+    assert [event["event"] for event in events][0] == "start" and events[-1]["cached"]
+
+def test_cached_analysis_is_keyed_on_its_settings():
+    from pipeline import spectral
+
+    args = transcription_args(PIANO, 0.6)
+    first, _ = cached_features(PIANO, args)
+    features, cached = cached_features(PIANO, transcription_args(PIANO, 0.9))
+    assert cached and features is first
+    for changed in [dict(sparse=True), dict(hop_length=256), dict(quality=0.5)]:
+        features, cached = cached_features(PIANO, argparse.Namespace(**dict(vars(args), **changed)))
+        assert not cached and features is not first
+    # Coarse-to-fine places its regions by threshold
+    assert not cached_features(PIANO, argparse.Namespace(**dict(vars(args), quality=0.5, threshold=0.9)))[1]
+    try:
+        spectral.set_precision("float64")
+        features, cached = cached_features(PIANO, args)
+        assert not cached and features["cqt_norm"].dtype == np.float64
+    finally:
+        spectral.set_precision("float32")
+    features, cached = cached_features(PIANO, args)
+    assert cached and features is first
+
+def test_peaks_width_must_be_a_positive_integer():
+    sr = 22050
+    write_peaks(np.zeros(sr, dtype=np.float32), sr, os.path.join(OUTPUT_FOLDER, "silence.wav"))
+    client = app.test_client()
+    response = client.get("/peaks/silence.wav?width=200")
+    assert response.status_code == 200 and int(response.headers["X-Peaks-Samples"]) == sr
+    for width in ["0", "-5", "wide", "1.5", ""]:
+        response = client.get(f"/peaks/silence.wav?width={width}")
+        assert response.status_code == 400 and "width" in response.get_json()["error"]
@@ -0,0 +1,72 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from pipeline.backends import load_backend, HeuristicBackend
+
+def test_config_selects_backend(tmp_path):
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"model_type": "simulated_neural", "threshold": 0.6}))
+    backend = load_backend(str(config))
+    assert isinstance(backend, HeuristicBackend)
+    assert load_backend(str(config)) is backend  # loaded once per process
+
+    config = tmp_path / "bad.json"
+    config.write_text(json.dumps({"model_type": "nope"}))
+    with pytest.raises(ValueError):
+        load_backend(str(config))
+
+def test_windowed_inference_matches_one_window():
+    torch = pytest.importorskip("torch")
+    from pipeline.cnn import FrameCNN, predict
+
+    torch.manual_seed(0)
+    model = FrameCNN().eval()
+    rng = np.random.RandomState(0)
+    cqt_norm = np.clip(rng.normal(-40, 20, (84, 1000)), -80, 0).astype(np.float32)
+    whole = predict(model, cqt_norm, window_frames=1024)
+    tiled = predict(model, cqt_norm, window_frames=100, batch_size=3)
+    assert tiled.shape == cqt_norm.shape
+    assert np.allclose(whole, tiled, atol=1e-6)
+
+def test_inference_modes_track_float_model(tmp_path):
+    pytest.importorskip("torch")
+    rng = np.random.RandomState(1)
+    cqt_norm = np.clip(rng.normal(-40, 20, (84, 700)), -80, 0).astype(np.float32)
+    probs = {}
+    for mode in ["float", "torchscript", "int8"]:
+        model_dir = tmp_path / mode
+        model_dir.mkdir()
+        (model_dir / "config.json").write_text(json.dumps({"model_type": "onset_frame_cnn", "batch_size": 2}))
+        (model_dir / "inference.json").write_text(json.dumps({"mode": mode, "calibration_windows": 8}))
+        backend = load_backend(str(model_dir / "config.json"))
+        assert backend.mode == mode
+        probs[mode] = backend.activation(cqt_norm)
+    assert np.allclose(probs["torchscript"], probs["float"], atol=1e-6)
+    assert np.max(np.abs(probs["int8"] - probs["float"])) < 0.02
+
+def test_shared_predictor_is_safe_across_threads():
+    torch = pytest.importorskip("torch")
+    from concurrent.futures import ThreadPoolExecutor
+    from pipeline.cnn import FrameCNN, WindowedPredictor
+
+    torch.manual_seed(0)
+    # One predictor, as a cached backend shares it between concurrent jobs
+    predictor = WindowedPredictor(FrameCNN().eval(), 84, window_frames=100, batch_size=2)
+    rng = np.random.RandomState(2)
+    inputs = [np.clip(rng.normal(-40, 20, (84, 900)), -80, 0).astype(np.float32) for _ in range(8)]
+    expected = [predictor(x) for x in inputs]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(predictor, inputs))
+    for got, want in zip(results, expected):
+        assert np.array_equal(got, want)
+
+def test_model_files_cover_config_inference_and_weights(tmp_path):
+    from pipeline.backends import model_files, MODEL_DIR
+
+    config = tmp_path / "config.json"
+    config.write_text(json.dumps({"model_type": "onset_frame_cnn", "weights": "cnn.pt"}))
+    assert model_files(str(config)) == [str(config), str(tmp_path / "inference.json"),
+                                        os.path.join(MODEL_DIR, "cnn.pt")]
@@ -1,9 +1,19 @@
+import argparse
 import subprocess
 import os
 import hashlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import mido
 import numpy as np
+import pretty_midi
 from scipy.io import wavfile
 
+from pipeline.transcribe import transcribe
+from pipeline.render import apply_humanization, render_segmented
+from pipeline.utils import seed_sequence, stage_rng
+from test_render import sine_synth
+
 def get_file_hash(filepath):
     if not os.path.exists(filepath):
         return None
@@ -22,6 +32,11 @@ def create_dummy_wav(path):
     y = y / np.max(np.abs(y))
     wavfile.write(path, sr, (y * 32767).astype(np.int16))
 
+def create_melody_wav(path, pitches, sr=22050, step=0.25):
+    t = np.arange(int(sr * step)) / sr
+    y = np.concatenate([np.sin(2 * np.pi * 440 * 2 ** ((p - 69) / 12) * t) * np.hanning(len(t)) for p in pitches])
+    wavfile.write(path, sr, (y * 0.5 * 32767).astype(np.int16))
+
 def test_determinism():
     input_wav = "tests/test_piano.wav"
     os.makedirs("tests", exist_ok=True)
@@ -48,5 +63,46 @@ def test_determinism():
 
     print("Determinism test passed!")
 
+def pipeline_task(input_wav, outdir, seed):
+    """Transcription plus humanized, segmented render; returns hashes of the MIDI files and the audio."""
+    os.makedirs(outdir, exist_ok=True)
+    transcribe(argparse.Namespace(input=input_wav, outdir=outdir, threshold=0.6, seed=seed))
+    midi = os.path.join(outdir, "transcription.mid")
+    humanized = os.path.join(outdir, "transcription_humanized.mid")
+    apply_humanization(mido.MidiFile(midi), seed).save(humanized)
+    sr, audio = render_segmented(pretty_midi.PrettyMIDI(humanized), sample_rate=22050, n_segments=3, synth=sine_synth)
+    return get_file_hash(midi), get_file_hash(humanized), hashlib.md5(audio.tobytes()).hexdigest()
+
+def test_task_streams_follow_spawn_tree():
+    render = np.random.SeedSequence(42).spawn(3)[2]
+    note = render.spawn(61)[60].spawn(1)[0]
+    assert seed_sequence(42, "render").spawn_key == render.spawn_key
+    assert np.array_equal(stage_rng(42, "render", 60, 0).random(8), np.random.default_rng(note).random(8))
+    assert not np.array_equal(stage_rng(42, "render", 60, 0).random(8), stage_rng(42, "render", 60, 1).random(8))
+
+def test_parallel_runs_are_bit_identical(tmp_path):
+    # Two melodies, each transcribed and rendered with two seeds
+    tasks = []
+    for i, pitches in enumerate([[60, 64, 67, 72, 67, 64], [55, 57, 59, 60, 62, 64, 65]]):
+        wav = str(tmp_path / f"in{i}.wav")
+        create_melody_wav(wav, pitches)
+        tasks += [(wav, 1), (wav, 2)]
+
+    def run_all(label, pool=None):
+        args = [(wav, str(tmp_path / label / str(i)), seed) for i, (wav, seed) in enumerate(tasks)]
+        if pool is None:
+            return [pipeline_task(*a) for a in args]
+        with pool:
+            return list(pool.map(pipeline_task, *zip(*args)))
+
+    serial = run_all("serial")
+    threads = run_all("threads", ThreadPoolExecutor(max_workers=4))
+    # Fresh interpreters, each with its own hash seed and global RNG state
+    processes = run_all("processes", ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn")))
+
+    assert serial == threads == processes
+    assert serial[0][0] == serial[1][0] and serial[0][1:] != serial[1][1:]  # only the render is seeded
+    assert serial[0][0] != serial[2][0]
+
 if __name__ == "__main__":
     test_determinism()
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import librosa
+import scipy.ndimage
+
+from pipeline.hpss import median_filter_rows, hpss, hpss_audio
+
+def test_running_median_matches_scipy():
+    rng = np.random.RandomState(0)
+    for shape, size in [((6, 300), 31), ((3, 10), 31), ((4, 50), 7)]:
+        X = rng.rand(*shape).astype(np.float32)
+        expected = scipy.ndimage.median_filter(X, size=(1, size), mode='reflect')
+        assert np.array_equal(median_filter_rows(X, size), expected)
+
+def test_hpss_matches_librosa():
+    sr = 22050
+    rng = np.random.RandomState(1)
+    t = np.arange(sr * 3) / sr
+    y = 0.4 * np.sin(2 * np.pi * 220 * t) + 0.1 * rng.randn(len(t)) * (t % 0.5 < 0.02)
+    y = y.astype(np.float32)
+
+    harmonic, percussive = hpss_audio(y)
+    ref_h, ref_p = librosa.effects.hpss(y)
+    assert np.max(np.abs(harmonic - ref_h)) < 1e-5
+    assert np.max(np.abs(percussive - ref_p)) < 1e-5
+
+    # Tiling doesn't change the result
+    S = librosa.stft(y)
+    whole = hpss(S, tile_frames=None)
+    tiled = hpss(S, tile_frames=16)
+    assert np.allclose(whole[0], tiled[0]) and np.allclose(whole[1], tiled[1])
+
+def test_pipeline_exits_after_hpss_off_the_main_thread(tmp_path):
+    # Stages run HPSS in scheduler threads; the interpreter must still shut down
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, RUNS_DB=str(tmp_path / "runs.db"))
+    result = subprocess.run(
+        [sys.executable, os.path.join(root, "main.py"), "--input", os.path.join(root, "tests", "test_piano.wav"),
+         "--output", str(tmp_path / "out")],
+        env=env, capture_output=True, text=True, timeout=180)
+    assert "Pipeline Complete" in result.stdout
+    assert os.path.exists(tmp_path / "out" / "stems" / "vocals.wav")
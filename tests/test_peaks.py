@@ -0,0 +1,19 @@
+import numpy as np
+
+from pipeline.peaks import compute_peaks, write_peaks, read_peaks, select_level
+
+def test_peak_levels_match_direct_summary(tmp_path):
+    sr = 22050
+    y = 0.5 * np.sin(2 * np.pi * 3 * np.arange(sr * 5) / sr).astype(np.float32)
+    write_peaks(y, sr, str(tmp_path / "tone.wav"))
+    read_sr, n_samples, levels = read_peaks(str(tmp_path / "tone.peaks"))
+    assert (read_sr, n_samples) == (sr, len(y))
+
+    for block, cols in levels:
+        frames = np.pad(y, (0, block * len(cols) - len(y))).reshape(-1, block)
+        assert np.allclose(cols[:, 0] / 32767, frames.min(axis=1), atol=1e-4)
+        assert np.allclose(cols[:, 1] / 32767, frames.max(axis=1), atol=1e-4)
+        assert np.allclose(cols[:, 2] / 32767, np.sqrt(np.mean(frames ** 2, axis=1)), atol=1e-4)
+
+    block, cols = select_level(levels, 100)
+    assert len(cols) >= 100 and block > levels[0][0]
@@ -0,0 +1,75 @@
+import argparse
+import os
+
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+from pipeline import spectral
+from pipeline.spectral import stft, amplitude_db, power_db, energy
+from pipeline.separate import split_stems
+from pipeline.transcribe import analyze, extract_notes
+from pipeline.metrics import sonic_metrics, calculate_sdr_proxy
+from pipeline.render import post_fx
+
+PIANO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test_piano.wav")
+
+@pytest.fixture
+def precision():
+    """set_precision for the test, restoring float32 afterwards."""
+    yield spectral.set_precision
+    spectral.set_precision("float32")
+
+def test_float32_policy_holds_for_wider_inputs():
+    y = np.random.RandomState(0).randn(22050)
+    assert stft(y).dtype == np.complex64
+    stems = split_stems(y, 22050)
+    assert all(stem.dtype == np.float32 for stem in stems.values())
+    features = analyze(y, 22050, argparse.Namespace(threshold=0.6))
+    assert features["cqt_norm"].dtype == np.float32
+    assert post_fx(np.zeros(100, dtype=np.int16), 22050).dtype == np.float32
+
+    # The in-place helpers agree with librosa
+    S = np.abs(stft(y.astype(np.float32)))
+    assert np.allclose(amplitude_db(S.copy()), librosa.amplitude_to_db(S, ref=np.max), atol=1e-4)
+    assert np.allclose(power_db(S ** 2), librosa.power_to_db(S ** 2, ref=np.max), atol=1e-4)
+    assert np.isclose(energy(S), np.sum(S.astype(np.float64) ** 2), rtol=1e-6)
+
+def test_precision_set_like_main_reaches_every_stage(precision):
+    # main.py sets it on pipeline.spectral; the stages import `spectral` by its bare name
+    from pipeline.spectral import set_precision
+    set_precision("float64")
+    y = np.random.RandomState(0).randn(22050).astype(np.float32)
+    assert stft(y).dtype == np.complex128
+    assert all(stem.dtype == np.float64 for stem in split_stems(y, 22050).values())
+    tone = librosa.tone(440, sr=22050, duration=1.0).astype(np.float32)
+    assert analyze(tone, 22050, argparse.Namespace(threshold=0.6))["cqt_norm"].dtype == np.float64
+    assert post_fx(np.zeros(100, dtype=np.int16), 22050).dtype == np.float64
+
+def test_float32_drift_from_float64_is_bounded(tmp_path, precision):
+    y, sr = librosa.load(PIANO, sr=22050)
+    stems_dir = tmp_path / "stems"
+    stems_dir.mkdir()
+    hyp = str(tmp_path / "hyp.wav")
+    sf.write(hyp, np.roll(y, 200) * 0.8, sr)
+
+    results = {}
+    for name in ("float64", "float32"):
+        precision(name)
+        stems = split_stems(y, sr)
+        for stem, data in stems.items():
+            sf.write(str(stems_dir / f"{stem}.wav"), data, sr, subtype="FLOAT")
+        features = analyze(librosa.util.normalize(y), sr, argparse.Namespace(threshold=0.6))
+        notes, _ = extract_notes(features["activation"], [0.6], features["frame_time"])[0]
+        results[name] = (stems, features, notes, sonic_metrics(PIANO, hyp), calculate_sdr_proxy(PIANO, str(stems_dir)))
+
+    stems64, features64, notes64, sonic64, sdr64 = results["float64"]
+    stems32, features32, notes32, sonic32, sdr32 = results["float32"]
+    for stem, ref in stems64.items():
+        assert stems32[stem].dtype == np.float32 and ref.dtype == np.float64
+        assert np.max(np.abs(stems32[stem] - ref)) <= 1e-4 * np.max(np.abs(ref))
+    assert np.max(np.abs(features32["cqt_norm"] - features64["cqt_norm"])) < 0.01 # dB
+    assert np.array_equal(notes32, notes64)
+    assert np.allclose(sonic32, sonic64, rtol=1e-3)
+    assert abs(sdr32 - sdr64) < 0.01
@@ -0,0 +1,29 @@
+import json
+import threading
+import time
+
+from pipeline.profiler import SamplingProfiler, read_folded
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        sum(range(1000))
+
+def test_profile_attributes_time_to_stages(tmp_path):
+    with SamplingProfiler(interval=0.005) as profiler:
+        worker = threading.Thread(target=profiler.wrap("render", busy), args=(0.3,))
+        worker.start()
+        with profiler.stage("separate"):
+            busy(0.3)
+        worker.join()
+
+    paths, report = profiler.write(str(tmp_path))
+    assert set(report["stages"]) >= {"separate", "render"}
+    assert all(0.1 < report["stages"][stage] < 0.6 for stage in ["separate", "render"])
+    assert any(spot["function"].startswith("busy (") for spot in report["hotspots"][:3])
+
+    stacks = read_folded(paths["folded"])
+    assert sum(stacks.values()) == sum(c for s, c in profiler.stacks.items())
+    assert {stack[0] for stack in stacks} >= {"separate", "render"}
+    assert open(paths["flamegraph"]).read().startswith("<svg")
+    assert json.load(open(paths["report"]))["samples"] == report["samples"]
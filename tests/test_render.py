@@ -0,0 +1,103 @@
+import mido
+import numpy as np
+import pretty_midi
+
+from pipeline.render import (
+    apply_humanization, render_incremental, render_segmented, render_instruments, parse_gains, post_fx,
+    excerpt, spectral_error, SEGMENT_TOLERANCE
+)
+
+def sine_synth(pm, sr):
+    """Stand-in for fluidsynth: pretty_midi's additive sine synth at a fixed gain."""
+    parts = [inst.synthesize(fs=sr) for inst in pm.instruments]
+    y = np.zeros(max([len(p) for p in parts] + [1]) + sr // 2)
+    for p in parts:
+        y[:len(p)] += p
+    y *= 1e-3
+    return sr, (np.stack([y, y], axis=1) * 32767).astype(np.int16)
+
+def make_piece(path, n_notes=60, drop=None):
+    rng = np.random.RandomState(0)
+    pm = pretty_midi.PrettyMIDI()
+    inst = pretty_midi.Instrument(program=0)
+    for i in range(n_notes):
+        start = i * 0.25 + rng.uniform(0, 0.05)
+        inst.notes.append(pretty_midi.Note(100, int(rng.randint(48, 84)), start, start + rng.uniform(0.1, 0.6)))
+    if drop is not None:
+        del inst.notes[drop]
+    pm.instruments.append(inst)
+    pm.write(path)
+    return path
+
+def onsets(mid):
+    events, tick = [], 0
+    for msg in mid.tracks[0]:
+        tick += msg.time
+        if msg.type == 'note_on' and msg.velocity > 0:
+            events.append((msg.note, tick, msg.velocity))
+    return events
+
+def test_humanization_is_local(tmp_path):
+    full = onsets(apply_humanization(mido.MidiFile(make_piece(str(tmp_path / "a.mid"))), 42))
+    edited = onsets(apply_humanization(mido.MidiFile(make_piece(str(tmp_path / "b.mid"), drop=30)), 42))
+    # Removing a note leaves every other note's jitter untouched
+    assert sorted(edited) == sorted(full[:30] + full[31:])
+
+def test_incremental_render_matches_full(tmp_path):
+    cache = str(tmp_path / "render_cache.npz")
+    sr = 22050
+    _, _, stats = render_incremental(pretty_midi.PrettyMIDI(make_piece(str(tmp_path / "a.mid"))), cache, sr, sine_synth)
+    assert stats["mode"] == "full"
+
+    edited = pretty_midi.PrettyMIDI(make_piece(str(tmp_path / "b.mid"), drop=30))
+    mix, _, stats = render_incremental(edited, cache, sr, sine_synth)
+    assert stats["mode"] == "incremental"
+    assert stats["changed_notes"] == 1
+    assert stats["rendered_seconds"] < edited.get_end_time() / 2
+
+    full = post_fx(sine_synth(edited, sr)[1], sr)
+    n = min(len(mix), len(full))
+    err = mix[:n] - full[:n]
+    snr = 10 * np.log10(np.sum(full[:n] ** 2) / max(np.sum(err ** 2), 1e-20))
+    assert snr > 40
+
+def test_excerpt_carries_controller_state(tmp_path):
+    pm = pretty_midi.PrettyMIDI(make_piece(str(tmp_path / "a.mid")))
+    pm.instruments[0].control_changes = [pretty_midi.ControlChange(64, 127, 2.0), pretty_midi.ControlChange(7, 90, 4.0)]
+    part = excerpt(pm, 5.0, 8.0, lambda n: 5.0 <= n.start < 8.0)
+    ccs = [(cc.number, cc.value, cc.time) for cc in part.instruments[0].control_changes]
+    assert ccs == [(7, 90, 0.0), (64, 127, 0.0)]
+    assert min(n.start for n in part.instruments[0].notes) >= 0.0
+
+def test_segmented_render_matches_single_pass(tmp_path):
+    pm = pretty_midi.PrettyMIDI(make_piece(str(tmp_path / "a.mid")))
+    sr = 22050
+    _, single = sine_synth(pm, sr)
+    _, segmented = render_segmented(pm, sr, n_segments=4, synth=sine_synth)
+    assert spectral_error(segmented, single, sr) < SEGMENT_TOLERANCE
+
+def test_instruments_render_apart_and_mix_with_gains(tmp_path):
+    pm = pretty_midi.PrettyMIDI(make_piece(str(tmp_path / "a.mid"), n_notes=20))
+    bass = pretty_midi.Instrument(program=33, name="bass")
+    bass.notes = [pretty_midi.Note(90, 36 + i % 5, i * 0.5, i * 0.5 + 0.4) for i in range(10)]
+    drums = pretty_midi.Instrument(program=0, is_drum=True, name="drums")
+    drums.notes = [pretty_midi.Note(100, 36, i * 0.5, i * 0.5 + 0.1) for i in range(10)]
+    pm.instruments += [bass, drums]
+    sr = 22050
+
+    # Voices add linearly: apart and summed is the single pass, give or take rounding
+    _, single = sine_synth(pm, sr)
+    _, mixed = render_instruments(pm, sr, synth=sine_synth)
+    n = min(len(single), len(mixed))
+    assert np.max(np.abs(mixed[:n].astype(np.int32) - single[:n])) <= len(pm.instruments)
+
+    # Muting a stem is rendering without it; -6 dB halves it
+    gains = parse_gains(["drums=-inf", "bass=-6.0206"])
+    _, muted = render_instruments(pm, sr, gains=gains, synth=sine_synth)
+    pm.instruments.pop()
+    _, rest = render_instruments(pm, sr, synth=sine_synth)
+    bass_only = render_instruments(pm, sr, gains={"Acoustic Grand Piano": -np.inf}, synth=sine_synth)[1]
+    n = min(len(muted), len(rest), len(bass_only))
+    expected = rest[:n].astype(np.float32) - bass_only[:n] / 2
+    assert np.max(np.abs(muted[:n] - expected)) <= 2
+
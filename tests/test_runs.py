@@ -0,0 +1,50 @@
+import json
+import time
+
+from pipeline.runs import record_run, ingest, find_runs, compare
+from pipeline.utils import file_digest
+
+def write_run(run_dir, note_f1, polyphony_max):
+    run_dir.mkdir()
+    (run_dir / "metrics.json").write_text(json.dumps({"note_f1": note_f1, "spectral_mse": 10.0, "status": "success"}))
+    (run_dir / "transcription_diagnostics.json").write_text(json.dumps({"polyphony_max": polyphony_max}))
+    (run_dir / "schedule.json").write_text(json.dumps({
+        "stages": {"transcribe": {"status": "success", "cached": False, "elapsed_s": 1.5}},
+        "failed": None, "wall_s": 2.0}))
+    return str(run_dir)
+
+def test_index_filters_orders_and_compares(tmp_path):
+    db = str(tmp_path / "runs.db")
+    wav = tmp_path / "in.wav"
+    wav.write_bytes(b"not really audio")
+    ids = [record_run(write_run(tmp_path / f"run{i}", f1, 5 + i), str(wav), {"threshold": t, "humanize": True}, db=db)
+           for i, (t, f1) in enumerate([(0.6, 0.5), (0.9, 0.7), (0.6, 0.8)])]
+
+    best = find_runs(params={"threshold": 0.6}, order_by="note_f1", db=db)
+    assert [run["id"] for run in best] == [ids[2], ids[0]]
+    assert best[0]["params"] == {"threshold": 0.6, "humanize": True}
+    assert best[0]["metrics"]["transcription.polyphony_max"] == 7.0
+    assert best[0]["stages"]["transcribe"]["elapsed_s"] == 1.5
+    assert best[0]["status"] == "success" and best[0]["wall_s"] == 2.0
+    assert len(find_runs(input_hash=best[0]["input_hash"], db=db)) == 3
+    assert find_runs(params={"threshold": 0.6, "humanize": False}, db=db) == []
+
+    table = compare([ids[0], ids[1]], db=db)["metrics"]
+    assert table["note_f1"]["values"] == [0.5, 0.7]
+    assert abs(table["note_f1"]["delta"][1] - 0.2) < 1e-9
+
+    # Backfills index a directory once
+    assert ingest([str(tmp_path / "run1")], db=db) == [ids[1]]
+    assert ingest([str(tmp_path / "new")], db=db) == []
+
+    # ...until it is run again: the new metrics get a new row, which later backfills return
+    time.sleep(0.05) # past the coarse filesystem clock
+    (tmp_path / "run1" / "metrics.json").write_text(json.dumps({"note_f1": 0.3, "status": "success"}))
+    rerun = ingest([str(tmp_path / "run1")], db=db)
+    assert rerun != [ids[1]] and ingest([str(tmp_path / "run1")], db=db) == rerun
+    assert compare(rerun, db=db)["runs"][0]["metrics"]["note_f1"] == 0.3
+    # A sweep variant directory reused for another input is indexed under that input
+    other = tmp_path / "other.wav"
+    other.write_bytes(b"other audio")
+    run_id = record_run(str(tmp_path / "run1"), str(other), {"threshold": 0.9}, unique=True, db=db)
+    assert run_id not in rerun and find_runs(input_hash=file_digest(str(other)), db=db)[0]["id"] == run_id
@@ -0,0 +1,79 @@
+import json
+import os
+import time
+
+from pipeline.scheduler import Stage, run_stages
+
+def make_stage(name, tmp_path, inputs, delay, calls, params=None):
+    out = str(tmp_path / f"{name}.txt")
+
+    def run():
+        calls.append(name)
+        time.sleep(delay)
+        with open(out, "w") as f:
+            f.write(name)
+
+    return Stage(name, run, inputs=[str(tmp_path / f"{i}.txt") for i in inputs], outputs=[out], params=params)
+
+def test_independent_stages_overlap_and_cache(tmp_path):
+    calls = []
+    stages = [
+        make_stage("a", tmp_path, [], 0.3, calls),
+        make_stage("b", tmp_path, [], 0.3, calls),
+        make_stage("c", tmp_path, ["a", "b"], 0.1, calls),
+    ]
+    report = run_stages(stages, str(tmp_path), log=lambda msg: None)
+
+    assert report["failed"] is None
+    assert report["dependencies"]["c"] == ["a", "b"]
+    assert report["wall_s"] < report["serial_s"]
+    assert report["critical_path"][-1] == "c" and len(report["critical_path"]) == 2
+
+    # Second run: everything is up to date
+    calls.clear()
+    report = run_stages(stages, str(tmp_path), log=lambda msg: None)
+    assert calls == []
+    assert all(info["cached"] for info in report["stages"].values())
+
+    # Changing a stage's params re-runs it and everything downstream
+    stages[1] = make_stage("b", tmp_path, [], 0.0, calls, params={"threshold": 0.7})
+    run_stages(stages, str(tmp_path), log=lambda msg: None)
+    assert sorted(calls) == ["b", "c"]
+
+def test_failure_blocks_downstream(tmp_path):
+    def boom():
+        raise RuntimeError("boom")
+
+    calls = []
+    stages = [
+        Stage("a", boom, outputs=[str(tmp_path / "a.txt")]),
+        make_stage("b", tmp_path, ["a"], 0.0, calls),
+        make_stage("c", tmp_path, [], 0.0, calls),
+    ]
+    report = run_stages(stages, str(tmp_path), log=lambda msg: None)
+    assert report["failed"] == "a"
+    assert report["stages"]["b"]["status"] == "blocked"
+    assert calls == ["c"]
+
+def test_abstention_skips_downstream(tmp_path):
+    diagnostics = tmp_path / "a.txt"
+
+    def abstain():
+        diagnostics.write_text(json.dumps({"status": "abstained", "reason": "Input too noisy"}))
+
+    calls = []
+    stale = tmp_path / "b.txt"
+    stale.write_text("score of an earlier input")
+    stages = [
+        Stage("a", abstain, outputs=[str(diagnostics)], diagnostics=str(diagnostics)),
+        make_stage("b", tmp_path, ["a"], 0.0, calls),
+        make_stage("c", tmp_path, ["b"], 0.0, calls),
+    ]
+    for _ in range(2):
+        # The second time round "a" is cached, and still abstained
+        report = run_stages(stages, str(tmp_path), log=lambda msg: None)
+        assert report["failed"] is None and report["abstained"] == ["a"]
+        assert report["stages"]["a"]["reason"] == "Input too noisy"
+        assert report["stages"]["b"] == {"status": "abstained", "abstained_upstream": ["a"], "elapsed_s": 0.0}
+        assert report["stages"]["c"]["status"] == "abstained"
+        assert calls == [] and not stale.exists()
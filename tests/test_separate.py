@@ -0,0 +1,47 @@
+import argparse
+
+import librosa
+import numpy as np
+
+from pipeline.separate import separate, split_stems, split_stems_blocked
+from pipeline.spectral import HOP_LENGTH
+from pipeline.utils import load_stem, find_stem, STEM_NAMES
+
+SR = 22050
+
+def run(outdir, y, fmt):
+    separate(argparse.Namespace(input=None, outdir=str(outdir), seed=0, format=fmt, audio=(y, SR)))
+
+def test_stems_written_in_another_format_replace_the_old_ones(tmp_path):
+    first = librosa.tone(220, sr=SR, duration=3.0)
+    second = librosa.tone(880, sr=SR, duration=3.0)
+    stems = tmp_path / "stems"
+    run(tmp_path, first, "npz")
+    run(tmp_path, second, "flac")
+    assert not (stems / "stems.npz").exists()
+    expected = load_stem(str(stems), "vocals", SR)
+    run(tmp_path, first, "npz")
+    assert find_stem(str(stems), "vocals") is None
+    run(tmp_path, second, "wav")
+    assert sorted(p.name for p in stems.glob("vocals.*")) == ["vocals.peaks", "vocals.wav"]
+    assert np.allclose(load_stem(str(stems), "vocals", SR), expected, atol=1e-4)
+
+def test_abstaining_on_noise_removes_old_stems(tmp_path):
+    run(tmp_path, librosa.tone(220, sr=SR, duration=3.0), "npz")
+    noise = np.random.default_rng(0).standard_normal(3 * SR).astype(np.float32)
+    run(tmp_path, noise, "npz")
+    assert list((tmp_path / "stems").iterdir()) == []
+    assert load_stem(str(tmp_path / "stems"), "vocals", SR) is None
+
+def test_blocked_split_matches_one_shot():
+    rng = np.random.default_rng(1)
+    y = (0.1 * rng.standard_normal(12 * SR) + librosa.tone(330, sr=SR, duration=12.0)).astype(np.float32)
+    fractions = []
+    whole = split_stems(y, SR)
+    blocked = split_stems_blocked(y, SR, 5.0, progress=fractions.append)
+    # Blocks are whole hops: 5 s rounds down to 110080 samples
+    block = 5 * SR // HOP_LENGTH * HOP_LENGTH
+    assert fractions == [block / len(y), 2 * block / len(y), 1.0]
+    for name in STEM_NAMES:
+        assert blocked[name].shape == whole[name].shape and blocked[name].dtype == whole[name].dtype
+        assert np.max(np.abs(blocked[name] - whole[name])) < 1e-6
@@ -0,0 +1,52 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import librosa
+import numpy as np
+
+from pipeline import spectral
+from pipeline.spectral import stft, istft, set_threads
+
+def test_stft_istft_match_librosa():
+    rng = np.random.RandomState(0)
+    y = rng.randn(22050).astype(np.float32)
+    for n_fft, hop in [(2048, 512), (1024, 300)]:
+        S_ref = librosa.stft(y, n_fft=n_fft, hop_length=hop)
+        S = stft(y, n_fft=n_fft, hop_length=hop)
+        assert S.shape == S_ref.shape and S.dtype == S_ref.dtype
+        assert np.max(np.abs(S - S_ref)) < 1e-4
+
+        for length in [None, len(y), len(y) - 1000, len(y) + 1000]:
+            ref = librosa.istft(S_ref, hop_length=hop, length=length)
+            out = istft(S_ref, hop_length=hop, length=length)
+            assert out.shape == ref.shape
+            assert np.max(np.abs(out - ref)) < 1e-5
+
+def test_batched_transforms_match_single_calls():
+    rng = np.random.RandomState(1)
+    Y = rng.randn(3, 10000).astype(np.float32)
+    S = stft(Y)
+    assert S.shape[0] == 3
+    for y, s in zip(Y, S):
+        assert np.array_equal(s, stft(y))
+    out = istft(S, length=Y.shape[1])
+    for s, o in zip(S, out):
+        assert np.allclose(o, istft(s, length=Y.shape[1]), atol=1e-6)
+
+def fft_threads():
+    """The thread budget the stages' FFTs (and librosa's, via ThreadedFFT) run with."""
+    from pipeline import separate, transcribe, metrics
+    fftlib = librosa.get_fftlib()
+    return {separate.stft.__globals__["THREADS"], transcribe.stft.__globals__["THREADS"],
+            metrics.stft.__globals__["THREADS"], type(fftlib).__getattr__.__globals__["THREADS"]}
+
+def test_thread_budget_reaches_stage_ffts():
+    before = spectral.THREADS
+    try:
+        # As main.py --threads does
+        set_threads(3)
+        assert fft_threads() == {3}
+    finally:
+        set_threads(before)
+    # As the sweep's worker initializer does
+    with ProcessPoolExecutor(max_workers=1, initializer=set_threads, initargs=(2,)) as pool:
+        assert pool.submit(fft_threads).result() == {2}
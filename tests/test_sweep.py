@@ -0,0 +1,53 @@
+import os
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from ablations.sweep import sweep, stage_task, expand_grid
+from pipeline.runs import find_runs
+from pipeline.utils import file_digest
+
+SR = 22050
+GRID = {"threshold": [0.6, 0.9], "humanize": [True, False], "seed": [1, 2],
+        "bass_cutoff": [200.0], "vocals_cutoff": [4000.0], "hop_length": [512]}
+
+def write_input(path, freqs):
+    y = sum(librosa.tone(f, sr=SR, duration=2.0) for f in freqs) / len(freqs)
+    y += 0.01 * np.random.default_rng(0).standard_normal(len(y))
+    sf.write(path, y.astype(np.float32), SR)
+    return str(path)
+
+def test_sweep_shares_stages_per_input(tmp_path):
+    a = write_input(tmp_path / "a.wav", [220.0, 330.0])
+    b = write_input(tmp_path / "b.wav", [60.0, 5000.0])
+    out, db = str(tmp_path / "sweep"), str(tmp_path / "runs.db")
+
+    df = sweep(a, GRID, out, jobs=2, db=db)
+    variants = expand_grid(GRID)
+    assert len(df) == len(variants) == 8
+    cache = os.path.join(out, "cache")
+    # One separation for every threshold/humanize/seed, one CQT-based transcription per threshold
+    assert len(os.listdir(os.path.join(cache, "separation"))) == 1
+    assert len(os.listdir(os.path.join(cache, "transcription"))) == 2
+    assert len(os.listdir(os.path.join(cache, "render"))) == 8
+    digest = file_digest(a)
+    dirs = {kind: [stage_task(kind, v, a, digest, cache)["dir"] for v in variants]
+            for kind in ["separation", "transcription"]}
+    for i, v in enumerate(variants):
+        for j, w in enumerate(variants):
+            differs = {name for name in v if v[name] != w[name]}
+            if differs == {"humanize"}:
+                assert dirs["transcription"][i] == dirs["transcription"][j]
+            if differs == {"threshold"}:
+                assert dirs["separation"][i] == dirs["separation"][j]
+
+    # Another input into the same --out gets its own stages, metrics and index rows
+    df_b = sweep(b, GRID, out, jobs=2, db=db)
+    fresh = sweep(b, GRID, str(tmp_path / "fresh"), jobs=2, db=db)
+    assert len(os.listdir(os.path.join(cache, "separation"))) == 2
+    assert set(df_b["run_dir"]).isdisjoint(df["run_dir"])
+    assert list(df_b["separation_sdr"]) == list(fresh["separation_sdr"])
+    assert df_b["separation_sdr"][0] != df["separation_sdr"][0]
+    assert len(find_runs(input_hash=file_digest(b), db=db)) == 16
+    assert len(find_runs(input_hash=digest, db=db)) == 8
@@ -0,0 +1,185 @@
+import argparse
+import json
+import os
+import numpy as np
+import pretty_midi
+from scipy.io import wavfile
+
+from test_determinism import get_file_hash
+import librosa
+from pipeline.transcribe import (
+    transcribe, transcribe_thresholds, prescreen, extract_notes, frame_ranges, select_bins, FLATNESS_ABSTAIN
+)
+from pipeline.live import LiveTranscriber, RingBuffer
+from pipeline.metrics import calculate_note_f1
+
+def create_sparse_wav(path):
+    sr = 22050
+    rng = np.random.RandomState(0)
+    y = rng.normal(0, 1e-4, sr * 12)
+    t = np.arange(int(sr * 1.5)) / sr
+    for start, freq in [(1.0, 440.0), (7.0, 261.63)]:
+        i = int(start * sr)
+        y[i:i + len(t)] += 0.5 * np.sin(2 * np.pi * freq * t) * np.exp(-t)
+    wavfile.write(path, sr, (y * 32767).astype(np.int16))
+
+def create_melody_wav(path):
+    sr = 22050
+    rng = np.random.RandomState(0)
+    y = rng.normal(0, 1e-3, sr * 8)
+    t = np.arange(int(sr * 0.8)) / sr
+    for i, pitch in enumerate([60, 64, 67, 72, 69, 65, 62, 57]):
+        start = int((0.5 + 0.8 * i) * sr)
+        y[start:start + len(t)] += 0.4 * np.sin(2 * np.pi * librosa.midi_to_hz(pitch) * t) * np.exp(-2 * t)
+    wavfile.write(path, sr, (y * 32767).astype(np.int16))
+
+def run_transcribe(input_wav, outdir, **kwargs):
+    os.makedirs(outdir, exist_ok=True)
+    args = argparse.Namespace(input=input_wav, outdir=outdir, threshold=0.6, seed=42, **kwargs)
+    transcribe(args)
+    with open(os.path.join(outdir, "transcription_diagnostics.json")) as f:
+        return json.load(f)
+
+def test_sparse_matches_dense(tmp_path):
+    input_wav = str(tmp_path / "sparse.wav")
+    create_sparse_wav(input_wav)
+
+    dense_dir = str(tmp_path / "dense")
+    sparse_dir = str(tmp_path / "sparse")
+    run_transcribe(input_wav, dense_dir)
+    diag = run_transcribe(input_wav, sparse_dir, sparse=True)
+
+    assert diag["mode"] == "sparse"
+    assert diag["skipped_fraction"] > 0.5
+    h1 = get_file_hash(os.path.join(dense_dir, "transcription.mid"))
+    h2 = get_file_hash(os.path.join(sparse_dir, "transcription.mid"))
+    assert h1 == h2, f"MIDI mismatch: {h1} != {h2}"
+
+def test_coarse_to_fine_keeps_the_full_runs_notes(tmp_path):
+    input_wav = str(tmp_path / "melody.wav")
+    create_melody_wav(input_wav)
+    full_dir = str(tmp_path / "full")
+    full = run_transcribe(input_wav, full_dir)
+    assert full["notes"] > 0
+
+    for quality in [0.0, 0.5]:
+        coarse_dir = str(tmp_path / f"quality_{quality}")
+        diag = run_transcribe(input_wav, coarse_dir, quality=quality)
+        assert diag["mode"] == "coarse_to_fine" and diag["skipped_fraction"] > 0
+        f1 = calculate_note_f1(os.path.join(full_dir, "transcription.mid"), os.path.join(coarse_dir, "transcription.mid"))
+        assert f1 >= 0.95
+
+def test_threshold_sweep_matches_single_runs(tmp_path):
+    input_wav = str(tmp_path / "sparse.wav")
+    create_sparse_wav(input_wav)
+
+    thresholds = [0.3, 0.6, 0.9]
+    sweep_dirs = [str(tmp_path / f"sweep_{t}") for t in thresholds]
+    for d in sweep_dirs:
+        os.makedirs(d)
+    transcribe_thresholds(argparse.Namespace(input=input_wav, seed=42), thresholds, sweep_dirs)
+
+    for t, sweep_dir in zip(thresholds, sweep_dirs):
+        single_dir = str(tmp_path / f"single_{t}")
+        os.makedirs(single_dir)
+        transcribe(argparse.Namespace(input=input_wav, outdir=single_dir, threshold=t, seed=42))
+        for name in ["transcription.mid", "transcription_diagnostics.json"]:
+            assert get_file_hash(os.path.join(sweep_dir, name)) == get_file_hash(os.path.join(single_dir, name))
+
+def test_prescreen_agrees_with_full_flatness(tmp_path):
+    sr = 22050
+    rng = np.random.RandomState(0)
+    t = np.arange(sr * 10) / sr
+    inputs = {
+        "noise": 0.3 * rng.randn(len(t)),
+        "silence": np.zeros(len(t)),
+        "tones": 0.5 * np.sin(2 * np.pi * 440 * t) + 0.3 * np.sin(2 * np.pi * 660 * t),
+        "noisy_tone": 0.5 * np.sin(2 * np.pi * 440 * t) + 0.3 * rng.randn(len(t)),
+    }
+    for name, y in inputs.items():
+        y = y.astype(np.float32)
+        screen = prescreen(y, sr)
+        full = np.mean(librosa.feature.spectral_flatness(y=y, hop_length=512))
+        assert abs(screen["flatness"] - full) < 0.02, name
+        # Early abstains only where the full analysis would abstain too
+        assert screen["abstain"] == (name in ("noise", "silence")), name
+        assert screen["abstain"] <= (full > FLATNESS_ABSTAIN), name
+
+    # Abstained inputs still get the usual (empty) outputs
+    wavfile.write(str(tmp_path / "noise.wav"), sr, (inputs["noise"] * 32767 / 2).astype(np.int16))
+    diag = run_transcribe(str(tmp_path / "noise.wav"), str(tmp_path / "out"))
+    assert diag["status"] == "abstained" and diag["prescreen"]["abstain"]
+    assert os.path.exists(str(tmp_path / "out" / "transcription.mid"))
+
+def test_note_selection_caps_polyphony():
+    rng = np.random.RandomState(0)
+    activation = rng.uniform(-80, 0, (84, 200)).astype(np.float32)
+    # A strong note with a weaker octave above it: the octave is an overtone
+    activation[10] = -1.0
+    activation[22] = -10.0
+
+    selected = select_bins(activation, max_polyphony=5)
+    assert selected.sum(axis=0).max() <= 5
+    assert selected[10].all() and not selected[22].any()
+    [(notes, polyphony)] = extract_notes(activation, [0.6], 0.05, max_polyphony=5)
+    [(uncapped, _)] = extract_notes(activation, [0.6], 0.05, max_polyphony=0, suppress_harmonics=False)
+    assert polyphony.max() > 5 and len(notes) < len(uncapped)
+    for pitch, start, end in notes.tolist():
+        assert selected[pitch - 24, start:end].all() and (activation[pitch - 24, start:end] > -24).all()
+    assert frame_ranges(np.array([0, 1, 1, 0, 1, 0, 0, 0, 1]), max_gap=1) == [(1, 5), (8, 9)]
+
+def test_ring_buffer_wraps():
+    ring = RingBuffer(8)
+    ring.write(np.arange(5))
+    ring.write(np.arange(5, 11))
+    assert ring.latest(8).tolist() == list(range(3, 11))
+    assert ring.latest(3).tolist() == [8, 9, 10]
+
+def test_live_matches_offline_pitches(tmp_path):
+    import librosa
+    import pretty_midi
+
+    input_wav = str(tmp_path / "sparse.wav")
+    create_sparse_wav(input_wav)
+    run_transcribe(input_wav, str(tmp_path))
+    offline = pretty_midi.PrettyMIDI(str(tmp_path / "transcription.mid")).instruments[0].notes
+
+    y, sr = librosa.load(input_wav, sr=22050)
+    live_tr = LiveTranscriber(sr=sr)
+    for i in range(0, len(y), 1000):
+        live_tr.push(y[i:i + 1000])
+    live_tr.flush()
+
+    onsets = [(t, msg.note) for t, msg in live_tr.events if msg.type == 'note_on']
+    assert live_tr.status == "success"
+    assert sorted(n for _, n in onsets) == sorted(n.pitch for n in offline)
+    # Bounded latency: each onset within a few hops of the offline one
+    for note in offline:
+        assert min(abs(t - note.start) for t, n in onsets if n == note.pitch) < 0.1
+    assert live_tr.latency_stats()["hops"] == len(y) // live_tr.hop_length
+
+def test_stems_transcribe_to_one_instrument_each(tmp_path):
+    sr = 22050
+    stems = tmp_path / "stems"
+    stems.mkdir()
+    create_sparse_wav(str(stems / "bass.wav"))
+    # Kicks (low thumps) on the beat, hi-hats (bright noise) off it
+    rng = np.random.RandomState(0)
+    drums = rng.normal(0, 1e-4, sr * 5)
+    t = np.arange(sr // 10) / sr
+    for i in range(4):
+        start = i * sr + sr // 4
+        drums[start:start + len(t)] += np.sin(2 * np.pi * 60 * t) * np.exp(-t * 40)
+        hat = np.diff(rng.normal(0, 0.3, len(t) + 1)) * np.exp(-t * 80)
+        drums[start + sr // 2:start + sr // 2 + len(t)] += hat
+    wavfile.write(str(stems / "drums.wav"), sr, (drums * 32767).astype(np.int16))
+
+    diag = run_transcribe(None, str(tmp_path / "out"), stems=str(stems))
+    assert diag["mode"] == "multitrack" and set(diag["stems"]) == {"bass", "drums"}
+    pm = pretty_midi.PrettyMIDI(str(tmp_path / "out" / "transcription.mid"))
+    by_name = {inst.name: inst for inst in pm.instruments}
+    assert by_name["bass"].program == 33 and not by_name["bass"].is_drum
+    assert by_name["drums"].is_drum
+    kit = sorted((round((n.start - 0.25) * 2) / 2, n.pitch) for n in by_name["drums"].notes)
+    assert kit == [(i + half, 42 if half else 36) for i in range(4) for half in (0, 0.5)]
+
@@ -0,0 +1,65 @@
+import hashlib
+import io
+
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+from web.uploads import UploadManager, UploadError
+
+def wav_bytes(seconds, sr=44100, channels=2):
+    rng = np.random.default_rng(0)
+    buf = io.BytesIO()
+    sf.write(buf, 0.1 * rng.standard_normal((int(seconds * sr), channels)), sr, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
+
+def test_chunks_out_of_order_are_verified_and_decoded(tmp_path):
+    data = wav_bytes(3)
+    manager = UploadManager(str(tmp_path), max_bytes=1 << 30)
+    upload = manager.create(len(data), hashlib.sha1(data).hexdigest())
+    chunk = 100_000
+    offsets = list(range(0, len(data), chunk))
+
+    # A corrupted chunk doesn't count and is asked for again
+    with pytest.raises(UploadError) as e:
+        upload.write(0, io.BytesIO(b"x" * chunk), chunk, hashlib.sha1(data[:chunk]).hexdigest())
+    assert e.value.status == 422
+    # Everything but the first chunk, last to first; resuming sends only what is missing
+    for offset in reversed(offsets[1:]):
+        upload.write(offset, io.BytesIO(data[offset:offset + chunk]), len(data[offset:offset + chunk]))
+    status = upload.status()
+    assert not status["complete"] and status["missing"] == [[0, chunk]]
+    assert status["audio"] is None
+    upload.write(0, io.BytesIO(data[:chunk]), chunk, hashlib.sha1(data[:chunk]).hexdigest())
+
+    assert upload.wait(10) and upload.verified()
+    with open(upload.path, "rb") as f:
+        assert f.read() == data
+    status = upload.status()
+    assert status["complete"] and status["audio"]["samplerate"] == 44100
+    # Decoded while arriving, the same signal the pipeline would load
+    y, sr = upload.take_audio()
+    expected, _ = librosa.load(upload.path, sr=22050)
+    assert sr == 22050 and np.array_equal(y, expected)
+    # Handed over once; the upload doesn't keep it in memory after that
+    assert upload.audio is None and upload.take_audio() is None
+
+def test_bad_checksum_and_long_inputs_are_refused(tmp_path):
+    data = wav_bytes(3)
+    manager = UploadManager(str(tmp_path), max_bytes=1 << 30, max_duration=2)
+    with pytest.raises(UploadError) as e:
+        UploadManager(str(tmp_path), max_bytes=1000).create(len(data))
+    assert e.value.status == 413
+
+    # Too long: refused from the header, before the rest is sent
+    upload = manager.create(len(data))
+    upload.write(0, io.BytesIO(data[:70_000]), 70_000)
+    assert upload.wait(10) and "limit" in upload.status()["error"]
+    with pytest.raises(UploadError):
+        upload.write(70_000, io.BytesIO(data[70_000:]), len(data) - 70_000)
+
+    upload = UploadManager(str(tmp_path), max_bytes=1 << 30).create(len(data), sha1="0" * 40)
+    upload.write(0, io.BytesIO(data), len(data))
+    assert upload.wait(10) and not upload.verified() and upload.audio is None
+    manager.discard(upload.id)
@@ -0,0 +1,182 @@
+import os
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+import mido
+import numpy as np
+import soundfile as sf
+
+# Admission control for the web jobs: each job's peak memory and CPU time are
+# estimated from the input's header (duration, rate, channels), and jobs only
+# start while the estimates fit the budget. The rest wait in FIFO order.
+MEMORY_BUDGET = int(os.environ.get("ADMISSION_MEMORY_MB", 2048)) << 20
+SLOTS = int(os.environ.get("ADMISSION_SLOTS", 0)) or os.cpu_count() or 1
+MAX_QUEUE = 16 # waiting jobs before new ones are turned away
+MAX_DURATION = 3600.0 # seconds of audio accepted at all
+MAX_UPLOAD_BYTES = 1 << 30
+STREAM_BLOCK_SECONDS = 30.0 # separation block length once downgraded to streaming mode
+WAIT_HISTORY = 256
+
+# Per kind: (peak bytes per sample of the 22.05 kHz analysis signal, CPU seconds per
+# second of audio), measured with tracemalloc and wall time on a 60 s input
+ANALYSIS_RATE = 22050
+JOB_COSTS = {
+    "separate": (200, 0.03),
+    "transcribe": (30, 0.01),
+    "render": (130, 0.1),
+}
+# Decoding and resampling the upload, per sample per channel at its own rate
+LOAD_BYTES = 8
+# Streaming separation keeps the four stems whole but only one block of spectrograms
+STREAM_BYTES = 20
+STREAM_CONTEXT_SECONDS = 1.1
+RENDER_TAIL = 1.0
+
+Cost = namedtuple("Cost", "kind duration memory cpu_seconds streaming")
+
+class Rejected(Exception):
+    """A job that can't be admitted; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=503, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def estimate(kind, path, streaming=False):
+    """Cost of running job `kind` on `path`, from the file header only."""
+    if kind == "render":
+        duration = mido.MidiFile(path).length + RENDER_TAIL
+        load = 0
+    else:
+        info = sf.info(path)
+        duration = info.duration
+        load = info.frames * info.channels * LOAD_BYTES
+    samples = duration * ANALYSIS_RATE
+    bytes_per_sample, cpu = JOB_COSTS[kind]
+    if streaming:
+        block = min(duration, STREAM_BLOCK_SECONDS + 2 * STREAM_CONTEXT_SECONDS) * ANALYSIS_RATE
+        memory = samples * STREAM_BYTES + block * bytes_per_sample
+    else:
+        memory = samples * bytes_per_sample
+    return Cost(kind, duration, int(load + memory), duration * cpu, streaming)
+
+class Ticket:
+    def __init__(self, cost):
+        self.cost = cost
+        self.queued_at = time.monotonic()
+        self.wait = None
+
+class AdmissionController:
+    """
+    Starts a job only while its estimated memory fits what running jobs leave of
+    the budget and one of `slots` is free. Waiting jobs are admitted strictly in
+    arrival order, so a big job is never starved by a stream of small ones. A job
+    too big for the budget runs in streaming mode where its stage has one
+    (separation); otherwise it is rejected, as is anything over max_duration, or
+    anything arriving while max_queue jobs are already waiting.
+    """
+
+    STREAMABLE = {"separate"}
+
+    def __init__(self, memory_budget=MEMORY_BUDGET, slots=SLOTS, max_queue=MAX_QUEUE, max_duration=MAX_DURATION):
+        self.memory_budget = memory_budget
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_duration = max_duration
+        self.cond = threading.Condition()
+        self.queue = deque()
+        self.running = set()
+        self.memory_in_use = 0
+        self.waits = deque(maxlen=WAIT_HISTORY)
+        self.rejected = 0
+
+    def plan(self, kind, path):
+        """Estimated cost of the job, downgraded to streaming if needed; raises Rejected (413) if it can never run."""
+        cost = estimate(kind, path)
+        if cost.duration > self.max_duration:
+            raise Rejected(f"Input is {cost.duration:.0f}s long; the limit is {self.max_duration:.0f}s", 413)
+        if cost.memory > self.memory_budget and kind in self.STREAMABLE:
+            cost = estimate(kind, path, streaming=True)
+        if cost.memory > self.memory_budget:
+            raise Rejected(f"Job needs ~{cost.memory >> 20} MB; the budget is {self.memory_budget >> 20} MB", 413)
+        return cost
+
+    def request(self, kind, path):
+        """Plans the job and takes a place in the queue; raises Rejected (413, or 503 when the queue is full)."""
+        try:
+            ticket = Ticket(self.plan(kind, path))
+            with self.cond:
+                if len(self.queue) >= self.max_queue:
+                    raise Rejected("Server busy, try again later", 503, retry_after=self.expected_wait())
+                self.queue.append(ticket)
+            return ticket
+        except Rejected:
+            with self.cond:
+                self.rejected += 1
+            raise
+
+    def _fits(self, ticket):
+        return (self.queue[0] is ticket and len(self.running) < self.slots
+                and self.memory_in_use + ticket.cost.memory <= self.memory_budget)
+
+    def expected_wait(self, ticket=None):
+        """Rough seconds until `ticket` (or a new arrival) starts: CPU time of everything ahead, over the slots."""
+        ahead = list(self.running)
+        for queued in self.queue:
+            if queued is ticket:
+                break
+            ahead.append(queued)
+        return sum(t.cost.cpu_seconds for t in ahead) / self.slots
+
+    @contextmanager
+    def admitted(self, ticket, on_queued=None):
+        """
+        Blocks until `ticket` may run and holds its resources for the `with` body.
+        on_queued(position, estimated_wait) is called once if it has to wait.
+        A None ticket (a job that needs no admission) runs straight away.
+        """
+        if ticket is None:
+            yield 0.0
+            return
+        with self.cond:
+            notified = False
+            while not self._fits(ticket):
+                if on_queued and not notified:
+                    on_queued(self.queue.index(ticket) + 1, self.expected_wait(ticket))
+                    notified = True
+                self.cond.wait()
+            self.queue.popleft()
+            self.running.add(ticket)
+            self.memory_in_use += ticket.cost.memory
+            ticket.wait = time.monotonic() - ticket.queued_at
+            self.waits.append(ticket.wait)
+            # The next in line may fit alongside this one
+            self.cond.notify_all()
+        try:
+            yield ticket.wait
+        finally:
+            with self.cond:
+                self.running.discard(ticket)
+                self.memory_in_use -= ticket.cost.memory
+                self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            waits = np.array(self.waits)
+            return {
+                "running": len(self.running),
+                "queued": len(self.queue),
+                "rejected": self.rejected,
+                "slots": self.slots,
+                "memory_in_use_mb": self.memory_in_use >> 20,
+                "memory_budget_mb": self.memory_budget >> 20,
+                "expected_wait_s": self.expected_wait(),
+                "wait_s": {
+                    "mean": float(waits.mean()) if len(waits) else 0.0,
+                    "p50": float(np.percentile(waits, 50)) if len(waits) else 0.0,
+                    "p95": float(np.percentile(waits, 95)) if len(waits) else 0.0,
+                    "max": float(waits.max()) if len(waits) else 0.0,
+                },
+            }
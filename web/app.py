@@ -1,102 +1,384 @@
 import os
 import json
+import math
+import random
+import time
+import uuid
 import shutil
 import argparse
+import queue
+import threading
 import traceback
-from flask import Flask, render_template, request, jsonify, send_from_directory
+from collections import OrderedDict
+import librosa
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 
 from pipeline.separate import separate as separate_func
-from pipeline.transcribe import transcribe as transcribe_func
+from pipeline.transcribe import transcribe as transcribe_func, analyze, analysis_params, load_input
 from pipeline.render import render as render_func
 from pipeline.metrics import main as metrics_func
+from pipeline.peaks import peaks_path, read_peaks, select_level
+from pipeline.utils import find_stem, file_digest
+from pipeline.runs import find_runs, compare as compare_runs, parse_param
+from pipeline.profiler import SamplingProfiler
+from web.admission import AdmissionController, Rejected, MAX_UPLOAD_BYTES, STREAM_BLOCK_SECONDS
+from web.uploads import UploadManager, UploadError, CHUNK_SIZE
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+# Larger uploads are refused with 413 before they reach the disk
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 
 UPLOAD_FOLDER = '/tmp/results/uploads'
 OUTPUT_FOLDER = '/tmp/results/renders'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
+# Transcription front ends (CQT etc.) by input content hash and analysis
+# settings, so turning the threshold knob only re-runs the cheap note extraction
+FEATURE_CACHE_SIZE = 8
+feature_cache = OrderedDict()
+feature_cache_lock = threading.Lock()
+
+# Fraction of jobs run under the sampling profiler without being asked (?profile=1 always is)
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0.0))
+PROFILE_FOLDER = os.path.join(OUTPUT_FOLDER, 'profiles')
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50)) # newest profiles kept on disk
+
+# Jobs wait here until their estimated memory/CPU fits (web/admission.py)
+admission = AdmissionController()
+# Resumable chunked uploads, hashed and decoded while they arrive (web/uploads.py)
+uploads = UploadManager(UPLOAD_FOLDER, MAX_UPLOAD_BYTES, admission.max_duration)
+
 @app.route('/')
 def index():
     return render_template('studio.html')
 
-@app.route('/api/separate', methods=['POST'])
-def separate():
+def load_json(path):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            return json.load(f)
+    return {}
+
+def result_url(path):
+    return '/results/' + os.path.relpath(path, OUTPUT_FOLDER).replace(os.sep, '/')
+
+# Each job takes the request inputs plus an optional progress callback and
+# returns the same payload the blocking endpoints send back.
+
+def separate_job(input_path, ticket, emit=None, upload=None):
+    separate_args = argparse.Namespace(
+        input=input_path,
+        outdir=OUTPUT_FOLDER,
+        seed=42,
+        # Signal already decoded while a chunked upload arrived
+        audio=upload and upload.take_audio(),
+        # Inputs too long to separate in one piece within the memory budget
+        block_seconds=STREAM_BLOCK_SECONDS if ticket.cost.streaming else None,
+        progress=emit
+    )
+    with admission.admitted(ticket, queued_callback(emit)):
+        separate_func(separate_args)
+
+    diagnostics = load_json(os.path.join(OUTPUT_FOLDER, "separation_diagnostics.json"))
+
+    # Return stem URLs
+    stem_files = diagnostics.get("stem_files", {})
+    stems = {}
+    for stem in diagnostics.get("stems_created", []):
+        stems[stem] = "/results/" + stem_files.get(stem, f"stems/{stem}.wav")
+
+    return {
+        'status': 'success',
+        'diagnostics': diagnostics,
+        'stems_created': diagnostics.get("stems_created", []),
+        'stems': stems,
+        'admission': admission_info(ticket)
+    }
+
+def queued_callback(emit):
+    if emit is None:
+        return None
+    return lambda position, wait: emit('queued', {'position': position, 'expected_wait_s': wait})
+
+def admission_info(ticket):
+    if ticket is None:
+        return {'wait_s': 0.0, 'streaming': False}
+    return {
+        'wait_s': ticket.wait,
+        'streaming': ticket.cost.streaming,
+        'estimated_memory_mb': ticket.cost.memory >> 20,
+        'estimated_cpu_s': ticket.cost.cpu_seconds
+    }
+
+def input_digest(input_path, upload=None):
+    # A chunked upload was hashed as it arrived
+    return upload.digest if upload else file_digest(input_path)
+
+def feature_key(input_path, args, upload=None):
+    return (input_digest(input_path, upload),) + analysis_params(args)
+
+def features_cached(input_path, args, upload=None):
+    with feature_cache_lock:
+        return feature_key(input_path, args, upload) in feature_cache
+
+def cached_features(input_path, args, upload=None, emit=None):
+    """analyze() result for this input, computed at most once per distinct file content and settings."""
+    key = feature_key(input_path, args, upload)
+    with feature_cache_lock:
+        if key in feature_cache:
+            feature_cache.move_to_end(key)
+            return feature_cache[key], True
+
+    if emit:
+        emit('progress', {'step': 'analyze'})
+    audio = upload and upload.take_audio()
+    if audio:
+        y, sr = librosa.util.normalize(audio[0]), audio[1]
+    else:
+        y, sr = load_input(input_path)
+    features = analyze(y, sr, args)
+    with feature_cache_lock:
+        feature_cache[key] = features
+        while len(feature_cache) > FEATURE_CACHE_SIZE:
+            feature_cache.popitem(last=False)
+    return features, False
+
+def transcription_args(input_path, threshold, emit=None):
+    return argparse.Namespace(
+        input=input_path,
+        outdir=OUTPUT_FOLDER,
+        threshold=threshold,
+        seed=42,
+        progress=emit
+    )
+
+def transcribe_job(input_path, threshold, ticket, emit=None, upload=None):
+    transcribe_args = transcription_args(input_path, threshold, emit)
+    with admission.admitted(ticket, queued_callback(emit)):
+        features, cached = cached_features(input_path, transcribe_args, upload, emit)
+        transcribe_func(transcribe_args, features)
+
+    return {
+        'status': 'success',
+        'cached': cached,
+        'admission': admission_info(ticket),
+        'diagnostics': load_json(os.path.join(OUTPUT_FOLDER, "transcription_diagnostics.json"))
+    }
+
+RENDER_MIDI = os.path.join(OUTPUT_FOLDER, 'transcription.mid')
+
+def render_job(humanize, seed, ticket, emit=None):
+    input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
+    midi_path = RENDER_MIDI
+    wav_path = os.path.join(OUTPUT_FOLDER, 'rendered.wav')
+    json_path = os.path.join(OUTPUT_FOLDER, 'metrics.json')
+
+    render_args = argparse.Namespace(
+        midi=midi_path,
+        out=wav_path,
+        seed=seed,
+        humanize=humanize,
+        incremental=True,
+        progress=emit
+    )
+    with admission.admitted(ticket, queued_callback(emit)):
+        render_func(render_args)
+
+        if emit:
+            emit('progress', {'step': 'metrics'})
+        try:
+            metrics_args = argparse.Namespace(
+                ref=input_path,
+                hyp=wav_path,
+                midi=midi_path,
+                out=json_path
+            )
+            metrics_func(metrics_args)
+        except Exception as e:
+            print(f"[!] Metrics calculation failed: {e}\n{traceback.format_exc()}")
+
+    return {
+        'status': 'success',
+        'metrics': load_json(json_path),
+        # No render when the transcription abstained
+        'audio_url': '/results/rendered.wav' if os.path.exists(wav_path) else None,
+        'admission': admission_info(ticket)
+    }
+
+def prune_profiles(folder=PROFILE_FOLDER, keep=PROFILE_KEEP):
+    """Deletes all but the `keep` newest profile directories."""
+    if not os.path.isdir(folder):
+        return
+    dirs = [entry for entry in os.scandir(folder) if entry.is_dir()]
+    dirs.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in dirs[keep:]:
+        # A concurrent job may be pruning the same directory
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def profiled(kind, job):
+    """
+    job(emit), run under the sampling profiler when the request asks for it
+    (?profile=1) or PROFILE_SAMPLE_RATE picks it. Only the job's own thread is
+    sampled, so concurrent jobs don't show up in each other's profiles.
+    """
+    if request.values.get('profile') != '1' and random.random() >= PROFILE_SAMPLE_RATE:
+        return lambda emit=None: job(emit)
+
+    def run(emit=None):
+        outdir = os.path.join(PROFILE_FOLDER, f"{kind}_{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:6]}")
+        with SamplingProfiler(threads=[threading.get_ident()]) as profiler:
+            with profiler.stage(kind):
+                result = job(emit)
+        paths, report = profiler.write(outdir)
+        prune_profiles()
+        return dict(result, profile={
+            'flamegraph': result_url(paths['flamegraph']),
+            'folded': result_url(paths['folded']),
+            'report': result_url(paths['report']),
+            'overhead': report['overhead'],
+            'hotspots': report['hotspots'][:5],
+        })
+    return run
+
+def stream_job(job, error):
+    """
+    Runs job(emit) on a worker thread and streams its progress as
+    newline-delimited JSON, ending with a 'done' (or 'error') event.
+    """
+    events = queue.Queue()
+
+    def emit(event, data):
+        if 'path' in data:
+            data = dict(data, url=result_url(data.pop('path')))
+        events.put(dict(data, event=event))
+
+    def worker():
+        try:
+            events.put(dict(job(emit), event='done'))
+        except Exception:
+            events.put({'event': 'error', 'error': error, 'details': traceback.format_exc()})
+        finally:
+            events.put(None)
+
+    threading.Thread(target=worker, daemon=True).start()
+
+    def generate():
+        while True:
+            item = events.get()
+            if item is None:
+                break
+            yield json.dumps(item) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson', headers={'X-Accel-Buffering': 'no'})
+
+def replace_input():
+    """Path for a new session input; the old one is unlinked first, as it may share its file with a chunked upload."""
+    input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
+    if os.path.lexists(input_path):
+        os.remove(input_path)
+    return input_path
+
+def attach_upload(upload_id):
+    """Makes a finished chunked upload the session input; returns (path, upload, error response)."""
+    try:
+        upload = uploads.get(upload_id)
+    except UploadError as e:
+        return None, None, (jsonify({'error': str(e)}), e.status)
+    status = upload.status()
+    if status['error']:
+        return None, None, (jsonify({'error': status['error']}), 413)
+    if not status['complete']:
+        return None, None, (jsonify({'error': 'Upload is not complete', 'missing': status['missing']}), 409)
+    upload.wait()
+    if not upload.verified():
+        return None, None, (jsonify({'error': upload.error or 'Upload failed verification'}), 422)
+
+    input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
+    if not (os.path.exists(input_path) and os.path.samefile(input_path, upload.path)):
+        # Linked, not copied: the upload already sits in the workspace
+        os.link(upload.path, replace_input())
+    return input_path, upload, None
+
+def save_upload():
+    """
+    Saves the uploaded file (or attaches the chunked upload named by the
+    'upload' field) as the session input; returns (path, upload, error response).
+    """
+    if request.form.get('upload'):
+        return attach_upload(request.form['upload'])
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+        return None, None, (jsonify({'error': 'No file part'}), 400)
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return None, None, (jsonify({'error': 'No selected file'}), 400)
 
-    input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
+    input_path = replace_input()
     file.save(input_path)
+    return input_path, None, None
 
+def request_admission(kind, path):
+    """Queue place for a `kind` job on `path`; returns (ticket, error response)."""
     try:
-        separate_args = argparse.Namespace(
-            input=input_path,
-            outdir=OUTPUT_FOLDER,
-            seed=42
-        )
-        separate_func(separate_args)
-        
-        diag_path = os.path.join(OUTPUT_FOLDER, "separation_diagnostics.json")
-        diagnostics = {}
-        if os.path.exists(diag_path):
-            with open(diag_path, 'r') as f:
-                diagnostics = json.load(f)
-
-        # Return stem URLs
-        stems = {}
-        for stem in diagnostics.get("stems_created", []):
-            stems[stem] = f"/results/stems/{stem}.wav"
-
-        return jsonify({
-            'status': 'success',
-            'diagnostics': diagnostics,
-            'stems_created': diagnostics.get("stems_created", []),
-            'stems': stems
-        })
-    except Exception as e:
-        return jsonify({'error': 'Separation Failed', 'details': traceback.format_exc()}), 500
+        return admission.request(kind, path), None
+    except Rejected as e:
+        headers = {'Retry-After': str(math.ceil(e.retry_after))} if e.retry_after is not None else {}
+        return None, (jsonify({'error': str(e)}), e.status, headers)
+    except Exception:
+        return None, (jsonify({'error': 'Unreadable input', 'details': traceback.format_exc()}), 400)
 
-@app.route('/api/transcribe', methods=['POST'])
-def transcribe():
-    threshold = float(request.form.get('threshold', 0.6))
+def transcription_admission(input_path, threshold, upload=None):
+    # Re-thresholding a cached analysis costs next to nothing; don't queue it
+    if features_cached(input_path, transcription_args(input_path, threshold), upload):
+        return None, None
+    return request_admission('transcribe', input_path)
+
+def transcribe_input():
+    """Resolves the transcription input from the form; returns (path, upload, error response)."""
     stem = request.form.get('stem')
 
     if stem:
-        input_path = os.path.join(OUTPUT_FOLDER, "stems", f"{stem}.wav")
+        stems_dir = os.path.join(OUTPUT_FOLDER, "stems")
+        input_path = find_stem(stems_dir, stem) or os.path.join(stems_dir, f"{stem}.wav")
+    elif request.form.get('upload'):
+        return attach_upload(request.form['upload'])
     else:
         if 'file' in request.files:
             file = request.files['file']
-            input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
+            input_path = replace_input()
             file.save(input_path)
         else:
             input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
 
     if not os.path.exists(input_path):
-        return jsonify({'error': f'Input file not found: {input_path}'}), 400
+        return None, None, (jsonify({'error': f'Input file not found: {input_path}'}), 400)
+    return input_path, None, None
+
+@app.route('/api/separate', methods=['POST'])
+def separate():
+    input_path, upload, error = save_upload()
+    if error:
+        return error
+    ticket, error = request_admission('separate', input_path)
+    if error:
+        return error
 
     try:
-        transcribe_args = argparse.Namespace(
-            input=input_path,
-            outdir=OUTPUT_FOLDER,
-            threshold=threshold,
-            seed=42
-        )
-        transcribe_func(transcribe_args)
-        
-        diag_path = os.path.join(OUTPUT_FOLDER, "transcription_diagnostics.json")
-        diagnostics = {}
-        if os.path.exists(diag_path):
-            with open(diag_path, 'r') as f:
-                diagnostics = json.load(f)
-
-        return jsonify({
-            'status': 'success',
-            'diagnostics': diagnostics
-        })
+        return jsonify(profiled('separate', lambda emit: separate_job(input_path, ticket, emit, upload))())
+    except Exception as e:
+        return jsonify({'error': 'Separation Failed', 'details': traceback.format_exc()}), 500
+
+@app.route('/api/transcribe', methods=['POST'])
+def transcribe():
+    threshold = float(request.form.get('threshold', 0.6))
+    input_path, upload, error = transcribe_input()
+    if error:
+        return error
+    ticket, error = transcription_admission(input_path, threshold, upload)
+    if error:
+        return error
+
+    try:
+        return jsonify(profiled('transcribe', lambda emit: transcribe_job(input_path, threshold, ticket, emit, upload))())
     except Exception as e:
         return jsonify({'error': 'Transcription Failed', 'details': traceback.format_exc()}), 500
 
@@ -104,48 +386,161 @@ def transcribe():
 def render():
     humanize = request.form.get('humanize') == 'true'
     seed = int(request.form.get('seed', 42))
-
-    input_path = os.path.join(UPLOAD_FOLDER, 'input.wav')
-    midi_path = os.path.join(OUTPUT_FOLDER, 'transcription.mid')
-    wav_path = os.path.join(OUTPUT_FOLDER, 'rendered.wav')
-    json_path = os.path.join(OUTPUT_FOLDER, 'metrics.json')
+    ticket, error = request_admission('render', RENDER_MIDI)
+    if error:
+        return error
 
     try:
-        render_args = argparse.Namespace(
-            midi=midi_path,
-            out=wav_path,
-            seed=seed,
-            humanize=humanize
-        )
-        render_func(render_args)
+        return jsonify(profiled('render', lambda emit: render_job(humanize, seed, ticket, emit))())
     except Exception as e:
         return jsonify({'error': 'Rendering Failed', 'details': traceback.format_exc()}), 500
 
+@app.route('/api/stream/separate', methods=['POST'])
+def stream_separate():
+    input_path, upload, error = save_upload()
+    if error:
+        return error
+    ticket, error = request_admission('separate', input_path)
+    if error:
+        return error
+    return stream_job(profiled('separate', lambda emit: separate_job(input_path, ticket, emit, upload)), 'Separation Failed')
+
+@app.route('/api/stream/transcribe', methods=['POST'])
+def stream_transcribe():
+    threshold = float(request.form.get('threshold', 0.6))
+    input_path, upload, error = transcribe_input()
+    if error:
+        return error
+    ticket, error = transcription_admission(input_path, threshold, upload)
+    if error:
+        return error
+    return stream_job(profiled('transcribe', lambda emit: transcribe_job(input_path, threshold, ticket, emit, upload)), 'Transcription Failed')
+
+@app.route('/api/stream/render', methods=['POST'])
+def stream_render():
+    humanize = request.form.get('humanize') == 'true'
+    seed = int(request.form.get('seed', 42))
+    ticket, error = request_admission('render', RENDER_MIDI)
+    if error:
+        return error
+    return stream_job(profiled('render', lambda emit: render_job(humanize, seed, ticket, emit)), 'Rendering Failed')
+
+# Chunked uploads: create a session with the file's size (and SHA-1), PUT the
+# chunks to ?offset= in any order, GET the status to find what is missing
+# after a dropped connection, then pass the id as the 'upload' field of a job.
+
+def upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+@app.route('/api/uploads', methods=['POST'])
+def create_upload():
+    body = request.get_json(silent=True) or request.form
     try:
-        metrics_args = argparse.Namespace(
-            ref=input_path,
-            hyp=wav_path,
-            midi=midi_path,
-            out=json_path
-        )
-        metrics_func(metrics_args)
-    except Exception as e:
-        print(f"[!] Metrics calculation failed: {e}\n{traceback.format_exc()}")
+        upload = uploads.create(int(body.get('size', 0)), body.get('sha1'), body.get('filename'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size must be an integer'}), 400
+    except UploadError as e:
+        return upload_error(e)
+    return jsonify(dict(upload.status(), chunk_size=CHUNK_SIZE)), 201
 
-    metrics = {}
-    if os.path.exists(json_path):
-        with open(json_path, 'r') as f:
-            metrics = json.load(f)
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Writes the request body at ?offset=; X-Chunk-SHA1, if sent, is checked before the chunk counts."""
+    if request.content_length is None:
+        return jsonify({'error': 'Content-Length required'}), 411
+    try:
+        upload = uploads.get(upload_id)
+        return jsonify(upload.write(int(request.args.get('offset', 0)), request.stream, request.content_length,
+                                    request.headers.get('X-Chunk-SHA1')))
+    except ValueError:
+        return jsonify({'error': 'offset must be an integer'}), 400
+    except UploadError as e:
+        return upload_error(e)
 
-    return jsonify({
-        'status': 'success',
-        'metrics': metrics,
-        'audio_url': '/results/rendered.wav'
-    })
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def upload_status(upload_id):
+    try:
+        return jsonify(uploads.get(upload_id).status())
+    except UploadError as e:
+        return upload_error(e)
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Waits for the checksum (and decoding) to catch up with the last chunk; 422 if the SHA-1 doesn't match."""
+    try:
+        upload = uploads.get(upload_id)
+    except UploadError as e:
+        return upload_error(e)
+    status = upload.status()
+    if status['error']:
+        return jsonify(status), 413
+    if not status['complete']:
+        return jsonify(dict(status, error='Upload is not complete')), 409
+    upload.wait()
+    status = upload.status()
+    if not upload.verified():
+        uploads.discard(upload_id)
+        return jsonify(status), 422 if status['sha1'] else 413
+    return jsonify(status)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+def delete_upload(upload_id):
+    uploads.discard(upload_id)
+    return '', 204
+
+@app.route('/api/admission')
+def admission_stats():
+    """Running and queued jobs, memory in use and recent queue wait times."""
+    return jsonify(admission.stats())
+
+@app.route('/api/runs')
+def list_runs():
+    """
+    Indexed pipeline runs (pipeline/runs.py). ?input_hash=, ?param=name=value
+    (repeatable), ?order_by=<metric> with ?asc=1 for lowest first, ?limit=.
+    """
+    params = dict(parse_param(p) for p in request.args.getlist('param'))
+    limit = min(request.args.get('limit', 50, type=int), 1000)
+    return jsonify(find_runs(request.args.get('input_hash'), params, request.args.get('order_by'),
+                             request.args.get('asc') == '1', limit))
+
+@app.route('/api/runs/compare')
+def compare_run_metrics():
+    """?id=1&id=2...: every metric per run and its change from the first."""
+    ids = request.args.getlist('id', type=int)
+    if not ids:
+        return jsonify({'error': 'Pass run ids as ?id=1&id=2'}), 400
+    return jsonify(compare_runs(ids))
 
 @app.route('/results/<path:filename>')
 def download_file(filename):
-    return send_from_directory(OUTPUT_FOLDER, filename)
+    # Conditional responses honour Range headers (206 Partial Content) for seeking
+    return send_from_directory(OUTPUT_FOLDER, filename, conditional=True)
+
+@app.route('/peaks/<path:filename>')
+def download_peaks(filename):
+    """
+    Waveform summary of a result file: int16 (min, max, rms) triples at the
+    coarsest precomputed resolution with at least ?width= columns.
+    """
+    try:
+        width = int(request.args.get('width', 1024))
+    except ValueError:
+        width = 0
+    if width <= 0:
+        return jsonify({'error': 'width must be a positive integer'}), 400
+    path = peaks_path(os.path.join(OUTPUT_FOLDER, filename))
+    if not os.path.abspath(path).startswith(os.path.abspath(OUTPUT_FOLDER) + os.sep) or not os.path.exists(path):
+        return jsonify({'error': 'No peaks for this file'}), 404
+
+    sr, n_samples, levels = read_peaks(path)
+    block, cols = select_level(levels, width)
+    return Response(cols.tobytes(), mimetype='application/octet-stream', headers={
+        'X-Peaks-Block': str(block),
+        'X-Peaks-Sample-Rate': str(sr),
+        'X-Peaks-Samples': str(n_samples),
+        'Cache-Control': 'no-cache'
+    })
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
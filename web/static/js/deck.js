@@ -10,6 +10,7 @@ const statusText = document.getElementById('statusText');
 const stemSelect = document.getElementById('stemSelect');
 
 let currentFile = null;
+let currentUpload = null; // promise of the chunked upload's id
 let separatedStems = {};
 
 // Audio Context for Visualization
@@ -50,6 +51,7 @@ function initKnob(knob) {
     });
 
     window.addEventListener('mouseup', () => {
+        if (isDragging) knob.dispatchEvent(new Event('change'));
         isDragging = false;
     });
 }
@@ -70,6 +72,9 @@ function handleFile(e) {
         separateBtn.classList.add('active-btn');
         visualizeAudio(file, 'inputCanvas');
         logS.textContent = "> SOURCE TAPE LOADED. SEPARATOR READY.";
+        // Uploading starts now; the server decodes it while the rest arrives
+        currentUpload = uploadFile(file);
+        currentUpload.catch(err => { logS.textContent = "!! UPLOAD ERROR: " + err.message; });
 
         // Reset stems
         separatedStems = {};
@@ -77,7 +82,88 @@ function handleFile(e) {
     }
 }
 
+// Chunked upload: each chunk is PUT at its offset with its SHA-1 and retried
+// on failure; after that the server's list of missing ranges is re-sent
+async function sha1Hex(buffer) {
+    if (!window.crypto || !crypto.subtle) return null;
+    const digest = await crypto.subtle.digest('SHA-1', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function putChunk(id, file, start, end) {
+    const body = await file.slice(start, end).arrayBuffer();
+    const headers = {};
+    const sha1 = await sha1Hex(body);
+    if (sha1) headers['X-Chunk-SHA1'] = sha1;
+    for (let attempt = 0; ; attempt++) {
+        try {
+            const res = await fetch(`/api/uploads/${id}?offset=${start}`, { method: 'PUT', headers, body });
+            if (res.ok) return res.json();
+            const data = await res.json();
+            if (res.status === 413 || res.status === 416 || attempt >= 2) throw new Error(data.error);
+        } catch (err) {
+            if (attempt >= 2) throw err;
+        }
+        await new Promise(resolve => setTimeout(resolve, 500 * (attempt + 1)));
+    }
+}
+
+async function uploadFile(file) {
+    let res = await fetch('/api/uploads', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ size: file.size, filename: file.name })
+    });
+    let status = await res.json();
+    if (!res.ok) throw new Error(status.error);
+    const id = status.id;
+    const chunkSize = status.chunk_size;
+
+    for (let pass = 0; status.missing.length && pass < 3; pass++) {
+        for (const [start, end] of status.missing) {
+            for (let offset = start; offset < end; offset += chunkSize) {
+                status = await putChunk(id, file, offset, Math.min(end, offset + chunkSize));
+            }
+        }
+        status = await (await fetch(`/api/uploads/${id}`)).json();
+    }
+    res = await fetch(`/api/uploads/${id}/complete`, { method: 'POST' });
+    status = await res.json();
+    if (!res.ok) throw new Error(status.error || 'Upload incomplete');
+    return id;
+}
+
 // 3. Visualization Logic
+// Result files come with precomputed peaks: int16 (min, max, rms) triples
+// at roughly canvas resolution, a few KB instead of the whole file.
+async function fetchPeaks(url, width) {
+    const peaksUrl = url.split('?')[0].replace(/^\/results\//, '/peaks/') + `?width=${width}`;
+    const resp = await fetch(peaksUrl);
+    if (!resp.ok) return null;
+    return new Int16Array(await resp.arrayBuffer());
+}
+
+function drawWaveformPeaks(canvas, ctx, peaks, color) {
+    const cols = peaks.length / 3;
+    const amp = canvas.height / 2;
+    ctx.beginPath();
+    ctx.strokeStyle = color;
+    ctx.lineWidth = 1;
+    for (let i = 0; i < canvas.width; i++) {
+        const start = Math.floor(i * cols / canvas.width);
+        const end = Math.max(start + 1, Math.floor((i + 1) * cols / canvas.width));
+        let min = 1.0;
+        let max = -1.0;
+        for (let c = start; c < end && c < cols; c++) {
+            min = Math.min(min, peaks[c * 3] / 32767);
+            max = Math.max(max, peaks[c * 3 + 1] / 32767);
+        }
+        ctx.moveTo(i, amp + min * amp);
+        ctx.lineTo(i, amp + max * amp);
+    }
+    ctx.stroke();
+}
+
 async function visualizeAudio(fileOrUrl, canvasId) {
     const canvas = document.getElementById(canvasId);
     if (!canvas) return;
@@ -85,6 +171,15 @@ async function visualizeAudio(fileOrUrl, canvasId) {
     let arrayBuffer;
 
     try {
+        if (!(fileOrUrl instanceof File)) {
+            const peaks = await fetchPeaks(fileOrUrl, canvas.width);
+            if (peaks) {
+                clearCanvas(canvasId);
+                drawWaveformPeaks(canvas, ctx, peaks, canvasId === 'inputCanvas' ? "#00ffcc" : "#ff9900");
+                return;
+            }
+        }
+
         if (fileOrUrl instanceof File) {
             arrayBuffer = await fileOrUrl.arrayBuffer();
         } else {
@@ -127,6 +222,96 @@ async function visualizeAudio(fileOrUrl, canvasId) {
     }
 }
 
+// Streaming jobs: the /api/stream/* endpoints send one JSON event per line
+// ('progress' as each step starts, then results as they are written), ending
+// with 'done' (same payload as the blocking API) or 'error'.
+async function streamJob(url, formData, onEvent) {
+    const res = await fetch(url, { method: 'POST', body: formData });
+    if (!res.body) throw new Error("Streaming not supported");
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffered = '';
+    let final = null;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (value) buffered += decoder.decode(value, { stream: true });
+        const lines = buffered.split('\n');
+        buffered = done ? '' : lines.pop();
+        for (const line of lines) {
+            if (!line.trim()) continue;
+            const event = JSON.parse(line);
+            if (event.error) throw new Error(event.error);
+            if (event.event === 'done') final = event;
+            else onEvent(event);
+        }
+        if (done) break;
+    }
+    if (!final) throw new Error("Stream ended early");
+    return final;
+}
+
+// Jobs over the server's memory/CPU budget wait their turn before starting
+function showQueued(log, event) {
+    log.innerHTML = `>>> QUEUED #${event.position} (~${Math.ceil(event.expected_wait_s)}s)`;
+}
+
+// The step a job is working on, with how far it got when the step reports it
+function showProgress(log, title, event) {
+    const pct = event.fraction !== undefined ? ` ${Math.round(event.fraction * 100)}%` : '';
+    log.innerHTML = `${title}<br>> ${event.step.toUpperCase()}${pct}`;
+}
+
+function clearCanvas(canvasId) {
+    const canvas = document.getElementById(canvasId);
+    const ctx = canvas.getContext('2d');
+    ctx.fillStyle = "#080808";
+    ctx.fillRect(0, 0, canvas.width, canvas.height);
+}
+
+// Piano roll drawn block by block as note events arrive
+function drawNotes(canvasId, notes, duration) {
+    const canvas = document.getElementById(canvasId);
+    const ctx = canvas.getContext('2d');
+    const rowHeight = canvas.height / 84;
+    ctx.fillStyle = "#00ffcc";
+    notes.forEach(([pitch, start, end]) => {
+        const x = (start / duration) * canvas.width;
+        const w = Math.max(1, ((end - start) / duration) * canvas.width);
+        const y = canvas.height - (pitch - 24 + 1) * rowHeight;
+        ctx.fillRect(x, y, w, Math.max(1, rowHeight));
+    });
+}
+
+// Waveform drawn chunk by chunk from streamed min/max peaks
+function drawPeaks(canvasId, chunk, duration) {
+    const canvas = document.getElementById(canvasId);
+    const ctx = canvas.getContext('2d');
+    const amp = canvas.height / 2;
+    const x0 = (chunk.offset / duration) * canvas.width;
+    const colWidth = (chunk.duration / duration) * canvas.width / chunk.min.length;
+
+    ctx.beginPath();
+    ctx.strokeStyle = "#ff9900";
+    ctx.lineWidth = 1;
+    for (let i = 0; i < chunk.min.length; i++) {
+        const x = x0 + i * colWidth;
+        ctx.moveTo(x, amp + chunk.min[i] * amp);
+        ctx.lineTo(x, amp + chunk.max[i] * amp);
+    }
+    ctx.stroke();
+}
+
+// Show the waveform of whichever stem is targeted for transcription
+stemSelect.addEventListener('change', () => {
+    const stem = stemSelect.value;
+    if (stem === 'original') {
+        if (currentFile) visualizeAudio(currentFile, 'inputCanvas');
+    } else if (separatedStems[stem]) {
+        visualizeAudio(separatedStems[stem], 'inputCanvas');
+    }
+});
+
 // 4. Track S: Separate
 separateBtn.addEventListener('click', async () => {
     if (!currentFile || separateBtn.classList.contains('disabled')) return;
@@ -136,21 +321,26 @@ separateBtn.addEventListener('click', async () => {
     separateBtn.classList.add('blink');
 
     const formData = new FormData();
-    formData.append('file', currentFile);
-
     try {
-        const res = await fetch('/api/separate', { method: 'POST', body: formData });
-        const data = await res.json();
-
-        if (data.error) throw new Error(data.error);
-
-        separatedStems = data.stems; // {vocals: url, bass: url, ...}
+        formData.append('upload', await currentUpload);
+    } catch (err) {
+        formData.append('file', currentFile);
+    }
 
-        data.stems_created.forEach(stem => {
-            const led = document.querySelector(`.stem-led[data-stem="${stem}"]`);
+    try {
+        // Stems light up as soon as each one is written
+        const data = await streamJob('/api/stream/separate', formData, event => {
+            if (event.event === 'queued') showQueued(logS, event);
+            if (event.event === 'progress') showProgress(logS, ">>> SEPARATING STEMS... [UNIT 00]", event);
+            if (event.event !== 'stem') return;
+            separatedStems[event.name] = event.url;
+            const led = document.querySelector(`.stem-led[data-stem="${event.name}"]`);
             if (led) led.classList.add('active');
+            logS.innerHTML = `>>> SEPARATING STEMS... [UNIT 00]<br>> ${event.name.toUpperCase()} READY`;
         });
 
+        separatedStems = data.stems; // {vocals: url, bass: url, ...}
+
         logS.innerHTML = `> SEPARATION COMPLETE.<br>> STEMS: ${data.stems_created.join(', ').toUpperCase()}`;
         separateBtn.textContent = "DONE";
         separateBtn.classList.remove('active-btn', 'blink');
@@ -167,9 +357,19 @@ separateBtn.addEventListener('click', async () => {
 });
 
 // 5. Track A: Transcribe
-transcribeBtn.addEventListener('click', async () => {
+let transcribed = false;
+
+transcribeBtn.addEventListener('click', () => {
     if (transcribeBtn.classList.contains('disabled')) return;
+    runTranscription();
+});
 
+// The server caches the CQT per input, so re-thresholding is near-instant
+document.getElementById('thresholdKnob').addEventListener('change', () => {
+    if (transcribed) runTranscription();
+});
+
+async function runTranscription() {
     const targetStem = stemSelect.value;
     logA.textContent = `>>> TRANSCRIBING ${targetStem.toUpperCase()}... [TRACK A]`;
     transcribeBtn.textContent = "BUSY...";
@@ -177,7 +377,11 @@ transcribeBtn.addEventListener('click', async () => {
 
     const formData = new FormData();
     if (targetStem === 'original') {
-        formData.append('file', currentFile);
+        try {
+            formData.append('upload', await currentUpload);
+        } catch (err) {
+            formData.append('file', currentFile);
+        }
     } else {
         // We'll tell the backend which stem to use from the last separation
         formData.append('stem', targetStem);
@@ -185,11 +389,16 @@ transcribeBtn.addEventListener('click', async () => {
     formData.append('threshold', document.getElementById('thresholdKnob').dataset.value);
 
     try {
-        const res = await fetch('/api/transcribe', { method: 'POST', body: formData });
-        const data = await res.json();
-
-        if (data.error) throw new Error(data.error);
+        let duration = 1;
+        clearCanvas('rollCanvas');
+        const data = await streamJob('/api/stream/transcribe', formData, event => {
+            if (event.event === 'queued') showQueued(logA, event);
+            if (event.event === 'progress') showProgress(logA, `>>> TRANSCRIBING ${targetStem.toUpperCase()}... [TRACK A]`, event);
+            if (event.event === 'start') duration = event.duration;
+            if (event.event === 'notes') drawNotes('rollCanvas', event.notes, duration);
+        });
 
+        transcribed = true;
         const warnCount = data.diagnostics.warnings.length;
         logA.innerHTML = `> TRACK A COMPLETE.<br>> CONFIDENCE: ${(data.diagnostics.confidence * 100).toFixed(1)}%<br>> WARNINGS: ${warnCount}`;
 
@@ -208,7 +417,7 @@ transcribeBtn.addEventListener('click', async () => {
         transcribeBtn.textContent = "FAIL";
         transcribeBtn.classList.remove('blink');
     }
-});
+}
 
 // 6. Track B: Render
 renderBtn.addEventListener('click', async () => {
@@ -223,18 +432,30 @@ renderBtn.addEventListener('click', async () => {
     formData.append('seed', document.getElementById('seedInput').value);
 
     try {
-        const res = await fetch('/api/render', { method: 'POST', body: formData });
-        const data = await res.json();
-        if (data.error) throw new Error(data.error);
+        let duration = 1;
+        let chunks = 0;
+        const data = await streamJob('/api/stream/render', formData, event => {
+            if (event.event === 'queued') statusText.textContent = `QUEUED #${event.position}`;
+            if (event.event === 'progress') statusText.textContent = `${event.step.toUpperCase()}...`;
+            if (event.event === 'start') {
+                duration = event.duration;
+                clearCanvas('outputCanvas');
+            }
+            if (event.event === 'audio_chunk') {
+                drawPeaks('outputCanvas', event, duration);
+                chunks++;
+            }
+        });
 
         document.getElementById('val-mse').textContent = data.metrics.spectral_mse.toFixed(4);
         document.getElementById('val-f1').textContent = data.metrics.note_f1.toFixed(2);
         document.getElementById('val-mfcc').textContent = data.metrics.mfcc_dist.toFixed(0);
 
-        const player = document.getElementById('audioPlayer');
-        player.src = data.audio_url + '?t=' + new Date().getTime();
-
-        visualizeAudio(data.audio_url, 'outputCanvas');
+        if (data.audio_url) {
+            const player = document.getElementById('audioPlayer');
+            player.src = data.audio_url + '?t=' + new Date().getTime();
+            if (!chunks) visualizeAudio(data.audio_url, 'outputCanvas');
+        }
 
         renderBtn.textContent = "RENDER DONE";
         renderBtn.classList.remove('blink');
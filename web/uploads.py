@@ -0,0 +1,296 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+import uuid
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+# Resumable chunked uploads: the file is preallocated in the workspace and each
+# chunk is streamed from its request straight to its offset, so nothing is
+# buffered whole and chunks can be retried or arrive out of order. An ingest
+# thread follows the contiguous prefix as it grows: it hashes it (the checksum
+# is known as soon as the last byte lands), parses the audio header from the
+# first bytes so oversized inputs are turned away early, and decodes WAV data
+# to the 22.05 kHz analysis signal while later chunks are still in flight.
+CHUNK_SIZE = 8 << 20 # suggested to clients
+COPY_SIZE = 1 << 20
+HEADER_BYTES = 64 << 10 # header parsing starts once this much (or the whole file) is in
+UPLOAD_TTL = 3600.0 # seconds an idle upload is kept
+ANALYSIS_RATE = 22050
+DECODE_FRAMES = 1 << 16
+# Bytes per sample of the WAV subtypes decoded while uploading
+SAMPLE_BYTES = {"PCM_U8": 1, "PCM_16": 2, "PCM_24": 3, "PCM_32": 4, "FLOAT": 4, "DOUBLE": 8}
+
+class UploadError(Exception):
+    """A bad upload request; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def wav_data_offset(path):
+    """Byte offset of a RIFF/WAVE file's 'data' chunk, or None for anything else."""
+    with open(path, "rb") as f:
+        head = f.read(12)
+        if len(head) < 12 or head[:4] not in (b"RIFF", b"RF64") or head[8:12] != b"WAVE":
+            return None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            name, size = chunk[:4], struct.unpack("<I", chunk[4:])[0]
+            if name == b"data":
+                return f.tell()
+            f.seek(size + (size & 1), os.SEEK_CUR)
+
+def merge_range(ranges, start, end):
+    """Adds [start, end) to a sorted list of disjoint ranges."""
+    merged = []
+    for s, e in sorted(ranges + [(start, end)]):
+        if merged and s <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], e))
+        else:
+            merged.append((s, e))
+    return merged
+
+class StreamingDecoder:
+    """
+    The mono ANALYSIS_RATE float32 signal librosa.load(path, sr=ANALYSIS_RATE)
+    would give for a PCM/float WAV that is still being written: frames are
+    decoded and resampled as soon as all their bytes are in.
+    """
+
+    def __init__(self, path, info, data_offset):
+        self.file = sf.SoundFile(path)
+        self.data_offset = data_offset
+        self.frame_bytes = SAMPLE_BYTES[info.subtype] * info.channels
+        self.frames = info.frames
+        self.resampler = soxr.ResampleStream(info.samplerate, ANALYSIS_RATE, 1, dtype="float32") \
+            if info.samplerate != ANALYSIS_RATE else None
+        self.decoded = 0
+        self.parts = []
+
+    def advance(self, contiguous):
+        available = min(self.frames, max(0, contiguous - self.data_offset) // self.frame_bytes)
+        while self.decoded < available:
+            n = min(DECODE_FRAMES, available - self.decoded)
+            self.file.seek(self.decoded)
+            block = self.file.read(n, dtype="float32", always_2d=True).mean(axis=1)
+            self.parts.append(self.resampler.resample_chunk(block) if self.resampler else block)
+            self.decoded += n
+
+    def finish(self):
+        self.advance(self.data_offset + self.frames * self.frame_bytes)
+        if self.resampler:
+            self.parts.append(self.resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+        self.file.close()
+        return np.concatenate(self.parts), ANALYSIS_RATE
+
+class Upload:
+    """
+    One upload of `size` bytes to `path`. `sha1`, if given, is checked against
+    the whole file once it is in; inputs longer than `max_duration` seconds are
+    refused as soon as their header arrives.
+    """
+
+    def __init__(self, path, size, sha1=None, filename=None, max_duration=None):
+        self.id = os.path.splitext(os.path.basename(path))[0]
+        self.path = path
+        self.size = size
+        self.sha1 = sha1.lower() if sha1 else None
+        self.filename = filename
+        self.max_duration = max_duration
+        self.received = []
+        self.cond = threading.Condition()
+        self.touched = time.time()
+        self.info = None
+        self.error = None
+        self.digest = None
+        self.audio = None # (y, sr) once a WAV upload is in
+        self.decoded_s = 0.0
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self._ingest = threading.Thread(target=self._run_ingest, name=f"ingest-{self.id}", daemon=True)
+        self._ingest.start()
+
+    def contiguous(self):
+        return self.received[0][1] if self.received and self.received[0][0] == 0 else 0
+
+    def write(self, offset, stream, length, chunk_sha1=None):
+        """
+        Copies `length` bytes of `stream` to `offset`. The range only counts as
+        received once all of it is written (and matches chunk_sha1, if given).
+        """
+        if self.error:
+            raise UploadError(self.error, 413)
+        if offset < 0 or length <= 0 or offset + length > self.size:
+            raise UploadError(f"Chunk {offset}+{length} is outside the {self.size}-byte upload", 416)
+        self.touched = time.time()
+        h = hashlib.sha1() if chunk_sha1 else None
+        written = 0
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            while written < length:
+                data = stream.read(min(COPY_SIZE, length - written))
+                if not data:
+                    break
+                os.pwrite(fd, data, offset + written)
+                if h:
+                    h.update(data)
+                written += len(data)
+        finally:
+            os.close(fd)
+        if written < length:
+            raise UploadError(f"Chunk ended after {written} of {length} bytes; send it again")
+        if h and h.hexdigest() != chunk_sha1.lower():
+            raise UploadError("Chunk checksum mismatch; send it again", 422)
+        with self.cond:
+            self.received = merge_range(self.received, offset, offset + length)
+            self.cond.notify_all()
+        return self.status()
+
+    def missing(self):
+        gaps, pos = [], 0
+        for start, end in self.received:
+            if start > pos:
+                gaps.append((pos, start))
+            pos = end
+        if pos < self.size:
+            gaps.append((pos, self.size))
+        return gaps
+
+    def wait(self, timeout=None):
+        """Blocks until every byte is in and hashed (and decoded, for WAV); False on timeout."""
+        self._ingest.join(timeout)
+        return not self._ingest.is_alive()
+
+    def verified(self):
+        return self.digest is not None and self.sha1 in (None, self.digest)
+
+    def take_audio(self):
+        """
+        The signal decoded while the upload arrived, handed to the first job that
+        asks for it; later jobs read the file. Kept here, it would stay in memory,
+        outside the admission budget, for as long as the upload is.
+        """
+        with self.cond:
+            audio, self.audio = self.audio, None
+        return audio
+
+    def status(self):
+        with self.cond:
+            received = sum(end - start for start, end in self.received)
+            return {
+                "id": self.id,
+                "filename": self.filename,
+                "size": self.size,
+                "received_bytes": received,
+                "missing": [list(gap) for gap in self.missing()],
+                "complete": received == self.size,
+                "sha1": self.digest,
+                "verified": self.verified(),
+                "audio": self.info,
+                "decoded_s": self.decoded_s,
+                "error": self.error,
+            }
+
+    def _fail(self, message):
+        with self.cond:
+            self.error = message
+            self.cond.notify_all()
+
+    def _parse_header(self):
+        try:
+            info = sf.info(self.path)
+        except RuntimeError:
+            return None
+        self.info = {"samplerate": info.samplerate, "channels": info.channels, "duration": info.duration,
+                     "format": info.format, "subtype": info.subtype}
+        if self.max_duration and info.duration > self.max_duration:
+            self._fail(f"Input is {info.duration:.0f}s long; the limit is {self.max_duration:.0f}s")
+        return info
+
+    def _run_ingest(self):
+        h = hashlib.sha1()
+        hashed = 0
+        info = decoder = None
+        # Unbuffered: a buffered reader could serve the preallocated zeros it read ahead
+        with open(self.path, "rb", buffering=0) as f:
+            while hashed < self.size:
+                with self.cond:
+                    while self.contiguous() <= hashed and not self.error:
+                        self.cond.wait()
+                    if self.error:
+                        return
+                    ready = self.contiguous()
+                f.seek(hashed)
+                while hashed < ready:
+                    data = f.read(min(COPY_SIZE, ready - hashed))
+                    h.update(data)
+                    hashed += len(data)
+
+                if info is None and ready >= min(self.size, HEADER_BYTES):
+                    info = self._parse_header()
+                    if self.error:
+                        return
+                    offset = wav_data_offset(self.path) if info is not None else None
+                    if offset is not None and info.subtype in SAMPLE_BYTES:
+                        decoder = StreamingDecoder(self.path, info, offset)
+                if decoder:
+                    decoder.advance(ready)
+                    self.decoded_s = decoder.decoded / info.samplerate
+        self.digest = h.hexdigest()
+        if self.sha1 and self.digest != self.sha1:
+            self._fail("Checksum mismatch; the upload has to start over")
+        elif decoder:
+            self.audio = decoder.finish()
+
+class UploadManager:
+    def __init__(self, folder, max_bytes, max_duration=None, ttl=UPLOAD_TTL):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_duration = max_duration
+        self.ttl = ttl
+        self.uploads = {}
+        self.lock = threading.Lock()
+
+    def create(self, size, sha1=None, filename=None):
+        if size <= 0:
+            raise UploadError("Upload size must be positive")
+        if size > self.max_bytes:
+            raise UploadError(f"Upload is {size >> 20} MB; the limit is {self.max_bytes >> 20} MB", 413)
+        self.prune()
+        os.makedirs(self.folder, exist_ok=True)
+        path = os.path.join(self.folder, f"{uuid.uuid4().hex}.part")
+        upload = Upload(path, size, sha1, filename, self.max_duration)
+        with self.lock:
+            self.uploads[upload.id] = upload
+        return upload
+
+    def get(self, upload_id):
+        with self.lock:
+            upload = self.uploads.get(upload_id)
+        if upload is None:
+            raise UploadError(f"Unknown upload '{upload_id}'", 404)
+        return upload
+
+    def discard(self, upload_id):
+        with self.lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload:
+            if upload.error is None:
+                upload._fail("Upload discarded")
+            if os.path.exists(upload.path):
+                os.remove(upload.path)
+
+    def prune(self):
+        """Drops uploads nobody has touched for `ttl` seconds."""
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            stale = [i for i, upload in self.uploads.items() if upload.touched < cutoff]
+        for upload_id in stale:
+            self.discard(upload_id)